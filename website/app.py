@@ -109,8 +109,9 @@ def create_app(config_filename='config.py', config_override={}):
     db.create_all(bind=list(app.config.get('SQLALCHEMY_BINDS')))
 
     readonly = app.config.get('HDB_READONLY', False)
-    bdb.open(app.config['HDB_DNA_TO_PROTEIN_PATH'], readonly=readonly)
-    bdb_refseq.open(app.config['HDB_GENE_TO_ISOFORM_PATH'], readonly=readonly)
+    dupsort = app.config.get('HDB_DUPSORT', False)
+    bdb.open(app.config['HDB_DNA_TO_PROTEIN_PATH'], readonly=readonly, dupsort=dupsort)
+    bdb_refseq.open(app.config['HDB_GENE_TO_ISOFORM_PATH'], readonly=readonly, dupsort=dupsort)
 
     if app.config['USE_LEVENSTHEIN_MYSQL_UDF']:
         with app.app_context():
@@ -1,9 +1,13 @@
+from tempfile import NamedTemporaryFile
+from typing import Iterable, List, Sequence
 from warnings import warn
 
-from sqlalchemy import func
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import func, inspect, text, LargeBinary
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError, OperationalError
 
 from database import db, get_engine
+from database.migrate import disabled_constraints
 from helpers.parsers import chunked_list
 
 
@@ -32,18 +36,132 @@ def get_highest_id(model):
         return db.session.query(func.max(model.id)).scalar() or 0
 
 
-def bulk_orm_insert(model, keys, data):
-    # note: it is also possible to use a lower-level "bulk_raw_insert"
-    # (search in repository at 27c516d218e33b82fbb9b08a8dfafd1093dc7978)
-    for chunk in chunked_list(data):
-        db.session.bulk_insert_mappings(
-            model,
-            [
-                dict(zip(keys, entry))
-                for entry in chunk
-            ]
+class BulkWriter:
+    """Strategy of inserting many rows into a table at once."""
+
+    def supports(self, connection: Connection, columns) -> bool:
+        raise NotImplementedError
+
+    def write(self, connection: Connection, table, columns, rows: Iterable[Sequence]):
+        raise NotImplementedError
+
+
+class ExecuteManyWriter(BulkWriter):
+    """Inserts chunks of rows with a single Core INSERT statement each (executemany)."""
+
+    chunk_size = 10000
+
+    def supports(self, connection, columns):
+        return True
+
+    def write(self, connection, table, columns, rows):
+        keys = [column.key for column in columns]
+        statement = table.insert()
+        for chunk in chunked_list(rows, chunk_size=self.chunk_size, progress=False):
+            connection.execute(statement, [dict(zip(keys, row)) for row in chunk])
+
+
+class LoadDataWriter(BulkWriter):
+    """Streams rows as tab-separated values into MySQL's LOAD DATA LOCAL INFILE.
+
+    The client has to allow local infile (e.g. `local_infile=1` in connect_args
+    of the engine); if the server or the client refuses, rows are inserted
+    with the executemany writer instead.
+    """
+
+    # number of rows in a single loaded file
+    chunk_size = 1000000
+
+    escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+    def supports(self, connection, columns):
+        if connection.dialect.name != 'mysql':
+            return False
+        # binary values (e.g. pickles) are not streamed as text
+        if any(isinstance(getattr(column.type, 'impl', column.type), LargeBinary) for column in columns):
+            return False
+        # Python-side defaults would not be applied to the omitted columns
+        names = {column.name for column in columns}
+        return not any(
+            column.default is not None
+            for column in columns[0].table.columns
+            if column.name not in names
         )
-        db.session.flush()
+
+    def format(self, value) -> str:
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        return str(value).translate(self.escapes)
+
+    def write(self, connection, table, columns, rows):
+        processors = [column.type.bind_processor(connection.dialect) for column in columns]
+        names = ', '.join(f'`{column.name}`' for column in columns)
+        load = text(
+            f"LOAD DATA LOCAL INFILE :path INTO TABLE `{table.name}` CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({names})"
+        )
+        chunks = chunked_list(rows, chunk_size=self.chunk_size, progress=False)
+
+        with disabled_constraints(connection):
+            for chunk in chunks:
+                with NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8') as f:
+                    for row in chunk:
+                        f.write('\t'.join(
+                            self.format(processor(value) if processor else value)
+                            for processor, value in zip(processors, row)
+                        ))
+                        f.write('\n')
+                    f.flush()
+                    try:
+                        connection.execute(load, path=f.name)
+                    except DBAPIError as e:
+                        warn(f'LOAD DATA LOCAL INFILE failed ({e.orig}), falling back to executemany')
+                        ExecuteManyWriter().write(connection, table, columns, chunk)
+                        break
+            else:
+                return
+
+            # insert the remaining chunks without retrying the failed method
+            for chunk in chunks:
+                ExecuteManyWriter().write(connection, table, columns, chunk)
+
+
+# the first writer supporting given connection and columns is used
+bulk_writers: List[BulkWriter] = [LoadDataWriter(), ExecuteManyWriter()]
+
+
+def bulk_insert(model, keys, data):
+    """Insert rows of data into the table of given model, bypassing the ORM.
+
+    Args:
+        model: the model to insert the rows for
+        keys: names of the attributes (of the model) in the order of values in rows
+        data: iterable of rows (sequences of values)
+
+    The rows are inserted within the transaction of the current session
+    (pending changes are flushed first) with the first of `bulk_writers`
+    which supports the database engine.
+    """
+    mapper = inspect(model)
+    columns = [mapper.column_attrs[key].columns[0] for key in keys]
+
+    db.session.flush()
+    connection = db.session.connection(mapper=mapper)
+
+    writer = choose_writer(connection, columns)
+    writer.write(connection, mapper.local_table, columns, data)
+
+
+def choose_writer(connection: Connection, columns) -> BulkWriter:
+    """Get the first of `bulk_writers` supporting given connection and columns."""
+    return next(
+        writer
+        for writer in bulk_writers
+        if writer.supports(connection, columns)
+    )
 
 
 def get_autoincrement(model):
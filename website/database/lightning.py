@@ -1,39 +1,215 @@
+import os
+import threading
+from contextlib import contextmanager
+
 import lmdb
 
 
+class LightningReader:
+    """Read-only session reusing a single lmdb transaction.
+
+    Use `LightningInterface.reader()` to create one.
+
+    For `dupsort` databases a value is the list of all
+    (sorted) duplicate values stored under the key.
+    """
+
+    def __init__(self, transaction, dupsort=False):
+        self.transaction = transaction
+        self.dupsort = dupsort
+
+    def get(self, key, default=None):
+        if self.dupsort:
+            return self._get_duplicates(self.transaction.cursor(), key, default)
+        return self.transaction.get(key, default=default)
+
+    def get_many(self, keys, default=None) -> list:
+        """Return values for given keys (in the same order as keys)."""
+        if self.dupsort:
+            cursor = self.transaction.cursor()
+            return [self._get_duplicates(cursor, key, default) for key in keys]
+        get = self.transaction.get
+        return [get(key, default=default) for key in keys]
+
+    @staticmethod
+    def _get_duplicates(cursor, key, default):
+        if not cursor.set_key(key):
+            return default
+        return list(cursor.iternext_dup())
+
+    def _iterate_from(self, cursor):
+        """Yield (key, value) pairs starting from the current position of the cursor."""
+        if not self.dupsort:
+            yield from cursor.iternext()
+            return
+        while True:
+            key = cursor.key()
+            yield key, list(cursor.iternext_dup())
+            if not cursor.next_nodup():
+                break
+
+    def __getitem__(self, item):
+        return self.get(item)
+
+    def __contains__(self, item):
+        indicator = object()
+        return self.transaction.get(item, default=indicator) is not indicator
+
+    def __len__(self):
+        if self.dupsort:
+            # entries count all the duplicates; count distinct keys instead
+            cursor = self.transaction.cursor()
+            return sum(1 for _ in cursor.iternext_nodup(values=False))
+        return self.transaction.stat()['entries']
+
+    def items(self):
+        cursor = self.transaction.cursor()
+        if not cursor.first():
+            return
+        yield from self._iterate_from(cursor)
+
+    def iterate_range(self, start=b'', end=None):
+        """Yield (key, value) pairs with keys in [start, end) range, in sorted order.
+
+        If `end` is None, iterates until the last key.
+        """
+        cursor = self.transaction.cursor()
+        if not cursor.set_range(start):
+            return
+        for k, v in self._iterate_from(cursor):
+            if end is not None and k >= end:
+                break
+            yield k, v
+
+    def iterate_prefix(self, prefix):
+        """Yield (key, value) pairs for keys starting with `prefix`, in sorted order."""
+        for k, v in self.iterate_range(prefix):
+            if not k.startswith(prefix):
+                break
+            yield k, v
+
+
 class LightningInterface:
-    """Minimal, pythonic interface for lmdb"""
+    """Minimal, pythonic interface for lmdb
+
+    The environment is re-opened transparently when used from a forked
+    process (e.g. a pre-forked gunicorn worker), as lmdb environments
+    must not be shared across `fork()`.
+
+    With `dupsort=True` the data are kept in a sub-database where each
+    key can hold many (sorted) values; see `add_many` to add values
+    without reading the values already stored under the same key.
+    """
 
-    def __init__(self, path, **kwargs):
+    def __init__(self, path, dupsort=False, **kwargs):
         self.path = path
-        self.env = lmdb.Environment(str(self.path), max_dbs=1, **kwargs)
+        self.dupsort = dupsort
+        self.kwargs = kwargs
+        self._open()
+
+    def _open(self):
+        self._env = lmdb.Environment(str(self.path), max_dbs=1, **self.kwargs)
+        if self.dupsort:
+            self._db = self._env.open_db(b'sets', dupsort=True, create=not self.kwargs.get('readonly'))
+        else:
+            # the main database
+            self._db = None
+        self._pid = os.getpid()
+        self._local = threading.local()
+
+    @property
+    def env(self) -> lmdb.Environment:
+        if self._pid != os.getpid():
+            # do not close the inherited environment: it belongs to the parent
+            self._open()
+        return self._env
+
+    def begin(self, write=False) -> lmdb.Transaction:
+        """Begin a transaction on the database (see `lmdb.Environment.begin`)."""
+        return self.env.begin(db=self._db, write=write)
+
+    @contextmanager
+    def reader(self):
+        """Open a read session which reuses one transaction for all reads.
+
+        While the session is active, reads done in the same thread
+        through this interface (e.g. `get` or `in`) will use it too.
+        Nested calls reuse the outermost session. All reads within
+        the session see the snapshot taken when the session started
+        (also the values written in the meantime are not visible).
+
+        Example:
+            with db.reader() as reader:
+                values = reader.get_many(keys)
+        """
+        active_reader = getattr(self._local, 'reader', None)
+        if active_reader is not None:
+            yield active_reader
+            return
+
+        with self.begin() as transaction:
+            self._local.reader = LightningReader(transaction, dupsort=self.dupsort)
+            try:
+                yield self._local.reader
+            finally:
+                self._local.reader = None
+
+    @contextmanager
+    def _reading(self):
+        """Read within the active session (see `reader`) or within a new, private transaction."""
+        active_reader = getattr(self._local, 'reader', None)
+        if active_reader is not None:
+            yield active_reader
+            return
+
+        with self.begin() as transaction:
+            yield LightningReader(transaction, dupsort=self.dupsort)
 
     def get(self, key, default=None):
-        with self.env.begin() as transaction:
-            return transaction.get(key, default=default)
+        with self._reading() as reader:
+            return reader.get(key, default=default)
+
+    def get_many(self, keys, default=None):
+        with self._reading() as reader:
+            return reader.get_many(keys, default=default)
 
     def items(self):
-        with self.env.begin() as transaction:
-            cursor = transaction.cursor()
-            for k, v in cursor:
-                yield k, v
+        with self._reading() as reader:
+            yield from reader.items()
+
+    def iterate_range(self, start=b'', end=None):
+        with self._reading() as reader:
+            yield from reader.iterate_range(start, end)
+
+    def iterate_prefix(self, prefix):
+        with self._reading() as reader:
+            yield from reader.iterate_prefix(prefix)
 
     def __setitem__(self, key, value):
-        with self.env.begin(write=True) as transaction:
+        """For `dupsort` databases `value` is a list of values replacing the stored ones."""
+        with self.begin(write=True) as transaction:
+            if self.dupsort:
+                transaction.delete(key)
+                return transaction.cursor().putmulti((key, v) for v in value)
             return transaction.put(key, value)
 
+    def add_many(self, items):
+        """Add (key, value) pairs to a `dupsort` database, keeping the values already stored."""
+        assert self.dupsort
+        with self.begin(write=True) as transaction:
+            return transaction.cursor().putmulti(items)
+
     def __getitem__(self, item):
-        with self.env.begin() as transaction:
-            return transaction.get(item)
+        with self._reading() as reader:
+            return reader[item]
 
     def __len__(self):
-        with self.env.begin() as transaction:
-            return transaction.stat()['entries']
+        with self._reading() as reader:
+            return len(reader)
 
     def __contains__(self, item):
-        indicator = object()
-        with self.env.begin() as transaction:
-            return transaction.get(item, default=indicator) is not indicator
+        with self._reading() as reader:
+            return item in reader
 
     def close(self):
         self.env.close()
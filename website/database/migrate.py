@@ -1,5 +1,6 @@
 import csv
 import re
+from contextlib import contextmanager
 from warnings import warn
 
 from database import db
@@ -48,6 +49,24 @@ def set_unique_checks(engine, active=True):
     return True
 
 
+@contextmanager
+def disabled_constraints(engine):
+    """Disable foreign key and unique checks within the context (if supported).
+
+    The checks are session-scoped, so pass a connection (rather than an engine)
+    to disable these for the statements executed on this very connection.
+    """
+    foreign_keys_disabled = set_foreign_key_checks(engine, active=False)
+    unique_disabled = set_unique_checks(engine, active=False)
+    try:
+        yield
+    finally:
+        if unique_disabled:
+            set_unique_checks(engine, active=True)
+        if foreign_keys_disabled:
+            set_foreign_key_checks(engine, active=True)
+
+
 def get_column_names(table):
     return set((i.name for i in table.c))
 
@@ -40,6 +40,9 @@ SQLALCHEMY_TRACK_MODIFICATIONS = True
 HDB_DNA_TO_PROTEIN_PATH = 'databases/dna_to_protein/'
 HDB_GENE_TO_ISOFORM_PATH = 'databases/gene_to_isoform/'
 HDB_READONLY = False
+# store each element of a set as a separate value (lmdb dupsort) rather than
+# as a single packed value; requires re-import of the mappings when changed
+HDB_DUPSORT = False
 
 # -Application settings
 # counting everything in the database in order to prepare statistics might be
@@ -48,6 +51,21 @@ LOAD_STATS = True
 CONTACT_LIST = ['some_maintainer@domain.org', 'other_maintainer@domain.org']
 LOGS_PATH = 'logs/app.log'
 
+# Cache of compressed protein/network representations (invalidated after each import);
+# sizes are given in bytes, the least recently used responses are evicted first.
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MEMORY_LIMIT = 256 * 1024 * 1024
+RESPONSE_CACHE_DISK_LIMIT = 4 * 1024 * 1024 * 1024
+
+# In-memory index of genes, proteins, diseases, etc. used by the search bar (instead of LIKE queries).
+# For searches restricted with filters, the ids of at most SEARCH_INDEX_MAX_CANDIDATES
+# matched rows will be passed to SQL; otherwise LIKE query will be used.
+SEARCH_INDEX_ENABLED = True
+SEARCH_INDEX_MAX_CANDIDATES = 1000
+
+# For how long (in seconds) should the total number of rows in paginated tables be re-used (0 to disable)
+TABLE_COUNT_CACHE_TTL = 600
+
 # Should the system load local copies of third party dependencies or use content delivery networks?
 #
 USE_CONTENT_DELIVERY_NETWORK = True
@@ -95,3 +113,6 @@ CELERY_IGNORE_RESULT = False
 CELERY_SECURITY_KEY = '../celery/worker.key'
 CELERY_SECURITY_CERTIFICATE = '../celery/worker.crt'
 CELERY_SECURITY_CERT_STORE = '../celery/*.crt'
+# uploads searched by celery workers are saved there (None for the temporary directory);
+# the directory has to be shared with the workers
+SEARCH_UPLOAD_FOLDER = None
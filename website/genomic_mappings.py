@@ -1,12 +1,29 @@
-from typing import List, TYPE_CHECKING
+from collections import namedtuple
+from string import ascii_letters
+from itertools import islice
+from struct import Struct, error as struct_error
+from typing import List, TYPE_CHECKING, Iterable, Tuple, Iterator, Set, Dict, Optional
 
-from hash_set_db import HashSetWithCache
+from hash_set_db import HashSetWithCache, FixedWidthSetFormat, require_open
+from helpers.parsers import chunked_list
 
 if TYPE_CHECKING:
     from search.mutation_result import SearchResult
 
+# chrom, dna_pos, dna_ref, dna_alt
+SNV = Tuple[str, int, str, str]
+
 
 class GenomicMappings(HashSetWithCache):
+    """Mappings: genomic mutation (snv) -> set of Coding Sequence Variants.
+
+    Values are stored as sets of fixed-width binary records (see `encode_record`);
+    values written in the legacy text format (see `encode_csv`) remain readable.
+    """
+
+    def __init__(self, name=None):
+        value_format = FixedWidthSetFormat(record_struct.size, from_text=record_from_csv)
+        super().__init__(name=name, value_format=value_format)
 
     def add_genomic_mut(self, chrom, dna_pos, dna_ref, dna_alt, aa_mut, strand='+', exon='EX1', is_ptm=False):
         """Add a genomic mutation mapping to provided 'mut' aminoacid mutation.
@@ -15,12 +32,12 @@ class GenomicMappings(HashSetWithCache):
         it for full-database imports as it *may* be hugely inefficient.
         """
         snv = make_snv_key(chrom, dna_pos, dna_ref, dna_alt)
-        csv = encode_csv(
+        record = encode_record(
             strand, aa_mut.ref, aa_mut.alt, cdna_pos_from_aa(aa_mut.position),
             exon, aa_mut.protein.id, is_ptm
         )
 
-        self.add(snv, csv)
+        self.add(snv, record)
 
     def get_genomic_muts(self, chrom, dna_pos, dna_ref, dna_alt) -> List['SearchResult']:
         """Returns aminoacid mutations meeting provided criteria.
@@ -39,64 +56,311 @@ class GenomicMappings(HashSetWithCache):
         Returns:
             list of items where each item contains Mutation object and additional metadata
         """
-        from search.mutation_result import SearchResult
+        return self.get_genomic_muts_bulk([(chrom, dna_pos, dna_ref, dna_alt)])[0]
 
-        from models import Protein, Mutation
-        from database import get_or_create
+    def get_genomic_muts_bulk(self, snvs: Iterable[Tuple[str, str, str, str]]) -> List[List['SearchResult']]:
+        """Returns aminoacid mutations for each of provided genomic mutations.
 
-        snv = make_snv_key(chrom, dna_pos, dna_ref, dna_alt)
+        Bulk equivalent of `get_genomic_muts`: all the keys are read within
+        a single LMDB transaction, then proteins and already known mutations
+        are fetched with a few `IN (...)` queries (rather than with one query
+        per each decoded mapping).
 
-        items = [
-            decode_csv(item)
-            for item in self[snv]
-        ]
+        Args:
+            snvs: iterable of (chrom, dna_pos, dna_ref, dna_alt) tuples,
+                  see `get_genomic_muts` for description of the fields
 
-        # this could be speed up by: itemgetters, accumulative queries and so on
-        results = []
+        Returns:
+            list of lists of SearchResult (one list per each of provided snvs,
+            in the order of the input); a list is empty if there is no mapping
+        """
+        keys = []
+        for snv in snvs:
+            try:
+                keys.append(make_snv_key(*snv))
+            except ValueError:
+                # such a mutation cannot have any mapping
+                keys.append(None)
+
+        if not keys:
+            return []
+
+        with self.db.reader() as reader:
+            values = reader.get_many(key for key in keys if key is not None)
+
+        unpack = self.unpack
+        values = iter(values)
+        items_by_snv = []
+        for key in keys:
+            value = next(values) if key is not None else None
+            items_by_snv.append(
+                list(map(decode_record, unpack(value))) if value else []
+            )
+
+        return self._make_search_results(items_by_snv)
+
+    def iter_region(self, chrom, start: int, end: int) -> Iterator[Tuple[SNV, List['MappingRecord']]]:
+        """Yield mappings of all genomic mutations located within given window, in genomic order.
+
+        Args:
+            chrom: chromosome identifier, without 'chr' prefix
+            start: first position of the window
+            end: last position of the window (inclusive)
+
+        Yields:
+            ((chrom, dna_pos, dna_ref, dna_alt), list of MappingRecord) tuples
+        """
+        code = chromosome_codes[chrom]
+        first_key = snv_key_struct.pack(code, start)
+        # keys of the following position (or of the following chromosome)
+        after_last_key = snv_key_struct.pack(code, end + 1) if end < 2 ** 32 - 1 else bytes((code + 1,))
+
+        unpack = self.unpack
+        for key, value in self.db.iterate_range(first_key, after_last_key):
+            yield decode_snv_key(key), list(map(decode_record, unpack(value)))
+
+    def get_region_mutation_ids(self, chrom, start: int, end: int) -> List[Tuple[SNV, List[int]]]:
+        """Returns identifiers of known aminoacid mutations for all genomic mutations within given window.
+
+        Only mutations present in the database are included; these
+        are looked up in bulk, without creating any ORM instances.
+        See `iter_region` for description of arguments.
+
+        Returns:
+            list of ((chrom, dna_pos, dna_ref, dna_alt), list of mutation ids) tuples,
+            in genomic order
+        """
+        region = [
+            (snv, [(item.protein_id, item.pos, item.alt) for item in items])
+            for snv, items in self.iter_region(chrom, start, end)
+        ]
+        ids = fetch_mutations(
+            {key for snv, keys in region for key in keys},
+            ids_only=True
+        )
+        return [
+            (snv, [ids[key] for key in keys if key in ids])
+            for snv, keys in region
+        ]
 
-        for item in items:
+    def _make_search_results(self, items_by_snv: List[List['MappingRecord']]) -> List[List['SearchResult']]:
+        from search.mutation_result import SearchResult
+        from models import Protein, Mutation
 
-            protein = Protein.query.get(item['protein_id'])
-            mutation, created = get_or_create(
-                Mutation,
-                protein=protein,
-                protein_id=protein.id,  # TODO: should use either protein or protein_id
-                position=item['pos'],
-                alt=item['alt']
+        proteins_ids = {
+            item.protein_id
+            for items in items_by_snv
+            for item in items
+        }
+        proteins = {}
+        for chunk in chunked_list(proteins_ids, chunk_size=500, progress=False):
+            proteins.update(
+                (protein.id, protein)
+                for protein in Protein.query.filter(Protein.id.in_(chunk))
             )
-            results.append(
-                SearchResult(
-                    protein=protein,
-                    mutation=mutation,
-                    is_mutation_novel=created,
-                    type='genomic',
-                    **item
+
+        mutation_keys = {
+            (item.protein_id, item.pos, item.alt)
+            for items in items_by_snv
+            for item in items
+        }
+        mutations = fetch_mutations(mutation_keys)
+
+        # mutations which are not in the database yet (the same novel
+        # mutation may be reached from more than one genomic mutation)
+        novel_mutations = set()
+        results = []
+
+        for items in items_by_snv:
+            snv_results = []
+
+            for item in items:
+                protein = proteins[item.protein_id]
+                key = (protein.id, item.pos, item.alt)
+
+                if key not in mutations:
+                    mutations[key] = Mutation(
+                        protein=protein,
+                        protein_id=protein.id,
+                        position=item.pos,
+                        alt=item.alt
+                    )
+                    novel_mutations.add(key)
+
+                snv_results.append(
+                    SearchResult(
+                        protein=protein,
+                        mutation=mutations[key],
+                        is_mutation_novel=key in novel_mutations,
+                        type='genomic',
+                        **item._asdict()
+                    )
                 )
-            )
+            results.append(snv_results)
 
         return results
 
-    def iterate_known_muts(self):
-        from models import Mutation
-        from tqdm import tqdm
+    @staticmethod
+    def decode_key(key: bytes):
+        return decode_snv_key(key)
+
+    @require_open
+    def convert_format(self, batch_size=10000) -> int:
+        """Rewrite legacy text keys and values into the current, binary formats, in place.
+
+        The legacy keys sort after all binary keys, so these are always
+        read from the end of the database, converted and then removed.
+
+        Returns:
+            number of converted entries
+        """
+        if self.dupsort:
+            # legacy keys can be only found in the packed layout
+            return 0
 
-        for value in tqdm(self.values(), total=len(self.db)):
-            for item in map(decode_csv, value):
+        pack = self.format.pack
+        unpack = self.format.unpack
+        first_legacy_key = bytes((len(chromosomes_order) + 1,))
 
-                mutation = Mutation.query.filter_by(
-                    protein_id=item['protein_id'],
-                    position=item['pos'],
-                    alt=item['alt']
-                ).first()
+        converted = 0
 
+        while True:
+            with self.db.begin(write=True) as transaction:
+                cursor = transaction.cursor()
+                if not cursor.set_range(first_legacy_key):
+                    break
+                batch = list(islice(cursor.iternext(), batch_size))
+                for key, value in batch:
+                    transaction.put(make_snv_key(*decode_legacy_snv_key(key)), pack(set(unpack(value))))
+                    transaction.delete(key)
+            converted += len(batch)
+
+        # values with binary keys which are still in an outdated format
+        return converted + super().convert_format(batch_size)
+
+    def iterate_known_muts(self, ids_only=False, chunk_size=10000, processes=1):
+        """Yield known mutations (those in the relational database) reachable from the genomic mappings.
+
+        A mutation is yielded once per each mapping item leading to it, as in the database.
+        The mapping items are read in chunks of `chunk_size` and each chunk is resolved
+        with a few `IN (...)` queries (see `fetch_mutations`).
+
+        Args:
+            ids_only: yield identifiers of mutations rather than Mutation objects
+            chunk_size: number of mapping items to resolve at once
+            processes: number of worker processes; the key space is partitioned
+                by chromosome (requires `ids_only` as the results are passed
+                between processes; the order of results is not preserved)
+        """
+        if processes > 1:
+            if not ids_only:
+                raise ValueError('Mutation objects cannot be passed between processes, use ids_only')
+
+            from multiprocessing import get_context
+
+            # workers inherit the application state and the open environment (passed
+            # to the initializer without pickling), which requires the fork start method
+            pool = get_context('fork').Pool(processes, initializer=_init_known_muts_worker, initargs=(self,))
+
+            with pool:
+                tasks = [(start, end, chunk_size) for start, end in key_space_partitions()]
+                for ids in pool.imap_unordered(_known_muts_ids_in_range, tasks):
+                    yield from ids
+            return
+
+        from tqdm import tqdm
+
+        items = self.db.items()
+        yield from self._known_muts(
+            tqdm(items, total=len(self.db)),
+            ids_only, chunk_size
+        )
+
+    def _known_muts(self, items: Iterable[Tuple[bytes, bytes]], ids_only, chunk_size):
+        unpack = self.unpack
+        mutation_keys = (
+            (record.protein_id, record.pos, record.alt)
+            for key, value in items
+            for record in map(decode_record, unpack(value))
+        )
+        for chunk in iter(lambda: list(islice(mutation_keys, chunk_size)), []):
+            mutations = fetch_mutations(set(chunk), ids_only=ids_only)
+            for key in chunk:
+                mutation = mutations.get(key)
                 if mutation:
                     yield mutation
 
 
-def make_snv_key(chrom, pos, ref, alt):
+def fetch_mutations(mutation_keys: Set[Tuple[int, int, str]], ids_only=False, chunk_size=300) -> Dict:
+    """Fetch mutations identified by (protein_id, position, alt) keys.
+
+    Mutations are selected in chunks, by protein identifiers and positions,
+    with exact matches picked in Python (row-value `IN` is not supported
+    by all of the database backends).
+
+    Returns:
+        dict: key -> Mutation (or mutation id, with `ids_only`), for keys of known mutations
+    """
+    from database import db
+    from models import Mutation
+
+    columns = [Mutation.protein_id, Mutation.position, Mutation.alt]
+    columns.append(Mutation.id if ids_only else Mutation)
+
+    mutations = {}
+    for chunk in chunked_list(mutation_keys, chunk_size=chunk_size, progress=False):
+        query = db.session.query(*columns).filter(
+            Mutation.protein_id.in_({protein_id for protein_id, pos, alt in chunk}),
+            Mutation.position.in_({pos for protein_id, pos, alt in chunk})
+        )
+        for protein_id, position, alt, mutation in query:
+            key = (protein_id, position, alt)
+            if key in mutation_keys:
+                mutations[key] = mutation
+    return mutations
+
+
+def key_space_partitions() -> List[Tuple[bytes, Optional[bytes]]]:
+    """Ranges of keys: one for each of the chromosomes, and one for (remaining) legacy keys."""
+    codes = range(1, len(chromosomes_order) + 1)
+    partitions = [(bytes((code,)), bytes((code + 1,))) for code in codes]
+    partitions.append((bytes((len(chromosomes_order) + 1,)), None))
+    return partitions
+
+
+_worker_mappings: GenomicMappings = None
+
+
+def _init_known_muts_worker(mappings: GenomicMappings):
+    from database import db
+    global _worker_mappings
+    _worker_mappings = mappings
+    # connections inherited from the parent process must not be reused
+    db.engine.dispose()
+
+
+def _known_muts_ids_in_range(task) -> List[int]:
+    start, end, chunk_size = task
+    mappings = _worker_mappings
+    items = mappings.db.iterate_range(start, end)
+    return list(mappings._known_muts(items, ids_only=True, chunk_size=chunk_size))
+
+
+# chromosome code, position (big-endian, so that the keys sort in genomic order)
+snv_key_struct = Struct('>BI')
+
+chromosomes_order = [str(x) for x in range(1, 23)] + ['X', 'Y', 'MT']
+chromosome_codes = {chrom: code for code, chrom in enumerate(chromosomes_order, start=1)}
+
+
+def make_snv_key(chrom, pos, ref, alt) -> bytes:
     """Makes a key for given `snv` (Single Nucleotide Variation)
     to be used as a key in hashmap in snv -> csv mappings.
 
+    The keys are ordered as the genomic coordinates are: by chromosome
+    (in `chromosomes_order`), then by position, so that all mutations
+    from a genomic window can be read with a single range scan.
+
     Args:
         chrom:
             str representing one of human chromosomes
@@ -108,10 +372,35 @@ def make_snv_key(chrom, pos, ref, alt):
             char representing reference nucleotide
         alt:
             char representing alternative nucleotide
+
+    Raises:
+        ValueError: if the chromosome or the position is not valid
+    """
+    try:
+        code = chromosome_codes[chrom]
+    except KeyError:
+        raise ValueError(f'Unknown chromosome: {chrom}')
+    try:
+        prefix = snv_key_struct.pack(code, int(pos))
+    except struct_error:
+        raise ValueError(f'Position out of range: {pos}')
+    return prefix + bytes(ref.lower() + alt.lower(), 'utf-8')
+
+
+def decode_snv_key(key: bytes) -> SNV:
+    """Decode (chrom, pos, ref, alt) from a key made by `make_snv_key`.
+
+    Alleles are returned in upper case.
     """
-    return ':'.join(
-        (chrom, '%x' % int(pos))
-    ) + ref.lower() + alt.lower()
+    code, pos = snv_key_struct.unpack_from(key)
+    alleles = key[snv_key_struct.size:].decode().upper()
+    return chromosomes_order[code - 1], pos, alleles[:-1], alleles[-1:]
+
+
+def decode_legacy_snv_key(key: bytes) -> SNV:
+    """Decode (chrom, pos, ref, alt) from a legacy, text key ('chrom:hexpos' + ref + alt)."""
+    chrom, rest = key.decode().split(':')
+    return chrom, int(rest[:-2], 16), rest[-2].upper(), rest[-1].upper()
 
 
 def decode_csv(encoded_data):
@@ -154,3 +443,45 @@ def encode_csv(strand, ref, alt, cdna_pos, exon, protein_id, is_ptm):
     """
     return strand + ref + alt + ('1' if is_ptm else '0') + ':'.join((
         '%x' % int(cdna_pos), exon, '%x' % protein_id))
+
+
+# strand & is_ptm flags, ref, alt, cdna_pos, exon, protein_id
+record_struct = Struct('<BBBIHI')
+
+STRAND_MINUS = 1
+IS_PTM = 2
+
+MappingRecord = namedtuple(
+    'MappingRecord',
+    ['strand', 'ref', 'alt', 'pos', 'cdna_pos', 'exon', 'protein_id', 'is_ptm']
+)
+
+
+def encode_record(strand, ref, alt, cdna_pos, exon, protein_id, is_ptm) -> bytes:
+    """Encode a Coding Sequence Variant into a fixed-width binary record.
+
+    Arguments have the same meaning as in `encode_csv`, though
+    only the number of the exon is stored ('EX4', 'exon4' and '4'
+    are all stored as 4).
+    """
+    flags = (STRAND_MINUS if strand == '-' else 0) | (IS_PTM if is_ptm else 0)
+    return record_struct.pack(
+        flags, ord(ref), ord(alt), int(cdna_pos),
+        int(str(exon).lstrip(ascii_letters)), protein_id
+    )
+
+
+def decode_record(record: bytes) -> MappingRecord:
+    """Decode Coding Sequence Variant data from a record made by encode_record()."""
+    flags, ref, alt, cdna_pos, exon, protein_id = record_struct.unpack(record)
+    return MappingRecord(
+        '-' if flags & STRAND_MINUS else '+', chr(ref), chr(alt), (cdna_pos - 1) // 3 + 1,
+        cdna_pos, exon, protein_id, bool(flags & IS_PTM)
+    )
+
+
+def record_from_csv(encoded_data: str) -> bytes:
+    """Convert a Coding Sequence Variant from the legacy text format to a binary record."""
+    item = decode_csv(encoded_data)
+    del item['pos']
+    return encode_record(**item)
@@ -4,7 +4,11 @@ import gc
 from collections import defaultdict
 from contextlib import contextmanager
 
-from typing import Iterable, Union
+from heapq import merge
+from itertools import islice, groupby
+from operator import itemgetter
+from struct import Struct
+from typing import Iterable, Union, Callable, Dict, List
 
 from database.lightning import LightningInterface
 
@@ -33,6 +37,140 @@ class SetWithCallback(set):
         return new_method_with_callback
 
 
+class TextSetFormat:
+    """Legacy value format: set elements stored as text, separated with '|'."""
+
+    def pack(self, items: Iterable[str]) -> bytes:
+        items = list(items)
+        assert all('|' not in item for item in items)
+        return bytes('|'.join(items), 'utf-8')
+
+    def unpack(self, value: bytes) -> Iterable[str]:
+        return filter(bool, value.decode().split('|'))
+
+    def is_current(self, value: bytes) -> bool:
+        return True
+
+    def pack_element(self, item: str) -> bytes:
+        """Pack a single element, to be stored as one of duplicate values of a `dupsort` database."""
+        return bytes(item, 'utf-8')
+
+    def unpack_element(self, data: bytes) -> str:
+        return data.decode()
+
+
+class BinarySetFormat(TextSetFormat):
+    """Base for versioned binary value formats.
+
+    Each value starts with a single `version` byte (never a printable
+    character) so values written in the legacy text format can still be
+    read (and converted in place, see `HashSet.convert_format`).
+    """
+    version: int
+
+    def __init__(self, from_text: Callable = str):
+        """
+        Args:
+            from_text: converts an element of the legacy text format
+                       into an element of this format
+        """
+        self.from_text = from_text
+
+    def pack(self, items) -> bytes:
+        return bytes((self.version,)) + self.pack_elements(items)
+
+    def unpack(self, value: bytes) -> Iterable:
+        if self.is_current(value):
+            return self.unpack_elements(value[1:])
+        return map(self.from_text, super().unpack(value))
+
+    def is_current(self, value: bytes) -> bool:
+        return value[:1] == bytes((self.version,))
+
+    def pack_elements(self, items) -> bytes:
+        raise NotImplementedError
+
+    def unpack_elements(self, data: bytes) -> Iterable:
+        raise NotImplementedError
+
+
+class FixedWidthSetFormat(BinarySetFormat):
+    """Elements are already packed, fixed-width byte strings (records).
+
+    The records are concatenated in sorted order, without any separators.
+    """
+    version = 1
+
+    def __init__(self, record_size: int, from_text: Callable):
+        super().__init__(from_text)
+        self.record_size = record_size
+
+    def pack_elements(self, items: Iterable[bytes]) -> bytes:
+        items = sorted(items)
+        assert all(len(item) == self.record_size for item in items)
+        return b''.join(items)
+
+    def unpack_elements(self, data: bytes) -> Iterable[bytes]:
+        size = self.record_size
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def pack_element(self, item: bytes) -> bytes:
+        return item
+
+    def unpack_element(self, data: bytes) -> bytes:
+        return data
+
+
+class VarintSetFormat(BinarySetFormat):
+    """Non-negative integers, sorted, delta-encoded and packed as varints."""
+    version = 2
+
+    def __init__(self):
+        super().__init__(from_text=int)
+
+    def pack_element(self, item: int) -> bytes:
+        # big-endian, so that the duplicates are sorted numerically
+        return item.to_bytes(8, 'big')
+
+    def unpack_element(self, data: bytes) -> int:
+        return int.from_bytes(data, 'big')
+
+    def pack_elements(self, items: Iterable[int]) -> bytes:
+        data = bytearray()
+        previous = 0
+        for number in sorted(items):
+            delta = number - previous
+            previous = number
+            while delta > 0x7f:
+                data.append(delta & 0x7f | 0x80)
+                delta >>= 7
+            data.append(delta)
+        return bytes(data)
+
+    def unpack_elements(self, data: bytes) -> Iterable[int]:
+        numbers = []
+        number = 0
+        delta = 0
+        shift = 0
+        for byte in data:
+            delta |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+            else:
+                number += delta
+                numbers.append(number)
+                delta = 0
+                shift = 0
+        return numbers
+
+
+def as_key(key: Union[str, bytes]) -> bytes:
+    """Keys can be given either as str (encoded to utf-8) or as raw bytes."""
+    if isinstance(key, bytes):
+        return key
+    return bytes(key, 'utf-8')
+
+
 class DatabaseNotOpened(Exception):
     pass
 
@@ -46,12 +184,24 @@ def require_open(func):
 
 
 class HashSet:
-    """A hash-indexed database where values are equivalent to Python's sets."""
+    """A hash-indexed database where values are equivalent to Python's sets.
 
-    def __init__(self, name=None, integer_values=False):
+    Sets are serialised with given `value_format`; by default text format
+    is used for generic sets and varint-packed format for integer sets.
+
+    Alternatively (see `open`), each element can be stored as a separate
+    duplicate value of the key in a `dupsort` database, so that elements
+    can be added without reading and re-writing the whole set.
+    """
+
+    def __init__(self, name=None, integer_values=False, value_format=None):
         self.is_open = False
+        self.dupsort = False
         self.path: Path
         self.integer_values = integer_values
+        if not value_format:
+            value_format = VarintSetFormat() if integer_values else TextSetFormat()
+        self.format = value_format
         if name:
             self.open(name)
 
@@ -66,35 +216,55 @@ class HashSet:
         db_dir.mkdir(parents=True, exist_ok=True)
         return db_dir
 
-    def open(self, name, readonly=False, size=1e5, write_map=True, **kwargs):
+    def open(self, name, readonly=False, size=1e5, write_map=True, dupsort=False, **kwargs):
         """Open hash database in a given mode.
 
         By default it opens a database in read-write mode and in case
         if a database of given name does not exists it creates one.
+
+        With `dupsort` the sets are stored element-by-element in an lmdb
+        `dupsort` sub-database (databases created in one layout
+        cannot be read in the other one).
         """
         path = self._create_path(name)
         self.path = path
-        self.db = LightningInterface(path, map_size=size, readonly=readonly, writemap=write_map, **kwargs)
+        self.dupsort = dupsort
+        self.db = LightningInterface(
+            path, dupsort=dupsort, map_size=size, readonly=readonly, writemap=write_map, **kwargs
+        )
         self.is_open = True
 
     def close(self):
         self.db.close()
 
+    @require_open
+    def reader(self):
+        """Reuse a single read transaction for all reads within the context.
+
+        See `LightningInterface.reader`.
+        """
+        return self.db.reader()
+
+    def pack(self, items) -> Union[bytes, List[bytes]]:
+        """Pack set elements into a value to be written with `LightningInterface`."""
+        if self.dupsort:
+            return [self.format.pack_element(item) for item in items]
+        return self.format.pack(items)
+
+    def unpack(self, value: Union[bytes, List[bytes]]) -> Iterable:
+        """Unpack set elements from a value read with `LightningInterface`."""
+        if self.dupsort:
+            return map(self.format.unpack_element, value)
+        return self.format.unpack(value)
+
     @require_open
     def __getitem__(self, key) -> set:
-        """key: has to be str"""
+        """key: str or bytes"""
 
-        key = bytes(key, 'utf-8')
+        key = as_key(key)
 
-        try:
-            items = filter(
-                bool,
-                self.db.get(key).decode().split('|')
-            )
-            if self.integer_values:
-                items = map(int, items)
-        except (KeyError, AttributeError):
-            items = []
+        value = self.db.get(key)
+        items = self.unpack(value) if value else []
 
         return SetWithCallback(
             items,
@@ -104,73 +274,139 @@ class HashSet:
     def items(self):
         """Yields (key, iterator over items from value set) tuples.
 
-        All atomic elements are returned as plain strings.
+        Elements are returned as unpacked by the value format
+        (plain strings for the text format).
         """
-        decode = bytes.decode
-        split = str.split
+        unpack = self.unpack
+        decode_key = self.decode_key
         for key, value in self.db.items():
-            try:
-                yield key.decode(), filter(bool, split(decode(value), '|'))
-            except (KeyError, AttributeError):
-                pass
+            yield decode_key(key), unpack(value)
+
+    @staticmethod
+    def decode_key(key: bytes):
+        return key.decode()
 
     def values(self):
         """Yields iterators over items from value set.
 
-        All atomic elements are returned as plain strings.
+        Elements are returned as unpacked by the value format
+        (plain strings for the text format).
         """
-        decode = bytes.decode
-        split = str.split
+        unpack = self.unpack
         for key, value in self.db.items():
-            try:
-                yield filter(bool, split(decode(value), '|'))
-            except (KeyError, AttributeError):
-                pass
+            yield unpack(value)
 
     def update(self, key, value):
-        key = bytes(key, 'utf-8')
-        try:
-            items = self._to_set(self.db.get(key))
-        except (KeyError, AttributeError):
-            items = set()
+        key = as_key(key)
+        if self.dupsort:
+            self.db.add_many((key, element) for element in self.pack(value))
+            return
+        # read within the write transaction (never from a read session, which could be outdated)
+        with self.db.begin(write=True) as transaction:
+            old_value = transaction.get(key)
+            items = set(self.unpack(old_value)) if old_value else set()
+            items.update(value)
+            transaction.put(key, self.pack(items))
 
-        assert '|' not in value
-        items.update((bytes(v, 'utf-8') for v in value))
+    def add(self, key, value):
+        self.update(key, [value])
 
-        self.db[key] = b'|'.join(items)
+    @require_open
+    def __setitem__(self, key: Union[str, bytes], items: Iterable[Union[str, int]]):
+        self.db[as_key(key)] = self.pack(items)
 
-    def _get(self, key):
-        try:
-            items = self._to_set(self.db.get(key))
-        except (KeyError, AttributeError):
-            items = set()
-        return items
+    @require_open
+    def convert_format(self, batch_size=10000) -> int:
+        """Rewrite values stored in an outdated (e.g. legacy text) format, in place.
 
-    @staticmethod
-    def _to_set(value: bytes):
-        return set(
-            filter(
-                bool,
-                value.split(b'|')
-            )
-        )
+        Values are processed in batches (one write transaction per batch)
+        so that the conversion of huge databases can be safely interrupted.
 
-    def add(self, key, value):
-        key = bytes(key, 'utf-8')
-        items = self._get(key)
-        assert '|' not in value
-        items.add(bytes(value, 'utf-8'))
-        self.db[key] = b'|'.join(items)
+        Returns:
+            number of converted values
+        """
+        if self.dupsort:
+            # elements are stored one by one, always in the current format
+            return 0
+
+        is_current = self.format.is_current
+        unpack = self.format.unpack
+        pack = self.format.pack
+
+        converted = 0
+        last_key = b''
+
+        while True:
+            with self.db.begin(write=True) as transaction:
+                cursor = transaction.cursor()
+                if not cursor.set_range(last_key):
+                    break
+                batch = list(islice(cursor.iternext(), batch_size))
+                for key, value in batch:
+                    if not is_current(value):
+                        transaction.put(key, pack(set(unpack(value))))
+                        converted += 1
+            # the next batch will start from the smallest key greater than the last one
+            last_key = batch[-1][0] + b'\x00'
+
+        return converted
+
+    def dump_run(self, path, cache: Dict[bytes, set]):
+        """Write `cache` (key -> set of elements) into a sorted run file.
+
+        Run files are meant to be created in parallel (e.g. by worker processes,
+        without access to the database) and then merged with `load_runs`.
+        The database does not need to be open.
+        """
+        pack = self.format.pack
+        header = run_entry_header.pack
+        with open(path, 'wb') as f:
+            write = f.write
+            for key, items in sorted(cache.items()):
+                value = pack(items)
+                write(header(len(key), len(value)))
+                write(key)
+                write(value)
 
     @require_open
-    def __setitem__(self, key: Union[str, bytes], items: Iterable[Union[str, int]]):
-        if self.integer_values:
-            items = map(str, items)
-        else:
-            assert all('|' not in item for item in items)
-        if not isinstance(key, bytes):
-            key = bytes(key, 'utf-8')
-        self.db[key] = bytes('|'.join(items), 'utf-8')
+    def load_runs(self, paths: Iterable, batch_size=100000) -> int:
+        """Merge sorted run files (see `dump_run`) into the database.
+
+        The sets of the same key from different runs are merged. As the keys
+        are written in the sorted order, the database has to be empty; this
+        allows to use the (much faster) lmdb append mode.
+
+        Returns:
+            number of written keys
+        """
+        assert len(self) == 0
+
+        # runs are always written in the (packed) value format
+        unpack = self.format.unpack
+        pack = self.pack
+
+        entries = merge(*[iterate_run(path) for path in paths], key=itemgetter(0))
+        grouped = groupby(entries, key=itemgetter(0))
+
+        written = 0
+        while True:
+            with self.db.begin(write=True) as transaction:
+                put = transaction.put
+                put_many = transaction.cursor().putmulti
+                in_batch = 0
+                for key, group in islice(grouped, batch_size):
+                    items = set()
+                    for _, value in group:
+                        items.update(unpack(value))
+                    if self.dupsort:
+                        put_many((key, element) for element in pack(sorted(items)))
+                    else:
+                        put(key, pack(items), append=True)
+                    in_batch += 1
+            written += in_batch
+            if in_batch < batch_size:
+                break
+        return written
 
     @require_open
     def __len__(self):
@@ -193,49 +429,66 @@ class HashSet:
     def reset(self):
         """Reset database completely by its removal and recreation."""
         self.drop()
-        self.open(self.name)
+        self.open(self.name, dupsort=self.dupsort)
 
     @require_open
     def reload(self):
         self.close()
-        self.open(self.name)
+        self.open(self.name, dupsort=self.dupsort)
 
 
 class HashSetWithCache(HashSet):
 
-    def __init__(self, name=None, integer_values=False):
+    def __init__(self, name=None, integer_values=False, value_format=None):
         self.in_cached_session = False
         self.cache = {}
         self.i = None
-        super().__init__(name=name, integer_values=integer_values)
+        super().__init__(name=name, integer_values=integer_values, value_format=value_format)
 
-    def cached_add(self, key: str, value: str):
-        self.cache[bytes(key, 'utf-8')].add(bytes(value, 'utf-8'))
+    def cached_add(self, key: Union[str, bytes], value):
+        self.cache[as_key(key)].add(value)
 
-    def cached_add_integer(self, key: str, value: int):
-        self.cache[bytes(key, 'utf-8')].add(b'%d' % value)
+    def cached_add_integer(self, key: Union[str, bytes], value: int):
+        self.cache[as_key(key)].add(value)
 
     def flush_cache(self):
+        """Write the cached elements to the database.
+
+        In the `dupsort` layout the elements are simply added (the sets
+        already stored do not need to be read, merged and re-written).
+        """
         assert self.in_cached_session
 
-        with self.db.env.begin(write=True) as transaction:
+        if self.dupsort:
+            pack_element = self.format.pack_element
+            self.db.add_many(
+                (key, pack_element(item))
+                for key in sorted(self.cache)
+                for item in self.cache[key]
+            )
+        else:
+            self._merge_cache()
+
+        self.cache = defaultdict(set)
+
+        self.i += 1
+        if self.i % 100 == 99:
+            gc.collect()
+
+    def _merge_cache(self):
+        with self.db.begin(write=True) as transaction:
             put = transaction.put
             get = transaction.get
-            to_set = self._to_set
+            pack = self.format.pack
+            unpack = self.format.unpack
 
             for key, items in self.cache.items():
                 old_values = get(key)  # will return None if the key does not exist in the db
                 if old_values:
-                    items.update(to_set(old_values))
+                    items.update(unpack(old_values))
 
             for key, items in self.cache.items():
-                put(key, b'|'.join(items))
-
-        self.cache = defaultdict(set)
-
-        self.i += 1
-        if self.i % 100 == 99:
-            gc.collect()
+                put(key, pack(items))
 
     @contextmanager
     def cached_session(self):
@@ -253,6 +506,24 @@ class HashSetWithCache(HashSet):
         self.in_cached_session = False
 
 
+# lengths of the key and of the value of a run file entry
+run_entry_header = Struct('<HI')
+
+
+def iterate_run(path):
+    """Yield (key, packed value) tuples from a run file created with `HashSet.dump_run`."""
+    header_size = run_entry_header.size
+    unpack_header = run_entry_header.unpack
+    with open(path, 'rb') as f:
+        read = f.read
+        while True:
+            header = read(header_size)
+            if not header:
+                break
+            key_length, value_length = unpack_header(header)
+            yield read(key_length), read(value_length)
+
+
 def path_relative_to_app(path):
     path = Path(path)
     base_dir = Path(__file__).parent.resolve()
@@ -1,4 +1,7 @@
+from collections import OrderedDict
 from pathlib import Path
+from threading import Lock
+from time import time_ns
 from typing import Callable
 from warnings import warn
 
@@ -6,17 +9,19 @@ from diskcache import Cache as DiskCache
 
 
 class Cache(DiskCache):
+    """Disk cache, purged (unless `purgeable` is False) with `purge_all_caches`."""
 
     caches = []
 
-    def __init__(self, directory, *args, cache_root=None, **kwargs):
+    def __init__(self, directory, *args, cache_root=None, purgeable=True, **kwargs):
         if not cache_root:
             cache_root = Path(__file__).absolute().parent.parent
         path = Path(directory)
         if not path.is_absolute():
             path = cache_root / path
         super().__init__(str(path), *args, **kwargs)
-        self.caches.append(self)
+        if purgeable:
+            self.caches.append(self)
 
 
 def purge_all_caches():
@@ -72,3 +77,110 @@ def cache_decorator(cache: Cache) -> Callable:
         return cache_manager
 
     return cached
+
+
+class MemoryCache:
+    """In-process LRU cache with a budget for the total size of stored values.
+
+    Mirrors the subset of diskcache.Cache interface used by TieredCache;
+    the size of each value has to be given explicitly on insertion.
+    """
+
+    def __init__(self, size_limit: int):
+        self.size_limit = size_limit
+        self.volume = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        Cache.caches.append(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, size: int):
+        if size > self.size_limit:
+            return False
+        with self._lock:
+            if key in self._data:
+                self.volume -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.volume += size
+            # evict the least recently used items
+            while self.volume > self.size_limit:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.volume -= evicted_size
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.volume = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TieredCache:
+    """Two-level cache: in-process memory tier backed by an on-disk tier.
+
+    Both tiers evict the least recently used items once their byte budgets
+    are exceeded; the disk tier is shared by all processes of the application.
+
+    Args:
+        sizeof: function returning the size (in bytes) of a stored value
+    """
+
+    def __init__(self, directory, memory_limit: int, disk_limit: int, sizeof: Callable = len, **kwargs):
+        self.sizeof = sizeof
+        self.memory = MemoryCache(memory_limit)
+        self.disk = Cache(
+            directory,
+            size_limit=disk_limit,
+            eviction_policy='least-recently-used',
+            **kwargs
+        )
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self.disk.get(key)
+        if value is None:
+            return default
+        # promote to the faster tier
+        self.memory.set(key, value, self.sizeof(value))
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value, self.sizeof(value))
+        self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+
+# never purged: if the version was reset, stale entries keyed by an old version could be served again
+data_version_store = Cache('.data_version', purgeable=False)
+
+
+def data_version() -> int:
+    """Version stamp of the biological data, bumped after each import."""
+    return data_version_store.get('version', 0)
+
+
+def bump_data_version() -> int:
+    """Invalidate all data-dependent caches keyed by the data version.
+
+    The version grows monotonically (it is based on the current time),
+    so even if the store was removed, the versions are never re-used.
+    """
+    with data_version_store.transact():
+        version = max(data_version() + 1, time_ns())
+        data_version_store.set('version', version)
+    return version
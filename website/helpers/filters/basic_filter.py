@@ -338,6 +338,28 @@ class BasicFilter:
         obj_value = attr_get(obj)
         return self.compare(obj_value)
 
+    def predicate(self, itemgetter=None):
+        """Compile a function testing if an element passes criteria of this filter.
+
+        Args:
+            itemgetter: function extracting the tested object from the element
+        """
+        attr_get = self.attr_getter()
+
+        comparator_function = self.allowed_comparators[self.comparator]
+        multiple_test = self.get_multiple_function()
+
+        compare = self.get_compare_func(comparator_function, multiple_test)
+
+        if itemgetter:
+            def predicate(element):
+                return compare(attr_get(itemgetter(element)))
+        else:
+            def predicate(element):
+                return compare(attr_get(element))
+
+        return predicate
+
     def apply(self, elements, itemgetter=None):
         """Optimized equivalent to list(filter(my_filter.test, elements))"""
 
@@ -348,25 +370,12 @@ class BasicFilter:
         if not elements:
             return []
 
-        attr_get = self.attr_getter()
-        if itemgetter:
-            old_attr_get = attr_get
-
-            def attr_get(element):
-                element = itemgetter(element)
-                return old_attr_get(element)
-
-        comparator_function = self.allowed_comparators[self.comparator]
-        multiple_test = self.get_multiple_function()
-
-        compare = self.get_compare_func(comparator_function, multiple_test)
+        predicate = self.predicate(itemgetter)
 
         return (
             elem
             for elem in elements
-            if compare(
-                attr_get(elem)
-            )
+            if predicate(elem)
         )
 
     @property
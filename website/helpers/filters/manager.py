@@ -1,8 +1,13 @@
 import re
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict
+from threading import Lock
+from types import FunctionType
 
 from sqlalchemy import and_
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm.attributes import QueryableAttribute
 
+from helpers.cache import Cache, data_version
 from helpers.utilities import is_iterable_but_not_str
 
 
@@ -34,22 +39,137 @@ def unqoute(value):
     return value
 
 
-def joined_query(query, required_joins, limit_to=None):
+def joined_query(query, required_joins, limit_to=None, joined=None):
+    """Join query with all required joins (skipping those which cannot be applied).
+
+    Args:
+        joined: if a list is given, the successfully applied joins will be appended to it
+    """
     already_joined = set()
     for joins in required_joins:
         for join in joins:
             if limit_to and join not in limit_to:
                 continue
             if join not in already_joined:
-                from sqlalchemy.exc import InvalidRequestError
                 try:
                     query = query.join(join)
                     already_joined.add(join)
+                    if joined is not None:
+                        joined.append(join)
                 except InvalidRequestError:
                     pass
     return query
 
 
+class FilterPlan:
+    """Compiled SQL side of the filters to be applied to a target.
+
+    Holds the SQLAlchemy clauses (and their conjunction) along with the required
+    joins and - once resolved against the target query - the path of joins which
+    are applicable to it. Plans are independent of a particular FilterManager
+    instance; filters to be applied manually are stored by their identifiers.
+    """
+
+    def __init__(self, query_filters, manual_filters_ids, required_joins):
+        self.query_filters = query_filters
+        self.manual_filters_ids = manual_filters_ids
+        self.required_joins = required_joins
+        self.clause = and_(*query_filters)
+        self.join_path = None
+
+
+class FilterPlansCache:
+    """Bounded (LRU) cache of filter plans, shared by all filter managers."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+            return plan
+
+    def set(self, key, plan):
+        with self._lock:
+            self._plans[key] = plan
+            if len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def __len__(self):
+        return len(self._plans)
+
+
+filter_plans = FilterPlansCache()
+
+# plans may refer to the data (e.g. ids of site types), so these are cleared with other caches
+Cache.caches.append(filter_plans)
+
+
+# types of objects which are compared (and hashed) by value and which are never modified
+value_types = (type(None), bool, int, float, complex, str, bytes, type)
+
+
+def captured_variables(function) -> tuple:
+    return tuple(cell.cell_contents for cell in function.__closure__ or ())
+
+
+def is_value_based(variable) -> bool:
+    if isinstance(variable, (tuple, frozenset)):
+        return all(is_value_based(element) for element in variable)
+    if isinstance(variable, FunctionType):
+        # functions do not change, unless the captured variables do
+        return is_value_based(captured_variables(variable))
+    return isinstance(variable, value_types)
+
+
+def join_signature(join):
+    if isinstance(join, QueryableAttribute):
+        return join.class_, join.key
+    return join
+
+
+def definition_signature(the_filter):
+    """Hashable description of the filter definition and state which determines its SQL form.
+
+    Returns None if the form cannot be described by values only (e.g. for a callback
+    capturing in the closure an object which could be modified in place), making the
+    plan not cacheable.
+    """
+    callback = getattr(the_filter, 'as_sqlalchemy_callback', None)
+
+    callback_signature = None
+    if callback:
+        bound_to = getattr(callback, '__self__', None)
+        callback = getattr(callback, '__func__', callback)
+        captured = (bound_to, *captured_variables(callback))
+        if not is_value_based(captured):
+            return None
+        callback_signature = (callback.__code__, captured)
+
+    value = the_filter.value
+    if is_iterable_but_not_str(value):
+        value = tuple(sorted(map(str, value)))
+    elif not is_value_based(value):
+        return None
+
+    joins = tuple(map(join_signature, getattr(the_filter, 'as_sqlalchemy_joins', ())))
+    if not is_value_based(joins):
+        return None
+
+    return (
+        type(the_filter), the_filter.id, the_filter.comparator, value, the_filter.multiple,
+        getattr(the_filter, 'has_sqlalchemy', False), callback_signature, joins
+    )
+
+
 class FilterManager:
     """Main class used to parse & apply filters' data specified by request.
 
@@ -79,13 +199,37 @@ class FilterManager:
             for filter_ in filters
         }
 
-    def prepare_filters(self, target=None):
+    def plan(self, target=None) -> FilterPlan:
+        """Get a plan of filtering the target with currently active filters.
+
+        Plans are cached by the target, the definitions and state of the filters
+        (and the data version), so that repeated requests for the same filters
+        combination do not need to derive SQL clauses again.
+        """
+        filters = self._filters_to_apply_to(target)
+
+        signatures = tuple(definition_signature(the_filter) for the_filter in filters)
+
+        if None in signatures:
+            return self._create_plan(target, filters)
+
+        key = (target, signatures, data_version())
+        plan = filter_plans.get(key)
+
+        if plan is None:
+            plan = self._create_plan(target, filters)
+            filter_plans.set(key, plan)
 
-        to_apply_manually = []
+        return plan
+
+    @staticmethod
+    def _create_plan(target, filters) -> FilterPlan:
+
+        manual_filters_ids = []
         query_filters = []
         all_required_joins = []
 
-        for the_filter in self._filters_to_apply_to(target):
+        for the_filter in filters:
 
             if the_filter.has_sqlalchemy:
 
@@ -97,9 +241,17 @@ class FilterManager:
                     all_required_joins.append(required_joins)
 
             else:
-                to_apply_manually.append(the_filter)
+                manual_filters_ids.append(the_filter.id)
+
+        return FilterPlan(query_filters, manual_filters_ids, all_required_joins)
+
+    def prepare_filters(self, target=None):
+
+        plan = self.plan(target)
 
-        return query_filters, to_apply_manually, all_required_joins
+        to_apply_manually = [self.filters[filter_id] for filter_id in plan.manual_filters_ids]
+
+        return list(plan.query_filters), to_apply_manually, list(plan.required_joins)
 
     def build_query(self, target, custom_filter=None, query_modifier=None):
         """There are two strategies of using filter manager:
@@ -109,14 +261,24 @@ class FilterManager:
             - you can build a query and move some job to the database;
               not always it is possible though.
         """
-        query_filters, to_apply_manually, required_joins = self.prepare_filters(target)
+        plan = self.plan(target)
+
+        to_apply_manually = [self.filters[filter_id] for filter_id in plan.manual_filters_ids]
 
-        query_filters_sum = and_(*query_filters)
+        query_filters_sum = plan.clause
 
         if custom_filter:
             query_filters_sum = custom_filter(query_filters_sum)
 
-        query = joined_query(target.query, required_joins)
+        if plan.join_path is None:
+            join_path = []
+            query = joined_query(target.query, plan.required_joins, joined=join_path)
+            plan.join_path = join_path
+        else:
+            query = target.query
+            for join in plan.join_path:
+                query = query.join(join)
+
         query = query.filter(query_filters_sum)
 
         if query_modifier:
@@ -167,10 +329,29 @@ class FilterManager:
         else:
             filters = self._filters_to_apply_to(target_type)
 
-        for filter_ in filters:
-            elements = filter_.apply(elements, itemgetter)
+        # test all the filters in a single pass over elements
+        predicates = [
+            the_filter.predicate(itemgetter)
+            for the_filter in filters
+            if the_filter.mapped_value is not None
+        ]
 
-        return list(elements)
+        if not predicates:
+            return list(elements)
+
+        if len(predicates) == 1:
+            predicate = predicates[0]
+            return [element for element in elements if predicate(element)]
+
+        return [
+            element
+            for element in elements
+            if all(predicate(element) for predicate in predicates)
+        ]
+
+    def active_filters(self, target=None):
+        """Return filters which will be applied to given target (or to any target, if not given)."""
+        return self._filters_to_apply_to(target)
 
     def _filters_to_apply_to(self, target=None):
         """Return filters that are active and can be applied to given target.
@@ -397,6 +578,30 @@ class FilterManager:
         # that there is really nothing interesting (keeps address clean when
         # result is being passed as a keyword arg to flask's url_for function)
 
+    def canonical_url_string(self):
+        """Order-independent representation of all active filters.
+
+        Unlike url_string, filters with default values are included and both
+        filters and their sub-values are sorted, so that equivalent states of
+        the manager produce the same string (e.g. for use in cache keys).
+        """
+        def canonical_value(value):
+            if is_iterable_but_not_str(value):
+                return sorted(map(str, value))
+            return value
+
+        return self.filters_separator.join(sorted(
+            self.field_separator.join(
+                map(str, [
+                    f.id,
+                    f.comparator,
+                    self._repr_value(canonical_value(f.value))
+                ])
+            )
+            for f in self.filters.values()
+            if f.is_active
+        ))
+
     def reset(self):
         """Reset values of child filters to bring them into a neutral state."""
         for filter_ in self.filters.values():
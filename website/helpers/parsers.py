@@ -1,8 +1,12 @@
 import os
+import json
 from contextlib import contextmanager
 from glob import glob
 import gzip
-from typing import TextIO
+from io import BytesIO, TextIOWrapper
+from itertools import islice
+from typing import TextIO, BinaryIO, Union, List, NamedTuple
+from warnings import warn
 
 from tqdm import tqdm
 import subprocess
@@ -21,6 +25,43 @@ def gzip_open_text(path, mode=None):
     return gzip.open(path, mode)
 
 
+class UploadedTextFile:
+    """Iterates over lines of an uploaded file, reading it incrementally.
+
+    Gzip-compressed files (recognised by the magic number) are
+    decompressed on the fly. As the number of lines is not known
+    upfront, the progress is estimated from the position in the
+    (possibly compressed) stream.
+    """
+
+    gzip_magic_number = b'\x1f\x8b'
+
+    def __init__(self, stream: Union[BinaryIO, bytes], encoding='utf-8'):
+        if isinstance(stream, bytes):
+            stream = BytesIO(stream)
+
+        self.raw = stream
+        self.size = stream.seek(0, os.SEEK_END)
+        stream.seek(0)
+
+        self.is_compressed = stream.read(2) == self.gzip_magic_number
+        stream.seek(0)
+
+        binary = gzip.GzipFile(fileobj=stream, mode='rb') if self.is_compressed else stream
+        self.text = TextIOWrapper(binary, encoding=encoding, errors='replace')
+        self.lines_read = 0
+
+    def __iter__(self):
+        for line in self.text:
+            self.lines_read += 1
+            yield line
+
+    def fraction_read(self) -> float:
+        if not self.size:
+            return 1
+        return self.raw.tell() / self.size
+
+
 def get_files(path, pattern):
     """Get all files from given `path` matching to given pattern
 
@@ -80,20 +121,22 @@ def count_lines_tsv_gz(filename):
 
 
 def iterate_tsv_gz_file(
-        filename, file_header=None
+        filename, file_header=None, with_total=True
 ):
     """Utility iterator for gzipped tsv (tab-separated values) file.
 
     It checks if the file header is the same as given (if provided).
 
-    Progress bar is embedded.
+    Progress bar is embedded; unless `with_total` is False, the lines are
+    counted first to show the total (which requires decompressing the file twice).
     """
-    data_lines_count = count_lines_tsv_gz(filename)
+    data_lines_count = count_lines_tsv_gz(filename) if with_total else None
 
     with fast_gzip_read(filename) as f:
         if file_header:
             header = f.readline().decode('utf-8').rstrip().split('\t')
-            data_lines_count -= 1
+            if with_total:
+                data_lines_count -= 1
             if header != file_header:
                 raise ParsingError(
                     'Given file header does not match to expected: '
@@ -141,6 +184,66 @@ def tsv_file_iterator(
                 yield line.rstrip().split(sep)
 
 
+class ChunkIndex(NamedTuple):
+    lines_count: int
+    # byte offsets of the first lines of subsequent chunks
+    offsets: List[int]
+
+
+def build_chunk_index(filename, chunk_size) -> ChunkIndex:
+    """Count lines of an (uncompressed) file, recording where every chunk of `chunk_size` lines starts."""
+    offsets = []
+    position = 0
+    lines_count = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            if lines_count % chunk_size == 0:
+                offsets.append(position)
+            position += len(line)
+            lines_count += 1
+    return ChunkIndex(lines_count, offsets)
+
+
+def load_chunk_index(filename, chunk_size) -> ChunkIndex:
+    """Get the chunk index of a file, cached next to the file (as `<filename>.chunks`).
+
+    The cached index is rebuilt when the file (its size or modification time)
+    or the chunk size changes.
+    """
+    cache_path = filename + '.chunks'
+    stat = os.stat(filename)
+    signature = [stat.st_size, stat.st_mtime_ns, chunk_size]
+
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['signature'] == signature:
+            return ChunkIndex(cached['lines_count'], cached['offsets'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_chunk_index(filename, chunk_size)
+
+    try:
+        with open(cache_path, 'w') as f:
+            json.dump({'signature': signature, **index._asdict()}, f)
+    except OSError as e:
+        warn(f'Could not cache the chunk index of {filename}: {e}')
+
+    return index
+
+
+def tsv_chunk_iterator(filename, offset=0, limit=None, sep='\t', encoding='utf-8'):
+    """Iterate over (at most `limit`) lines of tsv file, starting at given byte offset.
+
+    Progress bar is embedded.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        for line in tqdm(islice(f, limit), total=limit, unit=' lines'):
+            yield line.decode(encoding).rstrip().split(sep)
+
+
 def parse_tsv_file(
     filename, parser, file_header=None, file_opener=open, mode='r', sep='\t'
 ):
@@ -193,16 +296,18 @@ def parse_fasta_file(filename, on_sequence, on_header=lambda x: x, file_opener=o
                 on_sequence(header, line)
 
 
-def chunked_list(full_list, chunk_size=10000):
+def chunked_list(full_list, chunk_size=10000, progress=True):
     """Creates generator with `full_list` slitted into chunks.
 
     Each chunk will be no longer than `chunk_size` (the last chunk may have
     less elements if provided `full_list` is not divisible by `chunk_size`).
 
-    Progress bar is embedded.
+    Progress bar is embedded (unless `progress` is False).
     """
+    if progress:
+        full_list = tqdm(full_list)
     element_buffer = []
-    for element in tqdm(full_list):
+    for element in full_list:
         element_buffer.append(element)
         if len(element_buffer) >= chunk_size:
             yield element_buffer
@@ -1,13 +1,20 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodingError
 from copy import copy
+from hashlib import sha1
 
+from flask import current_app
 from flask import jsonify
 from flask import request
 from sqlalchemy import and_
 from sqlalchemy import asc
 from sqlalchemy import desc
+from sqlalchemy import or_
 from sqlalchemy.exc import StatementError
 from sqlalchemy.ext.associationproxy import AssociationProxy
 from database import db, fast_count
+from helpers.cache import Cache, data_version
 from helpers.filters.manager import joined_query
 
 ordering_functions = {
@@ -15,6 +22,8 @@ ordering_functions = {
     'asc': asc
 }
 
+counts_cache = Cache('.table_counts_cache')
+
 
 def json_results_mapper(result):
     return result.to_json()
@@ -32,6 +41,91 @@ class ModelCounter:
         self.query = self.query.filter(*args, **kwargs)
         return self
 
+    @property
+    def statement(self):
+        return self.query.statement
+
+
+def query_fingerprint(query) -> str:
+    """Digest of the SQL statement of the query, including the bound parameters."""
+    compiled = query.statement.compile()
+    return sha1(
+        (str(compiled) + repr(sorted(compiled.params.items()))).encode()
+    ).hexdigest()
+
+
+def cached_count(count_query) -> int:
+    """Count the results of the query, re-using the count memoised for
+    the same query (and the same data version) if it is not older
+    than TABLE_COUNT_CACHE_TTL seconds; zero TTL disables the memoisation."""
+    ttl = current_app.config.get('TABLE_COUNT_CACHE_TTL', 0)
+
+    if not ttl:
+        return count_query.count()
+
+    key = (query_fingerprint(count_query), data_version())
+    count = counts_cache.get(key)
+
+    if count is None:
+        count = count_query.count()
+        counts_cache.set(key, count, expire=ttl)
+
+    return count
+
+
+def encode_cursor(sort, order, value, tiebreaker_value) -> str:
+    return urlsafe_b64encode(json.dumps([sort, order, value, tiebreaker_value]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns: (sort, order, value, tiebreaker value) or None if the cursor is malformed."""
+    try:
+        sort, order, value, tiebreaker_value = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (DecodingError, ValueError, TypeError):
+        return None
+    return sort, order, value, tiebreaker_value
+
+
+def prepare_count_query(count_query, query, sql_filters, required_joins):
+    """Create the query for counting of results, see `count_query` of AjaxTableView.from_query."""
+    if callable(count_query):
+        return count_query(sql_filters, required_joins)
+    if count_query:
+        return joined_query(count_query, required_joins)
+    return query
+
+
+def keyset_filter(keyset, order, value, tiebreaker_value):
+    """SQL filter selecting rows which follow the row having given values of the keyset columns."""
+    column, tiebreaker = keyset
+    if order == 'desc':
+        return or_(column < value, and_(column == value, tiebreaker < tiebreaker_value))
+    return or_(column > value, and_(column == value, tiebreaker > tiebreaker_value))
+
+
+def apply_cursor(query, keyset, cursor, sort, order):
+    """Limit the query to rows following the one the cursor points to.
+
+    Returns: the limited query or None if the cursor is malformed
+        or was created for a different ordering (thus is ignored)
+    """
+    decoded = decode_cursor(cursor)
+    if not decoded or decoded[:2] != (sort, order):
+        return None
+    return query.filter(keyset_filter(keyset, order, *decoded[2:]))
+
+
+def next_page_cursor(elements, keyset, sort, order):
+    """Create a cursor pointing to the last of elements (or None)."""
+    if not elements:
+        return None
+    last = elements[-1]
+    value = getattr(last, sort)
+    tiebreaker_value = getattr(last, keyset[1].key)
+    if value is None or tiebreaker_value is None:
+        return None
+    return encode_cursor(sort, order, value, tiebreaker_value)
+
 
 class AjaxTableView:
     """View returning data in JSON format, compatible with Bootstrap-Table.
@@ -71,7 +165,7 @@ class AjaxTableView:
         query, count_query=None,
         results_mapper=json_results_mapper, filters_class=None,
         search_filter=None, search_sort=None,
-        prepare_for_sorting=None, **kwargs
+        prepare_for_sorting=None, keyset_columns=None, **kwargs
     ):
         """Create TableView from an sqlalchemy query object.
 
@@ -99,6 +193,17 @@ class AjaxTableView:
                 and boolean indication if the query was modified.
             prepare_for_sorting:
                 hook to modify query and sort key (sort column)
+            keyset_columns:
+                mapping of sort keys to pairs of columns: the sorted
+                column and a column with unique values (e.g. the primary
+                key) breaking the ties, enabling keyset pagination when
+                sorting by these keys: each page of results is then
+                accompanied by an opaque `cursor` which (passed as an
+                argument of the next request) replaces the offset, so
+                that the preceding rows do not have to be scanned again.
+                The values of both columns have to be accessible as
+                attributes of the results (the sort key and the key of
+                the tiebreaking column, respectively).
 
         Keyword Args:
             sort, search, order, offset and limit will be used
@@ -110,7 +215,8 @@ class AjaxTableView:
             'search': None,
             'order': 'asc',
             'offset': 0,
-            'limit': 25
+            'limit': 25,
+            'cursor': None
         }
 
         default_args.update(kwargs)
@@ -162,6 +268,8 @@ class AjaxTableView:
 
             sort_key = args['sort']
 
+            keyset = None
+
             if sort_key and prepare_for_sorting:
                 query, sort_key = prepare_for_sorting(query, sort_key)
 
@@ -169,37 +277,51 @@ class AjaxTableView:
                 query, sorted_by_search = search_sort(query, phrase, sort_key, ordering_function)
 
             if not sorted_by_search and sort_key:
+                order_by = [sort_key]
+                if keyset_columns and args['sort'] in keyset_columns:
+                    keyset = keyset_columns[args['sort']]
+                    order_by.append(keyset[1])
                 query = query.order_by(
-                    ordering_function(sort_key)
+                    *map(ordering_function, order_by)
                 )
 
-            if callable(predefined_count_query):
-                count_query = predefined_count_query(sql_filters, required_joins)
-            elif predefined_count_query:
-                count_query = joined_query(predefined_count_query, required_joins)
-            else:
-                count_query = query
+            count_query = prepare_count_query(predefined_count_query, query, sql_filters, required_joins)
 
             if filters:
                 filters_conjunction = and_(*filters)
                 query = query.filter(filters_conjunction)
                 count_query = count_query.filter(filters_conjunction)
 
+            offset = args['offset']
+
+            if keyset and args['cursor']:
+                following_query = apply_cursor(query, keyset, args['cursor'], args['sort'], args['order'])
+                if following_query is not None:
+                    query = following_query
+                    offset = 0
+
             try:
-                count = count_query.count()
-                query = query.limit(args['limit']).offset(args['offset'])
-                elements = query
+                count = cached_count(count_query)
+                query = query.limit(args['limit']).offset(offset)
+                elements = query.all()
             except StatementError as e:
                 db.session.rollback()
                 print('Statement Error detected!', e)
                 return jsonify({'message': 'Query error'})
 
-            return jsonify({
+            response = {
                 'total': count,
                 'rows': [
                     results_mapper(element)
                     for element in elements
                 ]
-            })
+            }
+
+            if keyset:
+                cursor = next_page_cursor(elements, keyset, args['sort'], args['order'])
+                if cursor:
+                    response['cursor'] = cursor
+
+            return jsonify(response)
 
         return ajax_table_view
@@ -1,215 +1,365 @@
 from collections import defaultdict
+from contextlib import contextmanager, ExitStack
+from multiprocessing import get_context
 from os.path import basename
-from typing import Dict
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, NamedTuple, List, Tuple, Optional
 
-from genomic_mappings import make_snv_key, encode_csv
+from tqdm import tqdm
+
+from genomic_mappings import make_snv_key, encode_record
+from hash_set_db import HashSetWithCache, as_key
 from helpers.bioinf import decode_mutation, DataInconsistencyError
 from helpers.bioinf import is_sequence_broken
-from helpers.parsers import read_from_gz_files
+from helpers.parsers import read_from_gz_files, get_files, fast_gzip_read
 from helpers.bioinf import get_human_chromosomes
 from helpers.bioinf import determine_strand
 from flask import current_app
-from database import bdb, bdb_refseq
-from models import Protein
+from database import db, bdb, bdb_refseq
+from models import Protein, Site, Gene, SiteIndex
 
 
-def import_genome_proteome_mappings(
+class ProteinSnapshot(NamedTuple):
+    """Picklable subset of Protein data, sufficient to map genomic mutations."""
+    id: int
+    refseq: str
+    sequence: str
+    gene_name: str
+    site_index: SiteIndex
+
+    def would_affect_any_sites(self, mutation_pos):
+        return bool(self.site_index.is_close(mutation_pos, 7, 7))
+
+
+def snapshot_proteins(proteins: Dict[str, Protein]) -> Dict[str, ProteinSnapshot]:
+    """Create snapshots of proteins, which can be also shared with worker processes."""
+    sites_positions = defaultdict(list)
+
+    for protein_id, position in db.session.query(Site.protein_id, Site.position):
+        sites_positions[protein_id].append(position)
+
+    genes = dict(
+        db.session.query(Protein.id, Gene.name).join(Gene, Gene.id == Protein.gene_id)
+    )
+
+    return {
+        refseq: ProteinSnapshot(
+            protein.id, protein.refseq, protein.sequence, genes.get(protein.id),
+            SiteIndex(sites_positions[protein.id])
+        )
+        for refseq, protein in proteins.items()
+    }
+
+
+@contextmanager
+def stage(name):
+    """Print how long did the stage of import take."""
+    print(f'{name}...')
+    start = perf_counter()
+    yield
+    print(f'{name} completed in {perf_counter() - start:.1f}s')
+
+
+def parse_mappings_line(line, proteins: Dict[str, ProteinSnapshot], chromosomes, broken_seq):
+    """Yield a tuple for each of isoform mappings from a single line of mappings file.
+
+    Yielded tuples are: (chrom, pos, ref, alt, exon, cdna_ref, cdna_pos, cdna_alt,
+    aa_ref, aa_pos, aa_alt, protein); use `genome_proteome_mapping` and
+    `aminoacid_refseq_mapping` to convert those into database items.
+
+    Args:
+        line: line from `annot_*.txt.gz` file
+        proteins: refseq -> protein snapshot mapping
+        chromosomes: names of chromosomes, see `get_human_chromosomes`
+        broken_seq: refseq -> list mapping where sequence problems will be recorded
+    """
+    try:
+        chrom, pos, ref, alt, prot = line.rstrip().split('\t')
+    except ValueError as e:
+        print(e, line)
+        return
+
+    assert chrom.startswith('chr')
+    chrom = chrom[3:]
+
+    assert chrom in chromosomes
+    ref = ref.rstrip()
+
+    for dest in filter(bool, prot.split(',')):
+        try:
+            name, refseq, exon, cdna_mut, prot_mut = dest.split(':')
+        except ValueError as e:
+            print(e, line)
+            continue
+
+        try:
+            assert refseq.startswith('NM_')
+        except AssertionError as e:
+            print(e, line)
+            continue
+        # refseq = int(refseq[3:])
+        # name and refseq are redundant with respect one to another
+
+        assert cdna_mut.startswith('c')
+        try:
+            cdna_ref, cdna_pos, cdna_alt = decode_mutation(cdna_mut)
+        except ValueError as e:
+            print(e, line)
+            continue
+
+        assert prot_mut.startswith('p')
+        # we can check here if a given reference nuc is consistent
+        # with the reference amino acid. For example cytosine in
+        # reference implies that there should't be a methionine,
+        # glutamic acid, lysine nor arginine. The same applies to
+        # alternative nuc/aa and their combinations (having
+        # references (nuc, aa): (G, K) and alt nuc C defines that
+        # the alt aa has to be Asparagine (N) - no other is valid).
+        # Note: it could be used to compress the data in memory too
+        aa_ref, aa_pos, aa_alt = decode_mutation(prot_mut)
+
+        try:
+            # try to get it from cache (`proteins` dictionary)
+            protein = proteins[refseq]
+        except KeyError:
+            continue
+
+        assert aa_pos == (int(cdna_pos) - 1) // 3 + 1
+
+        broken_sequence_tuple = is_sequence_broken(protein, aa_pos, aa_ref, aa_alt)
+
+        if broken_sequence_tuple:
+            broken_seq[refseq].append(broken_sequence_tuple)
+            continue
+
+        yield chrom, pos, ref, alt, exon, cdna_ref, cdna_pos, cdna_alt, aa_ref, aa_pos, aa_alt, protein
+
+
+def genome_proteome_mapping(mapping) -> Optional[Tuple[bytes, bytes]]:
+    """Make (snv, encoded record) item for dna_to_protein database from a parsed mapping.
+
+    Returns None if the mapping is inconsistent.
+    """
+    chrom, pos, ref, alt, exon, cdna_ref, cdna_pos, cdna_alt, aa_ref, aa_pos, aa_alt, protein = mapping
+
+    assert exon.startswith('exon')
+    exon = exon[4:]
+
+    try:
+        strand = determine_strand(ref, cdna_ref, alt, cdna_alt)
+    except DataInconsistencyError as e:
+        print(e, chrom, pos, ref, alt)
+        return None
+
+    is_ptm_related = protein.would_affect_any_sites(aa_pos)
+
+    snv = make_snv_key(chrom, pos, cdna_ref, cdna_alt)
+
+    item = encode_record(
+        strand,
+        aa_ref,
+        aa_alt,
+        cdna_pos,
+        exon,
+        protein.id,
+        is_ptm_related
+    )
+    return snv, item
+
+
+def aminoacid_refseq_mapping(mapping) -> Tuple[str, int]:
+    """Make ('GENE X1Y', protein id) item for gene_to_isoform database from a parsed mapping."""
+    aa_ref, aa_pos, aa_alt, protein = mapping[-4:]
+    return protein.gene_name + ' ' + aa_ref + str(aa_pos) + aa_alt, protein.id
+
+
+def reset_hash_set(hash_set: HashSetWithCache, config_key: str, bdb_dir: str, size):
+    hash_set.reset()
+    hash_set.close()
+
+    path = current_app.config[config_key]
+
+    if bdb_dir:
+        path = bdb_dir + '/' + basename(path)
+
+    hash_set.open(path, size=size, dupsort=hash_set.dupsort)
+
+
+def import_mappings(
     proteins: Dict[str, Protein],
     mappings_dir='data/200616/all_variants/playground',
     mappings_file_pattern='annot_*.txt.gz',
-    bdb_dir=''
+    bdb_dir='',
+    processes=1,
+    genome_proteome=True,
+    aminoacid_refseq=True
 ):
+    """Import DNA -> protein (`bdb`) and/or gene mutation -> isoforms (`bdb_refseq`) mappings.
+
+    Both databases are built from the same files; when both are requested,
+    the files are decompressed and parsed only once.
+
+    If more than one process is requested, the files will be parsed by worker
+    processes (one file at a time) into sorted runs, which are then merged into
+    the databases in the key order - see `import_mappings_sharded`.
+
+    Returns:
+        refseq -> list of problems mapping, for isoforms with sequence inconsistent with mappings
+    """
     print('Importing mappings:')
 
+    targets = []
+    if genome_proteome:
+        reset_hash_set(bdb, 'HDB_DNA_TO_PROTEIN_PATH', bdb_dir, size=5*1e10)
+        targets.append((bdb, genome_proteome_mapping))
+    if aminoacid_refseq:
+        reset_hash_set(bdb_refseq, 'HDB_GENE_TO_ISOFORM_PATH', bdb_dir, size=2*1e10)
+        targets.append((bdb_refseq, aminoacid_refseq_mapping))
+
+    with stage('Loading proteins'):
+        snapshot = snapshot_proteins(proteins)
+
+    if processes > 1:
+        files = get_files(mappings_dir, mappings_file_pattern)
+        return import_mappings_sharded(snapshot, files, processes, targets)
+
     chromosomes = get_human_chromosomes()
     broken_seq = defaultdict(list)
 
-    bdb.reset()
-    bdb.close()
+    def flush_caches():
+        for hash_set, make_item in targets:
+            hash_set.flush_cache()
 
-    path = current_app.config['HDB_DNA_TO_PROTEIN_PATH']
+    with stage('Parsing and writing mappings'), ExitStack() as sessions:
+        for hash_set, make_item in targets:
+            sessions.enter_context(hash_set.cached_session())
 
-    if bdb_dir:
-        path = bdb_dir + '/' + basename(path)
+        adders = [
+            (hash_set.cached_add, make_item)
+            for hash_set, make_item in targets
+        ]
 
-    bdb.open(path, size=5*1e10)
-
-    with bdb.cached_session():
-        add = bdb.cached_add
-        for line in read_from_gz_files(mappings_dir, mappings_file_pattern, after_batch=bdb.flush_cache):
-            try:
-                chrom, pos, ref, alt, prot = line.rstrip().split('\t')
-            except ValueError as e:
-                print(e, line)
-                continue
-
-            assert chrom.startswith('chr')
-            chrom = chrom[3:]
-
-            assert chrom in chromosomes
-            ref = ref.rstrip()
-
-            # new Coding Sequence Variants to be added to those already
-            # mapped from given `snv` (Single Nucleotide Variation)
-
-            for dest in filter(bool, prot.split(',')):
-                try:
-                    name, refseq, exon, cdna_mut, prot_mut = dest.split(':')
-                except ValueError as e:
-                    print(e, line)
-                    continue
-
-                try:
-                    assert refseq.startswith('NM_')
-                except AssertionError as e:
-                    print(e, line)
-                    continue
-                # refseq = int(refseq[3:])
-                # name and refseq are redundant with respect one to another
-
-                assert exon.startswith('exon')
-                exon = exon[4:]
-
-                assert cdna_mut.startswith('c')
-                try:
-                    cdna_ref, cdna_pos, cdna_alt = decode_mutation(cdna_mut)
-                except ValueError as e:
-                    print(e, line)
-                    continue
-
-                try:
-                    strand = determine_strand(ref, cdna_ref, alt, cdna_alt)
-                except DataInconsistencyError as e:
-                    print(e, line)
-                    continue
-
-                assert prot_mut.startswith('p')
-                # we can check here if a given reference nuc is consistent
-                # with the reference amino acid. For example cytosine in
-                # reference implies that there should't be a methionine,
-                # glutamic acid, lysine nor arginine. The same applies to
-                # alternative nuc/aa and their combinations (having
-                # references (nuc, aa): (G, K) and alt nuc C defines that
-                # the alt aa has to be Asparagine (N) - no other is valid).
-                # Note: it could be used to compress the data in memory too
-                aa_ref, aa_pos, aa_alt = decode_mutation(prot_mut)
-
-                try:
-                    # try to get it from cache (`proteins` dictionary)
-                    protein = proteins[refseq]
-                except KeyError:
-                    continue
-
-                assert aa_pos == (int(cdna_pos) - 1) // 3 + 1
-
-                broken_sequence_tuple = is_sequence_broken(protein, aa_pos, aa_ref, aa_alt)
-
-                if broken_sequence_tuple:
-                    broken_seq[refseq].append(broken_sequence_tuple)
-                    continue
-
-                is_ptm_related = protein.would_affect_any_sites(aa_pos)
-
-                snv = make_snv_key(chrom, pos, cdna_ref, cdna_alt)
-
-                # add new item, emulating set update
-                item = encode_csv(
-                    strand,
-                    aa_ref,
-                    aa_alt,
-                    cdna_pos,
-                    exon,
-                    protein.id,
-                    is_ptm_related
-                )
-
-                add(snv, item)
+        for line in read_from_gz_files(mappings_dir, mappings_file_pattern, after_batch=flush_caches):
+            for mapping in parse_mappings_line(line, snapshot, chromosomes, broken_seq):
+                # add new items, emulating set update
+                for add, make_item in adders:
+                    item = make_item(mapping)
+                    if item:
+                        add(*item)
 
     return broken_seq
 
 
-def import_aminoacid_mutation_refseq_mappings(
-    proteins: Dict[str, Protein],
-    mappings_dir='data/200616/all_variants/playground',
-    mappings_file_pattern='annot_*.txt.gz',
-    bdb_dir=''
-):
-    print('Importing mappings:')
+# state available to the worker processes
+_shard_proteins: Dict[str, ProteinSnapshot] = {}
+_shard_targets = []
+
+
+def _init_shard_worker(proteins: Dict[str, ProteinSnapshot], targets):
+    global _shard_proteins, _shard_targets
+    _shard_proteins = proteins
+    _shard_targets = targets
+
+
+def _map_file_to_runs(task) -> Tuple[List[List[str]], Dict[str, list]]:
+    """Parse a single mappings file into sorted run files (in a worker process).
+
+    Returns:
+        lists of run files (one list for each of the targets) and sequence problems
+    """
+    path, runs_dir, run_size = task
 
     chromosomes = get_human_chromosomes()
+    broken_seq = defaultdict(list)
+    caches = [defaultdict(set) for _ in _shard_targets]
+    runs = [[] for _ in _shard_targets]
+
+    def dump_runs():
+        for i, (hash_set, make_item) in enumerate(_shard_targets):
+            run_path = f'{runs_dir}/{basename(path)}.{i}.{len(runs[i])}.run'
+            hash_set.dump_run(run_path, caches[i])
+            runs[i].append(run_path)
+            caches[i].clear()
+
+    with fast_gzip_read(path, processes=1, as_str=True) as f:
+        next(f)     # skip header
+        for line in f:
+            for mapping in parse_mappings_line(line, _shard_proteins, chromosomes, broken_seq):
+                for cache, (hash_set, make_item) in zip(caches, _shard_targets):
+                    item = make_item(mapping)
+                    if item:
+                        key, value = item
+                        cache[as_key(key)].add(value)
+            if any(len(cache) >= run_size for cache in caches):
+                dump_runs()
+
+    dump_runs()
+
+    return runs, dict(broken_seq)
+
+
+def import_mappings_sharded(
+    proteins: Dict[str, ProteinSnapshot], files: List[str], processes: int, targets, run_size=1000000
+):
+    """Parse mappings files in parallel and merge them into the (open and empty) target databases.
 
-    bdb_refseq.reset()
-    bdb_refseq.close()
+    Each worker parses one file at a time, encoding the values and dumping
+    them into sorted run files (up to `run_size` keys each). The runs are
+    then merged and written into the databases in the key order, using the
+    append mode of lmdb (so no read-modify-write cycles are needed).
 
-    path = current_app.config['HDB_GENE_TO_ISOFORM_PATH']
+    Args:
+        targets: list of (hash set, function making an item from parsed mapping) tuples
+    """
+    broken_seq = defaultdict(list)
+    runs = [[] for _ in targets]
+
+    # the runs may be large, keep them next to the database rather than in /tmp
+    with TemporaryDirectory(dir=targets[0][0].path.parent) as runs_dir:
+        tasks = [(path, runs_dir, run_size) for path in files]
+
+        with stage(f'Parsing {len(files)} files using {processes} processes'):
+            # the target databases (with open environments) are passed to
+            # the workers without pickling, which requires the fork start method
+            pool = get_context('fork').Pool(processes, initializer=_init_shard_worker, initargs=(proteins, targets))
+            with pool:
+                results = pool.imap_unordered(_map_file_to_runs, tasks)
+                for file_runs, file_broken_seq in tqdm(results, total=len(tasks), unit=' files'):
+                    for target_runs, new_runs in zip(runs, file_runs):
+                        target_runs.extend(new_runs)
+                    for refseq, problems in file_broken_seq.items():
+                        broken_seq[refseq].extend(problems)
+
+        for (hash_set, make_item), target_runs in zip(targets, runs):
+            with stage(f'Merging {len(target_runs)} sorted runs into {hash_set.name}'):
+                written = hash_set.load_runs(target_runs)
+                print(f'Written {written} keys')
 
-    if bdb_dir:
-        path = bdb_dir + '/' + basename(path)
+    return broken_seq
 
-    bdb_refseq.open(path, size=2*1e10)
 
-    genes = {
-        protein: protein.gene_name
-        for protein in proteins.values()
-    }
+def import_genome_proteome_mappings(
+    proteins: Dict[str, Protein],
+    mappings_dir='data/200616/all_variants/playground',
+    mappings_file_pattern='annot_*.txt.gz',
+    bdb_dir='',
+    processes=1
+):
+    return import_mappings(
+        proteins, mappings_dir, mappings_file_pattern, bdb_dir, processes,
+        genome_proteome=True, aminoacid_refseq=False
+    )
 
-    with bdb_refseq.cached_session():
-        add = bdb_refseq.cached_add_integer
-        for line in read_from_gz_files(mappings_dir, mappings_file_pattern, after_batch=bdb_refseq.flush_cache):
-            try:
-                chrom, pos, ref, alt, prot = line.rstrip().split('\t')
-            except ValueError:
-                print('Import error: not enough values for "tab" split')
-                print(line)
-                continue
-
-            assert chrom.startswith('chr')
-            chrom = chrom[3:]
-
-            assert chrom in chromosomes
-
-            for dest in filter(bool, prot.split(',')):
-                try:
-                    name, refseq, exon, cdna_mut, prot_mut = dest.split(':')
-                except ValueError:
-                    print('Import error: not enough values for ":" split')
-                    print(line)
-                    print(dest)
-                    continue
-
-                try:
-                    assert refseq.startswith('NM_')
-                except AssertionError:
-                    print('Import error: refseq does not start with NM_:')
-                    print(line)
-                    print(refseq)
-                    continue
-
-                try:
-                    assert cdna_mut.startswith('c')
-                    cdna_ref, cdna_pos, cdna_alt = decode_mutation(cdna_mut)
-
-                    assert prot_mut.startswith('p')
-
-                    aa_ref, aa_pos, aa_alt = decode_mutation(prot_mut)
-
-                    try:
-                        # try to get it from cache (`proteins` dictionary)
-                        protein = proteins[refseq]
-                    except KeyError:
-                        continue
-
-                    assert aa_pos == (int(cdna_pos) - 1) // 3 + 1
-
-                    broken_sequence_tuple = is_sequence_broken(protein, aa_pos, aa_ref, aa_alt)
-
-                    if broken_sequence_tuple:
-                        continue
-
-                    add(
-                        genes[protein] + ' ' + aa_ref + str(aa_pos) + aa_alt,
-                        protein.id
-                    )
-                except Exception as e:
-                    print('Import error:')
-                    print(e)
+
+def import_aminoacid_mutation_refseq_mappings(
+    proteins: Dict[str, Protein],
+    mappings_dir='data/200616/all_variants/playground',
+    mappings_file_pattern='annot_*.txt.gz',
+    bdb_dir='',
+    processes=1
+):
+    import_mappings(
+        proteins, mappings_dir, mappings_file_pattern, bdb_dir, processes,
+        genome_proteome=False, aminoacid_refseq=True
+    )
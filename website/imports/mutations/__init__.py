@@ -6,6 +6,8 @@ from helpers.parsers import get_files
 from imports.protein_data import get_proteins
 
 from .mutation_importer import MutationImporter
+from .mutation_importer.base_importer import MutationKeyIndex
+from .parallel import parallel_load
 
 
 # rename to MutationOperationManager?
@@ -68,11 +70,27 @@ class MutationImportManager:
         if not proteins:
             proteins = get_proteins()
 
+        # keys of existing mutations are loaded once, for all the importers
+        mutation_keys = MutationKeyIndex()
+
+        processes = kwargs.pop('processes', 1)
+
+        if action == 'load' and processes > 1:
+            parallel_load(
+                {
+                    name: importer_class(proteins, mutation_keys=mutation_keys)
+                    for name, importer_class in importers.items()
+                },
+                paths, processes, **kwargs
+            )
+            print(f'Mutations {action}ed')
+            return
+
         for name, importer_class in importers.items():
             if paths:
                 path = paths[name]
 
-            importer = importer_class(proteins)
+            importer = importer_class(proteins, mutation_keys=mutation_keys)
             method = getattr(importer, action)
             method(path=path, **kwargs)
 
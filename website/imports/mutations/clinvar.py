@@ -8,7 +8,7 @@ from models import InheritedMutation, Disease
 from models import ClinicalData, or_
 from helpers.parsers import tsv_file_iterator
 from helpers.parsers import gzip_open_text
-from database.bulk import get_highest_id, bulk_orm_insert, restart_autoincrement
+from database.bulk import get_highest_id, bulk_insert, restart_autoincrement
 from database import db
 
 from .mutation_importer import MutationImporter
@@ -58,13 +58,12 @@ class ClinVarImporter(MutationImporter):
         self.skipped_variation_types = set()
         self.skipped_species = set()
 
-    def load(self, path=None, update=False, clinvar_xml_path=None, **ignored_kwargs):
+    def prepare_load(self, clinvar_xml_path=None, **kwargs):
         print(
             'Please note that the annovar and XML database needs to be based on the same ClinVar release'
             ' to avoid incorrect removal of variants which are missing metadata (i.e. not found in the XML file)'
         )
         self.xml_path = clinvar_xml_path or self.default_xml_path
-        super().load(path, update, **ignored_kwargs)
 
     @staticmethod
     def _beautify_disease_name(name):
@@ -423,6 +422,7 @@ class ClinVarImporter(MutationImporter):
         empty_mutations_cnt = InheritedMutation.query.filter(~InheritedMutation.clin_data.any()).delete(
             synchronize_session='fetch'
         )
+        self.update_sources_mask()
         db.session.commit()
         print(f'Removed {empty_mutations_cnt} ClinVar mutations without associations')
 
@@ -434,6 +434,9 @@ class ClinVarImporter(MutationImporter):
     def _load(self, path, update, **kwargs):
         skip_removal = kwargs.pop('skip_removal', False)
         super()._load(path, update, **kwargs)
+        self.finish_load(skip_removal=skip_removal)
+
+    def finish_load(self, skip_removal=False, **kwargs):
         self.import_disease_associations()
         if not skip_removal:
             self.remove_muts_without_origin()
@@ -660,7 +663,7 @@ class ClinVarImporter(MutationImporter):
 
         print(f'{duplicates} duplicates found')
 
-        return clinvar_mutations, clinvar_data, new_diseases.values()
+        return clinvar_mutations, clinvar_data, list(new_diseases.values())
 
     def export_details_headers(self):
         return ['disease', 'significance', 'has_significance_conflict']
@@ -676,13 +679,13 @@ class ClinVarImporter(MutationImporter):
 
         disease_columns = ('name', *self.disease_id_clinvar_to_db.values())
 
-        bulk_orm_insert(
+        bulk_insert(
             Disease,
             disease_columns,
             [disease_data for pk, disease_data in new_diseases]
         )
         self.insert_list(clinvar_mutations)
-        bulk_orm_insert(
+        bulk_insert(
             ClinicalData,
             ('inherited_id', 'disease_id', 'variation_id'),
             clinvar_data
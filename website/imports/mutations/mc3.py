@@ -32,6 +32,7 @@ class MC3Importer(TCGAImporter):
     # 'GeneDetail.refGene', 'ExonicFunc.refGene', 'AAChange.refGene', 'Tumor_Sample_Barcode']
     header = None
     tss_cancer_map_path = 'data/mutations/tissue_source_site_codes.tsv'
+    hypermutation_threshold = 900
 
     def extract_cancer_name(self, sample_name):
         tss_code = sample_name.split('-')[1]
@@ -45,17 +46,3 @@ class MC3Importer(TCGAImporter):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.cancer_barcodes = load_tss_cancer_map(self.tss_cancer_map_path)
-
-    def parse(self, path):
-        from stats import hypermutated_samples
-
-        print(
-            'Analyzing data to find hypermutated samples '
-            '(samples with > 900 mutations - i.e. roughly 30 muts/megabase)'
-        )
-        hypermutated = hypermutated_samples(path, sample_column=10)
-        self.samples_to_skip = set(hypermutated.keys())
-        hypermutated_count = len(self.samples_to_skip)
-        print(f'{hypermutated_count} samples are hypermutated and will be skipped at import.')
-
-        return super().parse(path)
@@ -2,7 +2,7 @@ from warnings import warn
 
 from models import MIMPMutation, SiteType
 from helpers.bioinf import decode_raw_mutation
-from helpers.parsers import tsv_file_iterator, count_lines_tsv
+from helpers.parsers import tsv_file_iterator, tsv_chunk_iterator
 
 from .mutation_importer import ChunkedMutationImporter
 
@@ -38,11 +38,11 @@ class MIMPImporter(ChunkedMutationImporter):
         return tsv_file_iterator(path, self.header)
 
     def iterate_chunk(self, path, chunk_start, chunk_size):
-        header = self.header if chunk_size == 0 else None
-        return tsv_file_iterator(path, header, skip=chunk_start, limit=chunk_size)
+        offset = self.chunk_offset(path, chunk_start)
+        return tsv_chunk_iterator(path, offset, limit=chunk_size)
 
     def count_lines(self, path) -> int:
-        return count_lines_tsv(path)
+        return self.chunk_index(path).lines_count
 
     def parse_chunk(self, path, chunk_start, chunk_size):
         mimps = []
@@ -81,7 +81,8 @@ class MIMPImporter(ChunkedMutationImporter):
                 site
                 for site in protein.sites
                 if site.position == psite_pos
-                and any(t == site_type for t in site.types)
+                # compared by id, as proteins may come from a snapshot shared with worker processes
+                and any(t.id == site_type.id for t in site.types)
             ]
 
             # as this is site-type specific and only one site object of given type should be placed at a position,
@@ -9,14 +9,15 @@ from sqlalchemy.util import classproperty
 from werkzeug.utils import cached_property
 
 from database import db, create_key_model_dict
-from database.bulk import bulk_orm_insert, restart_autoincrement
+from database.bulk import bulk_insert, restart_autoincrement
 from database.manage import raw_delete_all, remove_model
 from helpers.bioinf import decode_mutation, is_sequence_broken
+from helpers.parsers import ChunkIndex, load_chunk_index
 from helpers.patterns import abstract_property
-from models import Protein, Mutation
+from models import Protein, Mutation, source_manager
 
 from ...importer import BioImporter
-from .base_importer import BaseMutationsImporter
+from .base_importer import BaseMutationsImporter, MutationKeyIndex
 from .exporter import MutationExporter
 
 
@@ -31,14 +32,22 @@ class MutationImporter(BioImporter, MutationExporter):
     insert_keys = None
     model = None
 
-    def __init__(self, proteins=None):
+    # importers of the same group write to the same tables (other than mutations
+    # and their own details) while parsing, thus these are never parsed concurrently
+    parallel_group = None
+
+    def __init__(self, proteins=None, mutation_keys: MutationKeyIndex = None):
         self.mutations_details_pointers_grouped_by_unique_mutations = defaultdict(list)
         self._proteins = proteins
         self.broken_seq = defaultdict(list)
 
         # used to save 'cores of mutations': Mutation objects which have
-        # columns like 'position', 'alt', 'protein' and no other details.
-        self.base_importer = BaseMutationsImporter()
+        # columns like 'position', 'alt', 'protein' and no other details;
+        # the index of keys of mutations may be shared between importers
+        self.base_importer = BaseMutationsImporter(mutation_keys)
+
+        # ids of mutations which got details with insert_list (None if it was not used)
+        self.inserted_mutation_ids = None
 
     @cached_property
     def proteins(self):
@@ -85,8 +94,15 @@ class MutationImporter(BioImporter, MutationExporter):
 
         path = self.choose_path(path)
 
+        self.prepare_load(**kwargs)
+
         self._load(path, update, **kwargs)
 
+        self.report_broken_sequences()
+
+        print(f'Loaded {self.model_name}.')
+
+    def report_broken_sequences(self):
         if self.broken_seq:
             report_file = 'broken_seq_' + self.model_name + '.log'
 
@@ -106,13 +122,18 @@ class MutationImporter(BioImporter, MutationExporter):
                 )
             )
 
-        print(f'Loaded {self.model_name}.')
-
     parse_kwargs = []
 
+    def parse_tasks(self, path, **kwargs) -> List[dict]:
+        """Keyword arguments of subsequent `parse` calls needed to load the data from path."""
+        return [{k: v for k, v in kwargs.items() if k in self.parse_kwargs}]
+
     def _load(self, path, update, **kwargs):
+        mutation_details = self._parse(path, **kwargs)
+        self._insert(mutation_details, update)
 
-        self.base_importer.prepare()
+    def _parse(self, path, first_id=None, **kwargs):
+        self.base_importer.prepare(first_id)
 
         gc.collect()
 
@@ -120,22 +141,34 @@ class MutationImporter(BioImporter, MutationExporter):
         # populate 'self.base_importer.mutations' with new tuples of data
         # necessary to create rows corresponding to 'Mutation' instances.
         parse_kwargs = {k: v for k, v in kwargs.items() if k in self.parse_kwargs}
-        mutation_details = self.parse(path, **parse_kwargs)
+        return self.parse(path, **parse_kwargs)
 
+    def _insert(self, mutation_details, update):
         # first insert new 'Mutation' data
         self.base_importer.insert()
 
+        self.inserted_mutation_ids = None
+
         # then insert or update details about mutation (so self.model entries)
         if update:
             self.update_details(mutation_details)
         else:
             self.insert_details(mutation_details)
 
+        # only the mutations of this batch need to be updated (unless unknown)
+        self.update_sources_mask(None if update else self.inserted_mutation_ids)
+
         self.commit()
 
         db.session.expire_all()
         gc.collect()
 
+    def prepare_load(self, **kwargs):
+        """Set up the state needed to load the data (also when loaded in parallel)."""
+
+    def finish_load(self, **kwargs):
+        """Steps to be performed once all the data are inserted (also when loaded in parallel)."""
+
     def test_line(self, line):
         """Whether the line should be imported/exported or not"""
         return True
@@ -270,7 +303,7 @@ class MutationImporter(BioImporter, MutationExporter):
     def insert_details(self, data):
         """Create instances of self.model using provided data and add them to
         session (flushing is allowed, committing is highly not recommended).
-        Use of db.session methods like 'bulk_insert_mappings' is recommended."""
+        Use of `insert_list` (or `database.bulk.bulk_insert`) is recommended."""
 
     # @abstractmethod
     # TODO: make it abstract and add it to all importers, altogether with tests
@@ -287,7 +320,16 @@ class MutationImporter(BioImporter, MutationExporter):
             raise Exception(
                 'To use insert_list, you have to specify insert_keys'
             )
-        bulk_orm_insert(self.model, self.insert_keys, data)
+        if 'mutation_id' in self.insert_keys:
+            data = self._record_mutation_ids(data, self.insert_keys.index('mutation_id'))
+        bulk_insert(self.model, self.insert_keys, data)
+
+    def _record_mutation_ids(self, data, index):
+        if self.inserted_mutation_ids is None:
+            self.inserted_mutation_ids = set()
+        for row in data:
+            self.inserted_mutation_ids.add(row[index])
+            yield row
 
     def raw_delete_all(self, model):
         """In subclasses you can overwrite this function
@@ -304,6 +346,16 @@ class MutationImporter(BioImporter, MutationExporter):
     def remove(self, **kwargs):
         """Do not overwrite this function"""
         remove_model(self.model, self.raw_delete_all, self.restart_autoincrement)
+        self.update_sources_mask()
+        self.commit()
+
+    def update_sources_mask(self, mutation_ids=None):
+        """Update bits of self.model in Mutation.sources_mask after raw (bulk) changes of details
+
+        (of mutations with given ids, or of all mutations).
+        """
+        if self.model in source_manager.bits:
+            Mutation.update_sources_mask(self.model, mutation_ids)
 
     def get_or_make_mutation(self, pos, protein_id, alt, is_ptm):
         mutation_id = self.base_importer.get_or_make_mutation(
@@ -311,7 +363,7 @@ class MutationImporter(BioImporter, MutationExporter):
         )
         return mutation_id
 
-    def preparse_mutations(self, line: List[str]):
+    def preparse_mutations(self, line: List[str], broken_seq=None):
         """Preparse mutations from a line of Annovar annotation file.
 
         Given line should be already split by correct separator (usually
@@ -322,7 +374,13 @@ class MutationImporter(BioImporter, MutationExporter):
         test from `test_data.py` script.
 
         For more explanation, check #43 issue on GitHub.
+
+        Sequence mismatches are recorded in `broken_seq` (a list of these
+        for each refseq), by default in the broken sequence report.
         """
+        if broken_seq is None:
+            broken_seq = self.broken_seq
+
         for mutation in [
             m.split(':')
             for m in line[9].split(';')[0].split(',')
@@ -341,7 +399,7 @@ class MutationImporter(BioImporter, MutationExporter):
             broken_sequence_tuple = is_sequence_broken(protein, pos, ref, alt)
 
             if broken_sequence_tuple:
-                self.broken_seq[refseq].append(broken_sequence_tuple)
+                broken_seq[refseq].append(broken_sequence_tuple)
                 continue
 
             is_ptm_related = protein.has_sites_in_range(pos - 7, pos + 7)
@@ -421,10 +479,22 @@ class ChunkedMutationImporter(MutationImporter):
     def parse_chunk(self, path, chunk_start, chunk_size):
         pass
 
+    def chunk_index(self, path) -> ChunkIndex:
+        """Lines count and byte offsets of chunks of an uncompressed file.
+
+        The file is indexed in a single pass on the first use;
+        afterwards the index is read from the cache next to the file.
+        """
+        return load_chunk_index(path, self.chunk_size)
+
+    def chunk_offset(self, path, chunk_start) -> int:
+        """Byte offset of the chunk starting at given line, to seek() directly to."""
+        return self.chunk_index(path).offsets[chunk_start // self.chunk_size]
+
     def parse(self, path, chunk_start, chunk_size):
         return self.parse_chunk(path, chunk_start, chunk_size)
 
-    def _load(self, path, update, chunk=None, **kwargs):
+    def _chunks(self, path, chunk=None):
         total = self.count_lines(path)
         chunks = (
             list(range(0, total, self.chunk_size))
@@ -434,6 +504,17 @@ class ChunkedMutationImporter(MutationImporter):
         if chunk is not None:
             print(f'Limiting imported chunks to {chunk+1}-th chunk out of {len(chunks)}')
             chunks = [chunks[chunk]]
+        return total, chunks
+
+    def parse_tasks(self, path, chunk=None, **kwargs):
+        total, chunks = self._chunks(path, chunk)
+        return [
+            {'chunk_start': chunk_start, 'chunk_size': self.chunk_size}
+            for chunk_start in chunks
+        ]
+
+    def _load(self, path, update, chunk=None, **kwargs):
+        total, chunks = self._chunks(path, chunk)
         for chunk_start in chunks:
             print(f'Importing chunk from {chunk_start/total*100:.2f} to {(chunk_start + self.chunk_size)/total*100:.2f}:')
             super()._load(path, update, chunk_start=chunk_start, chunk_size=self.chunk_size)
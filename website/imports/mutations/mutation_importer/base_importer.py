@@ -1,20 +1,101 @@
+from array import array
+from string import ascii_uppercase
+from typing import Dict, Tuple
+
+import numpy as np
+
 from database import db
-from database.bulk import get_highest_id
-from helpers.parsers import chunked_list
+from database.bulk import get_highest_id, bulk_insert
 from models import Mutation
 
 
+# codes of alternative residues, fitting in five bits
+alt_codes = {alt: code for code, alt in enumerate(ascii_uppercase + '*')}
+
+
+class MutationKeyIndex:
+    """In-memory index of (pos, protein_id, alt) keys of mutations in the database.
+
+    All the keys are loaded (lazily, on the first look-up) with a single,
+    streamed query and packed into one sorted array of 64-bit integers
+    (protein_id, position and alternative residue code), searched by bisection,
+    with identifiers of mutations in a parallel array. Keys of mutations
+    inserted later (or with unusual alternative residues) are kept in a dict.
+
+    The index is meant to be shared by importers run one after another,
+    so that the keys are loaded only once; it does not see mutations
+    inserted or removed by other means.
+    """
+
+    def __init__(self):
+        self.keys = None
+        self.ids = None
+        self.extra: Dict[Tuple[int, int, str], int] = {}
+
+    @staticmethod
+    def pack(pos, protein_id, alt):
+        code = alt_codes.get(alt)
+        if code is None or pos is None or protein_id is None or not 0 <= pos < 1 << 27:
+            return None
+        return (protein_id << 32) | (pos << 5) | code
+
+    def load(self, batch_size=100000):
+        keys = array('q')
+        ids = array('q')
+        extra = {}
+
+        query = (
+            db.session.query(Mutation.position, Mutation.protein_id, Mutation.alt, Mutation.id)
+            .yield_per(batch_size)
+        )
+        for pos, protein_id, alt, mutation_id in query:
+            key = self.pack(pos, protein_id, alt)
+            if key is None:
+                extra[pos, protein_id, alt] = mutation_id
+            else:
+                keys.append(key)
+                ids.append(mutation_id)
+
+        keys = np.frombuffer(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.ids = np.frombuffer(ids, dtype=np.int64)[order]
+        extra.update(self.extra)
+        self.extra = extra
+
+    def get(self, pos, protein_id, alt):
+        """Identifier of the mutation with given key, or None if not in the database."""
+        if self.keys is None:
+            self.load()
+
+        key = self.pack(pos, protein_id, alt)
+        if key is not None:
+            i = self.keys.searchsorted(key)
+            if i < len(self.keys) and self.keys[i] == key:
+                return int(self.ids[i])
+
+        return self.extra.get((pos, protein_id, alt))
+
+    def update(self, mutations: Dict[Tuple[int, int, str], int]):
+        """Register identifiers of newly inserted mutations, by (pos, protein_id, alt) keys."""
+        self.extra.update(mutations)
+
+
 class BaseMutationsImporter:
     """Imports 'cores of mutations' - data used to build 'Mutation' instances
     so columns common for different metadata like: 'position', 'alt' etc."""
 
-    def prepare(self):
+    def __init__(self, mutation_keys: MutationKeyIndex = None):
+        self.mutation_keys = mutation_keys if mutation_keys is not None else MutationKeyIndex()
+
+    def prepare(self, first_id=None):
         # reset base_mutations
         self.mutations = {}
 
         # for bulk_inserts it's needed to generate identifiers manually so
-        # here the highest id currently in use in the database is retrieved.
-        self.highest_base_id = self.get_highest_id()
+        # here the highest id currently in use in the database is retrieved
+        # (unless the identifiers should start from given, provisional id).
+        self.highest_base_id = self.get_highest_id() if first_id is None else first_id - 1
 
     def get_highest_id(self):
         return get_highest_id(Mutation)
@@ -26,9 +107,7 @@ class BaseMutationsImporter:
             return self.mutations[key][0]
         else:
 
-            mutation_id = db.session.query(Mutation.id).filter_by(
-                position=pos, protein_id=protein_id, alt=alt
-            ).scalar()
+            mutation_id = self.mutation_keys.get(pos, protein_id, alt)
 
             if mutation_id is None:
                 self.highest_base_id += 1
@@ -37,19 +116,25 @@ class BaseMutationsImporter:
 
             return mutation_id
 
+    # all columns with defaults are given explicitly so that fast writers (which
+    # do not apply Python-side defaults) can be used; the bits of sources_mask
+    # are set after the details are inserted (see Mutation.update_sources_mask)
+    insert_columns = (
+        'id', 'precomputed_is_ptm', 'position', 'protein_id', 'alt',
+        'sources_mask', 'were_affected_motifs_precomputed'
+    )
+
     def insert(self):
-        for chunk in chunked_list(self.mutations.items()):
-            db.session.bulk_insert_mappings(
-                Mutation,
-                [
-                    {
-                        'id': data[0],
-                        'precomputed_is_ptm': data[1],
-                        'position': mutation[0],
-                        'protein_id': mutation[1],
-                        'alt': mutation[2]
-                    }
-                    for mutation, data in chunk
-                ]
+        bulk_insert(
+            Mutation,
+            self.insert_columns,
+            (
+                (data[0], data[1], *mutation, 0, False)
+                for mutation, data in self.mutations.items()
             )
-            db.session.flush()
+        )
+
+        self.mutation_keys.update({
+            mutation: data[0]
+            for mutation, data in self.mutations.items()
+        })
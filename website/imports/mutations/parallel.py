@@ -0,0 +1,229 @@
+"""Loading of mutations from multiple sources, parsed in parallel.
+
+Sources are parsed concurrently in worker processes, which share (via fork)
+a read-only snapshot of proteins (with sites) and of the keys of mutations
+already present in the database. Workers do not assign final identifiers to
+new mutations: each parse task uses its own range of provisional identifiers.
+
+The main process then reconciles the new mutations of subsequent tasks, in
+the order of a sequential load (regardless of how the tasks were grouped
+between the workers): mutations already known (from the database or from previous
+tasks) keep their identifiers and the remaining ones get consecutive new
+identifiers, so the assignment is deterministic. Provisional identifiers
+in the parsed details are replaced with the final ones and the details
+are inserted, source by source.
+"""
+from collections import defaultdict
+from multiprocessing import Pool
+from typing import Dict, List, NamedTuple, Tuple
+from warnings import warn
+
+from flask import current_app
+from sqlalchemy.orm import selectinload
+
+from database import db, get_engine
+from helpers.parsers import chunked_list
+from models import Protein, Site
+
+from .mutation_importer import MutationImporter
+from .mutation_importer.base_importer import MutationKeyIndex
+
+
+# provisional identifiers of subsequent tasks start at multiples of this number;
+# these are far above the identifiers of mutations (and values in the details)
+PROVISIONAL_ID_STEP = 2 ** 40
+
+
+class ParseTask(NamedTuple):
+    source: str
+    path: str
+    parse_kwargs: dict
+    first_id: int
+
+
+class ParseResult(NamedTuple):
+    details: object
+    # new mutations: (pos, protein_id, alt) -> (provisional id, is_ptm)
+    mutations: Dict[Tuple[int, int, str], Tuple[int, bool]]
+    broken_seq: Dict[str, list]
+
+
+def replace_ids(data, mapping: Dict[int, int]):
+    """Replace provisional identifiers (keys of mapping) in nested containers of parsed details."""
+    data_type = type(data)
+    if data_type is int:
+        return mapping.get(data, data) if data >= PROVISIONAL_ID_STEP else data
+    if data_type in (list, tuple, set, frozenset):
+        return data_type(replace_ids(element, mapping) for element in data)
+    if data_type is dict:
+        return {
+            replace_ids(key, mapping): replace_ids(value, mapping)
+            for key, value in data.items()
+        }
+    return data
+
+
+_importers: Dict[str, MutationImporter] = None
+_proteins = None
+_mutation_keys: MutationKeyIndex = None
+
+
+def _init_parse_worker(importers, proteins, mutation_keys):
+    global _importers, _proteins, _mutation_keys
+    _importers = importers
+    _proteins = proteins
+    _mutation_keys = mutation_keys
+
+
+def _parse_group(tasks: List[ParseTask]) -> List[ParseResult]:
+    """Parse tasks of a group of sources, one after another (in a worker process)."""
+    results = []
+    for task in tasks:
+        importer = type(_importers[task.source])(_proteins, mutation_keys=_mutation_keys)
+        details = importer._parse(task.path, first_id=task.first_id, **task.parse_kwargs)
+        results.append(
+            ParseResult(
+                details=details,
+                mutations=importer.base_importer.mutations,
+                broken_seq=dict(importer.broken_seq)
+            )
+        )
+    # persist the rows created while parsing (e.g. cancers)
+    db.session.commit()
+    return results
+
+
+def preload_proteins(proteins: Dict[str, Protein], chunk_size=5000):
+    """Load sites (with types) of proteins and index these, so that workers do not query for them."""
+    for chunk in chunked_list([protein.id for protein in proteins.values()], chunk_size, progress=False):
+        (
+            Protein.query
+            .filter(Protein.id.in_(chunk))
+            .options(selectinload(Protein.sites).selectinload(Site.types))
+            .all()
+        )
+    for protein in proteins.values():
+        assert protein.site_index is not None
+
+
+def uses_memory_database() -> bool:
+    engine = get_engine('bio')
+    return engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:')
+
+
+def parallel_load(importers: Dict[str, MutationImporter], paths, processes: int, **kwargs):
+    """Load mutations from given sources, parsing these in up to `processes` worker processes.
+
+    Args:
+        importers: importers (sharing a single MutationKeyIndex), by source name
+        paths: paths to the files of given sources (optional)
+    """
+    mutation_keys = next(iter(importers.values())).base_importer.mutation_keys
+    proteins = next(iter(importers.values())).proteins
+
+    # the tasks are ordered by the source and then by the part (e.g. chunk) of the file
+    tasks_by_source = {}
+    groups = defaultdict(list)
+    first_id = PROVISIONAL_ID_STEP
+
+    for name, importer in importers.items():
+        path = importer.choose_path(paths.get(name) if paths else None)
+        importer.prepare_load(**kwargs)
+        tasks = tasks_by_source[name] = []
+        for parse_kwargs in importer.parse_tasks(path, **kwargs):
+            task = ParseTask(name, path, parse_kwargs, first_id)
+            first_id += PROVISIONAL_ID_STEP
+            tasks.append(task)
+            # tasks of the same group are parsed in a single worker, one after another
+            group = importer.parallel_group or task.first_id
+            groups[group].append(task)
+
+    groups = list(groups.values())
+
+    if mutation_keys.keys is None:
+        mutation_keys.load()
+
+    # commit before loading the snapshot as committing expires the loaded state
+    db.session.commit()
+    preload_proteins(proteins)
+
+    if processes > 1 and uses_memory_database():
+        warn('In-memory database cannot be shared with worker processes; parsing in the main process')
+        processes = 1
+
+    if processes > 1:
+        # workers should not share connections with the main process
+        db.session.close()
+        for bind_key in [None, *current_app.config['SQLALCHEMY_BINDS']]:
+            get_engine(bind_key).dispose()
+        pool = Pool(
+            min(processes, len(groups)),
+            initializer=_init_parse_worker,
+            initargs=(importers, proteins, mutation_keys)
+        )
+        results = pool.imap(_parse_group, groups)
+    else:
+        pool = None
+        _init_parse_worker(importers, proteins, mutation_keys)
+        results = map(_parse_group, groups)
+
+    # results are reconciled in the order of the tasks (as in a sequential load);
+    # results of tasks which are not due yet (parsed in a group with
+    # an earlier task) are buffered, by first_id, until their turn
+    ordered_tasks = iter([task for tasks in tasks_by_source.values() for task in tasks])
+    next_task = next(ordered_tasks, None)
+    buffered_results = {}
+
+    remaining_tasks = {name: len(tasks) for name, tasks in tasks_by_source.items()}
+
+    try:
+        for group, group_results in zip(groups, results):
+            buffered_results.update(
+                (task.first_id, result)
+                for task, result in zip(group, group_results)
+            )
+
+            while next_task and next_task.first_id in buffered_results:
+                task = next_task
+                result = buffered_results.pop(task.first_id)
+                next_task = next(ordered_tasks, None)
+
+                importer = importers[task.source]
+                print(f'Inserting {importer.model_name} (part {task.first_id // PROVISIONAL_ID_STEP}):')
+                details = reconcile(importer, result)
+                importer._insert(details, update=False)
+
+                remaining_tasks[task.source] -= 1
+                if not remaining_tasks[task.source]:
+                    importer.finish_load(**kwargs)
+                    importer.report_broken_sequences()
+                    print(f'Loaded {importer.model_name}.')
+        assert not buffered_results
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if processes > 1:
+        # re-attach the proteins (detached before forking) to the session
+        db.session.add_all(proteins.values())
+
+
+def reconcile(importer: MutationImporter, result: ParseResult):
+    """Assign final identifiers to the new mutations parsed by a worker.
+
+    Returns:
+        parsed details with the provisional identifiers replaced
+    """
+    base_importer = importer.base_importer
+    base_importer.prepare()
+
+    mapping = {
+        provisional_id: base_importer.get_or_make_mutation(*key, is_ptm)
+        for key, (provisional_id, is_ptm) in result.mutations.items()
+    }
+
+    for refseq, problems in result.broken_seq.items():
+        importer.broken_seq[refseq].extend(problems)
+
+    return replace_ids(result.details, mapping)
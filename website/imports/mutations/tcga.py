@@ -7,7 +7,6 @@ from database import get_or_create
 from models import Cancer
 from models import TCGAMutation
 from helpers.parsers import iterate_tsv_gz_file
-from helpers.parsers import chunked_list
 
 from .mutation_importer import MutationImporter
 
@@ -22,6 +21,12 @@ class TCGAImporter(MutationImporter):
         'GeneDetail.refGene', 'ExonicFunc.refGene', 'AAChange.refGene', 'V11'
     ]
     samples_to_skip = set()
+    # samples with more mutations (i.e. hypermutated ones) are not imported;
+    # these are found while reading the file, before any mutation is created
+    hypermutation_threshold = None
+    # cancers are created while parsing
+    parallel_group = 'cancers'
+    insert_keys = ('mutation_id', 'cancer_id', 'samples', 'count')
 
     def __init__(self, *args, export_samples=False, **kwargs):
         super().__init__(*args, **kwargs)
@@ -50,7 +55,7 @@ class TCGAImporter(MutationImporter):
         return cancer_name, sample_name
 
     def iterate_lines(self, path):
-        return iterate_tsv_gz_file(path, file_header=self.header)
+        return iterate_tsv_gz_file(path, file_header=self.header, with_total=self.hypermutation_threshold is None)
 
     def test_line(self, line):
         cancer_name, sample_name = self.decode_line(line)
@@ -62,30 +67,93 @@ class TCGAImporter(MutationImporter):
         return line
 
     def parse(self, path):
+        if self.hypermutation_threshold is None:
+            records = (
+                (*self.decode_line(line), self.preparse_mutations(line))
+                for line in self.iterate_lines(path)
+            )
+        else:
+            records = self.skip_hypermutated(self.iterate_lines(path))
 
         mutations = defaultdict(lambda: [0, set()])
+        cancers = {}
 
-        for line in self.iterate_lines(path):
-            cancer_name, sample_name = self.decode_line(line)
+        for cancer_name, sample_name, preparsed_mutations in records:
 
             if sample_name in self.samples_to_skip:
                 continue
 
-            cancer, created = get_or_create(Cancer, name=cancer_name)
+            cancer_id = cancers.get(cancer_name)
+
+            if cancer_id is None:
+                cancer, created = get_or_create(Cancer, name=cancer_name)
+
+                if created:
+                    # set code (temporarily) to the cancer name
+                    cancer.code = cancer_name
+                    db.session.add(cancer)
+                    db.session.flush()
+
+                cancer_id = cancers[cancer_name] = cancer.id
 
-            if created:
-                # set code (temporarily) to the cancer name
-                cancer.code = cancer_name
-                db.session.add(cancer)
+            for pos, protein, alt, ref, is_ptm_related in preparsed_mutations:
 
-            for mutation_id in self.get_or_make_mutations(line):
+                mutation_id = self.get_or_make_mutation(pos, protein.id, alt, is_ptm_related)
 
-                key = (mutation_id, cancer.id)
+                key = (mutation_id, cancer_id)
 
                 mutations[key][0] += 1
                 mutations[key][1].add(sample_name)
 
-        return mutations
+        return dict(mutations)
+
+    def skip_hypermutated(self, lines):
+        """Read all the lines (in a single pass) and yield records of those not from hypermutated samples.
+
+        The lines are reduced to records of the cancer, sample and the
+        mutations of proteins in the database (the remaining lines are
+        only counted); the samples are kept as integer identifiers.
+        Sequence mismatches are reported only for the samples which are kept.
+        """
+        from stats import SampleMutationsCounter
+
+        print(
+            'Analyzing data to find hypermutated samples '
+            f'(samples with > {self.hypermutation_threshold} mutations - i.e. roughly 30 muts/megabase)'
+        )
+        counter = SampleMutationsCounter()
+        cancer_names = {}
+        records = []
+        broken_records = []
+        line_broken_seq = defaultdict(list)
+
+        for line in lines:
+            cancer_name, sample_name = self.decode_line(line)
+            sample_id = counter.add(sample_name, line)
+
+            preparsed_mutations = tuple(self.preparse_mutations(line, line_broken_seq))
+            if preparsed_mutations:
+                cancer_name = cancer_names.setdefault(cancer_name, cancer_name)
+                records.append((sample_id, cancer_name, preparsed_mutations))
+            if line_broken_seq:
+                broken_records.append((sample_id, dict(line_broken_seq)))
+                line_broken_seq.clear()
+
+        hypermutated = counter.hypermutated(self.hypermutation_threshold)
+        self.samples_to_skip = set(hypermutated.keys())
+        hypermutated_count = len(self.samples_to_skip)
+        print(f'{hypermutated_count} samples are hypermutated and will be skipped at import.')
+
+        hypermutated_ids = {counter.sample_ids[sample] for sample in self.samples_to_skip}
+
+        for sample_id, broken_seq in broken_records:
+            if sample_id not in hypermutated_ids:
+                for refseq, problems in broken_seq.items():
+                    self.broken_seq[refseq].extend(problems)
+
+        for sample_id, cancer_name, preparsed_mutations in records:
+            if sample_id not in hypermutated_ids:
+                yield cancer_name, counter.sample_names[sample_id], preparsed_mutations
 
     def create_init_kwargs(self, mutation, data):
         return {
@@ -115,15 +183,13 @@ class TCGAImporter(MutationImporter):
         ]
 
     def insert_details(self, mutations):
-        for chunk in chunked_list(mutations.items()):
-            db.session.bulk_insert_mappings(
-                self.model,
-                [
-                    self.create_init_kwargs(mutation, data)
-                    for mutation, data in chunk
-                ]
+        self.insert_list(
+            [kwargs[key] for key in self.insert_keys]
+            for kwargs in (
+                self.create_init_kwargs(mutation, data)
+                for mutation, data in mutations.items()
             )
-            db.session.flush()
+        )
 
     def update_details(self, mutations):
         """Unfortunately mutation_id does not maps 1-1 for CancerMutation, so
@@ -8,13 +8,13 @@ from tqdm import tqdm
 from database import db, create_key_model_dict
 from database import get_or_create
 from helpers.bioinf import aa_symbols
-from helpers.parsers import parse_fasta_file, iterate_tsv_gz_file
+from helpers.parsers import parse_fasta_file, iterate_tsv_gz_file, chunked_list
 from helpers.parsers import parse_tsv_file
 from helpers.parsers import parse_text_file
 from imports.importer import simple_importer, BioImporter
 from models import (
     Domain, MC3Mutation, InheritedMutation, Mutation, SiteType,
-    SiteMotif, PCAWGMutation
+    SiteMotif, PCAWGMutation, Site, SiteIndex, source_manager
 )
 from models.bio.drug import DrugGroup, DrugType, Drug, DrugTarget
 from models import Gene
@@ -1130,16 +1130,46 @@ def active_pathways_lists(
 
 @simple_bio_importer(requires=[proteins_and_genes, *site_importers])
 def precompute_ptm_mutations():
-    print('Counting mutations...')
-    total = Mutation.query.filter_by(is_confirmed=True).count()
-    mismatch = 0
-    for mutation in tqdm(Mutation.query.filter_by(is_confirmed=True), total=total):
-        pos = mutation.position
-        is_ptm_related = mutation.protein.has_sites_in_range(pos - 7, pos + 7)
-        if is_ptm_related != mutation.precomputed_is_ptm:
-            mismatch += 1
-            mutation.precomputed_is_ptm = is_ptm_related
-    print(f'Precomputed values of {mismatch} mutations has been computed and updated')
+    print('Loading sites...')
+    sites_positions = defaultdict(list)
+    for protein_id, position in db.session.query(Site.protein_id, Site.position):
+        sites_positions[protein_id].append(position)
+
+    print('Loading mutations...')
+    query = (
+        db.session.query(Mutation.id, Mutation.protein_id, Mutation.position, Mutation.precomputed_is_ptm)
+        .filter_by(is_confirmed=True)
+    )
+    mutations_by_protein = defaultdict(list)
+    for mutation_id, protein_id, position, precomputed_is_ptm in tqdm(query.yield_per(10000), total=query.count()):
+        mutations_by_protein[protein_id].append((mutation_id, position, precomputed_is_ptm))
+
+    print('Checking proximity to sites...')
+    updates = {}
+    for protein_id, mutations in tqdm(mutations_by_protein.items()):
+        site_index = SiteIndex(sites_positions[protein_id])
+        mutations_ids, positions, precomputed = zip(*mutations)
+        # all mutations of the protein are checked at once
+        is_ptm_related = site_index.is_ptm_distal(positions)
+        for mutation_id, old_value, new_value in zip(mutations_ids, precomputed, is_ptm_related.tolist()):
+            if new_value != old_value:
+                updates[mutation_id] = new_value
+
+    for chunk in chunked_list(updates, progress=False):
+        for mutation in Mutation.query.filter(Mutation.id.in_(chunk)):
+            mutation.precomputed_is_ptm = updates[mutation.id]
+
+    print(f'Precomputed values of {len(updates)} mutations has been computed and updated')
+    return []
+
+
+@simple_bio_importer(requires=[proteins_and_genes])
+def mutations_sources_masks():
+    """Rebuild Mutation.sources_mask from the mutation details tables."""
+    updated = 0
+    for source in tqdm(source_manager.bits):
+        updated += Mutation.update_sources_mask(source)
+    print(f'Sources masks of {updated} mutations have been updated')
     return []
 
 
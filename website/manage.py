@@ -14,6 +14,7 @@ from database import db
 from database.manage import remove_model, reset_relational_db
 from database.migrate import basic_auto_migrate_relational_db, set_foreign_key_checks, set_unique_checks, set_autocommit
 from exports.protein_data import EXPORTERS
+from helpers.cache import bump_data_version
 from helpers.commands import CommandTarget
 from helpers.commands import argument
 from helpers.commands import argument_parameters
@@ -21,8 +22,7 @@ from helpers.commands import command
 from helpers.commands import create_command_subparsers
 from imports import import_all, ImportManager
 from imports.importer import BioImporter, CMSImporter
-from imports.mappings import import_aminoacid_mutation_refseq_mappings
-from imports.mappings import import_genome_proteome_mappings
+from imports.mappings import import_mappings
 from imports.mutations import MutationImportManager, MutationImporter
 from imports.mutations import get_proteins
 from models import Model
@@ -51,6 +51,23 @@ def calc_statistics(args, app=None):
         db.session.commit()
 
 
+def refresh_summaries():
+    # genes listings read the counts from ProteinSummary (if present), so these
+    # have to be recalculated whenever mutations or sites are imported or removed
+    from views.gene import refresh_protein_summaries
+    print('Calculating protein summaries...')
+    created = refresh_protein_summaries()
+    db.session.commit()
+    print(f'Created {created} protein summaries')
+
+
+def calc_summaries(args, app=None):
+    if not app:
+        app = create_app(config_override=CONFIG)
+    with app.app_context():
+        refresh_summaries()
+
+
 def automigrate(args, app=None):
     if not app:
         app = create_app(config_override=CONFIG)
@@ -127,6 +144,8 @@ class ProteinRelated(CommandTarget, ImportersMixin):
     @command
     def load(self, args):
         self.import_manager.import_selected(args.importers, dry=args.dry)
+        if not args.dry:
+            refresh_summaries()
 
     @load.argument
     def importers(self):
@@ -199,6 +218,9 @@ class ProteinRelated(CommandTarget, ImportersMixin):
             remove_model(model)
             db.session.commit()
 
+        if to_remove:
+            refresh_summaries()
+
     @remove.argument
     def all(self):
         return argument_parameters(
@@ -233,25 +255,17 @@ class Mappings(CommandTarget):
     def load(self, args):
         print(f'Importing {args.restrict_to or "all"} mappings')
 
-        if args.restrict_to != 'aminoacid_refseq':
-            from sqlalchemy.orm import load_only
-            proteins = get_proteins(options=load_only('id', 'refseq', 'sequence'))
-
-            import_genome_proteome_mappings(proteins, bdb_dir=args.path)
+        from sqlalchemy.orm import load_only
+        proteins = get_proteins(options=load_only('id', 'refseq', 'sequence'))
 
-        if args.restrict_to != 'genome_proteome':
-            from models import Protein
-            from sqlalchemy.orm import load_only, joinedload
-
-            proteins = {
-                protein.refseq: protein
-                for protein in Protein.query.options(
-                    load_only('id', 'refseq', 'sequence'),
-                    joinedload(Protein.gene)
-                )
-            }
-
-            import_aminoacid_mutation_refseq_mappings(proteins, bdb_dir=args.path)
+        # both databases are built in a single pass over the mappings files
+        import_mappings(
+            proteins,
+            bdb_dir=args.path,
+            processes=args.processes,
+            genome_proteome=args.restrict_to != 'aminoacid_refseq',
+            aminoacid_refseq=args.restrict_to != 'genome_proteome'
+        )
 
     @load.argument
     def restrict_to(self):
@@ -271,6 +285,26 @@ class Mappings(CommandTarget):
             help='A path to dir where mappings dbs should be created'
         )
 
+    @load.argument
+    def processes(self):
+        return argument_parameters(
+            '--processes', '-p',
+            type=int,
+            default=1,
+            help=(
+                'Number of processes to parse mappings files with.'
+                ' If more than one, files are parsed in parallel into sorted runs'
+                ' which are then merged into the database. By default 1.'
+            )
+        )
+
+    @command
+    def update(self, args):
+        print('Converting mappings databases to the current format...')
+        for database in (bdb, bdb_refseq):
+            converted = database.convert_format()
+            print(f'Converted {converted} values in {database.name}')
+
     @command
     def remove(self, args):
         print('Removing mappings database...')
@@ -319,6 +353,8 @@ class Mutations(CommandTarget):
         muts_import_manager.perform(
             name, proteins, **kwargs
         )
+        if name in {'load', 'update', 'remove'}:
+            refresh_summaries()
 
     @command
     def load(self, args):
@@ -373,6 +409,19 @@ class Mutations(CommandTarget):
             help='Limit import to n-th chunk, starts with 0. By default None.'
         )
 
+    @load.argument
+    def processes(self):
+        return argument_parameters(
+            '--processes', '-p',
+            type=int,
+            default=1,
+            help=(
+                'Number of processes to parse mutations files with.'
+                ' If more than one, sources (and chunks) are parsed in parallel'
+                ' and inserted one after another. By default 1.'
+            )
+        )
+
     @load.argument
     def disable_constraints(self):
         return argument_parameters(
@@ -416,6 +465,7 @@ class All(CommandTarget):
     @command
     def load(self, args):
         import_all()
+        refresh_summaries()
         Mappings().load(args)
 
     @command
@@ -524,6 +574,16 @@ def create_parser():
         default=None
     )
 
+    new_subparser(
+        subparsers,
+        'calc_summaries',
+        calc_summaries,
+        help=(
+            '(re)calculate counts of mutations and sites per protein used by genes listings;'
+            ' run automatically after each import or removal of mutations or sites'
+        )
+    )
+
     shell_parser = new_subparser(
         subparsers,
         'shell',
@@ -615,6 +675,9 @@ def run_manage(parsed_args, app=None):
     with app.app_context():
         parsed_args.func(parsed_args)
 
+    # responses cached by the web application may be outdated now
+    bump_data_version()
+
     print('Done, all tasks completed.')
 
 
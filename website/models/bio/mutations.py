@@ -3,7 +3,7 @@ from collections import UserList, OrderedDict
 from functools import lru_cache
 from typing import Type, Iterable, Mapping, List, Dict, TYPE_CHECKING
 
-from sqlalchemy import select, func, or_, and_, exists
+from sqlalchemy import select, func, or_, and_, exists, event
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property, Comparator, hybrid_method
@@ -12,10 +12,11 @@ from sqlalchemy.orm import synonym, RelationshipProperty
 from database import db
 from database.types import ScalarSet
 from helpers.models import generic_aggregator
+from helpers.parsers import chunked_list
 
 from .diseases import ClinicalData
 from .model import BioModel, make_association_table
-from .sites import Site, SiteMotif
+from .sites import Site, SiteMotif, SiteIndex
 
 
 if TYPE_CHECKING:
@@ -735,6 +736,23 @@ class Sources:
             for source in self.visible
         }
 
+        # each source with details stored in the database gets its own
+        # bit in Mutation.sources_mask (order of bits follows all_sources)
+        self.bits: Mapping[MutationSource, int] = {
+            source: 1 << i
+            for i, source in enumerate(
+                source for source in all_sources
+                if issubclass(source, MappedMutationDetails)
+            )
+        }
+
+    def mask(self, sources: Iterable[MutationSource]) -> int:
+        """Return a bitmask with bits of given sources set."""
+        mask = 0
+        for source in sources:
+            mask |= self.bits[source]
+        return mask
+
     def get_relationship(self, source: MutationSource) -> RelationshipProperty:
         return self.class_relation_map[source]
 
@@ -744,6 +762,15 @@ class Sources:
         except AttributeError:
             return None
 
+    def has_source(self, mutation, source: MutationSource) -> bool:
+        """Check if given mutation has details from given source, reading the
+        bit from `mutation.sources_mask` (if the source has a bit assigned).
+        """
+        bit = self.bits.get(source)
+        if bit is None:
+            return bool(self.get_bound_relationship(mutation, source))
+        return bool((mutation.sources_mask or 0) & bit)
+
     @property
     @lru_cache()
     def class_relation_map(self) -> Dict[MutationSource, RelationshipProperty]:
@@ -836,6 +863,13 @@ class Mutation(BioModel, MutatedMotifs):
     # is different than None. Be careful with boolean evaluation!
     precomputed_is_ptm = db.Column(db.Boolean)
 
+    # Bitmask of sources which mention this mutation (see Sources.bits),
+    # allowing to filter by source without joining the details tables.
+    # It is kept in sync by the ORM events (see track_mutation_sources)
+    # and by the mutation importers; after changes made with raw SQL use:
+    # `./manage.py load protein_related mutations_sources_masks`.
+    sources_mask = db.Column(db.Integer, default=0, index=True)
+
     types = ('direct', 'network-rewiring', 'motif-changing', 'proximal', 'distal', 'none')
 
     vars().update(source_manager.relationships)
@@ -872,9 +906,14 @@ class Mutation(BioModel, MutatedMotifs):
         return [
             source.name
             for source in source_manager.visible
-            if source_manager.get_bound_relationship(self, source)
+            if source_manager.has_source(self, source)
         ]
 
+    @sources.expression
+    def sources(cls):
+        """Bitmask of the sources in SQL (use `in_sources` to filter by sources)"""
+        return cls.sources_mask
+
     @hybrid_property
     def is_confirmed(self):
         """Mutation is confirmed if there are metadata from one of four studies
@@ -882,19 +921,12 @@ class Mutation(BioModel, MutatedMotifs):
         (or experiments). Presence of MIMP metadata does not imply
         if mutation has been ever studied experimentally before.
         """
-        return any([source_manager.get_bound_relationship(self, source) for source in source_manager.confirmed])
+        return any(source_manager.has_source(self, source) for source in source_manager.confirmed)
 
     @is_confirmed.expression
     def is_confirmed(cls):
         """SQL expression for is_confirmed"""
-        return or_(
-            relationship_field.any()
-            if relationship_field.prop.uselist
-            else relationship_field.has()
-            for relationship_field in [
-                source_manager.get_relationship(source) for source in source_manager.confirmed
-            ]
-        )
+        return cls.in_sources(*source_manager.confirmed, conjunction=or_)
 
     @hybrid_property
     def sites(self):
@@ -924,10 +956,10 @@ class Mutation(BioModel, MutatedMotifs):
 
         This method works very similarly to is_ptm_distal property.
         """
-        sites = self.protein.sites
-        if filter_manager:
-            sites = filter_manager.apply(sites)
-        return self.is_close_to_some_site(7, 7, sites)
+        if not filter_manager:
+            return self.is_close_to_some_site(7, 7)
+        # only the sites within the span need to be filtered
+        return bool(filter_manager.apply(self.get_affected_ptm_sites()))
 
     @hybrid_property
     def ref(self):
@@ -962,51 +994,15 @@ class Mutation(BioModel, MutatedMotifs):
         # otherwise it's a novel mutation - let's check proximity
         return self.is_close_to_some_site(7, 7)
 
-    def get_affected_ptm_sites(self, site_filter=lambda x: x):
+    def get_affected_ptm_sites(self, site_filter=None):
         """Get PTM sites that might be affected by this mutation,
 
         when taking into account -7 to +7 spans of each PTM site.
         """
-        sites = site_filter(self.protein.sites)
-        pos = self.position
-        a = 0
-        b = len(sites)
-        sites_affected = set()
-
-        while a != b:
-            pivot = (b - a) // 2 + a
-            site_pos = sites[pivot].position
-            if site_pos - 7 <= pos <= site_pos + 7:
-                hit = pivot
-                sites_affected.add(sites[pivot])
-                break
-            if pos > site_pos:
-                a = pivot + 1
-            else:
-                b = pivot
-        else:
-            return tuple()
-
-        def cond():
-            try:
-                site_pos = sites[pivot].position
-                return site_pos - 7 <= pos <= site_pos + 7
-            except IndexError:
-                return tuple()
-
-        # go to right from found site, check if there is more overlapping sites
-        pivot = hit + 1
-        while cond():
-            sites_affected.add(sites[pivot])
-            pivot += 1
-
-        # and then go to the left
-        pivot = hit - 1
-        while cond():
-            sites_affected.add(sites[pivot])
-            pivot -= 1
-
-        return sorted(sites_affected, key=lambda site: site.position)
+        sites = self.protein.site_index.affected_sites(self.position)
+        if site_filter:
+            sites = site_filter(sites)
+        return sites
 
     def impact_on_specific_ptm(self, site: Site, ignore_mimp=False):
         if self.position == site.position:
@@ -1047,22 +1043,7 @@ class Mutation(BioModel, MutatedMotifs):
 
     def find_closest_sites(self, distance=7, site_filter=lambda x: x):
         # TODO: implement site type filter
-        pos = self.position
-
-        sites = Site.query.filter(
-            and_(
-                Site.protein_id == self.protein_id,
-                Site.position.between(pos - distance, pos + distance)
-            )
-        ).order_by(func.abs(Site.position - pos)).limit(2).all()
-
-        if(
-            len(sites) == 2 and
-            abs(sites[0].position - pos) != abs(sites[1].position - pos)
-        ):
-            return sites[:1]
-        else:
-            return sites
+        return self.protein.site_index.closest_sites(self.position, distance)
 
     @hybrid_method
     def is_close_to_some_site(self, left, right, sites=None):
@@ -1072,24 +1053,14 @@ class Mutation(BioModel, MutatedMotifs):
         (site_pos - left, site_pos + right)
         site_pos is the position of a site
 
-        Algorithm is based on bisection and an assumption,
-        that sites are sorted by position in the database.
+        If no sites are given, sites of the protein are
+        checked (using the site index of the protein).
         """
         if sites is None:
-            sites = self.protein.sites
-        pos = self.position
-        a = 0
-        b = len(sites)
-        while a != b:
-            p = (b - a) // 2 + a
-            site_pos = sites[p].position
-            if site_pos - left <= pos <= site_pos + right:
-                return True
-            if pos > site_pos:
-                a = p + 1
-            else:
-                b = p
-        return False
+            index = self.protein.site_index
+        else:
+            index = SiteIndex.from_sites(sites)
+        return bool(index.is_close(self.position, left, right))
 
     @is_close_to_some_site.expression
     def is_close_to_some_site(self, left, right):
@@ -1120,17 +1091,87 @@ class Mutation(BioModel, MutatedMotifs):
 
     @classmethod
     def in_sources(cls, *sources: MutationSource, conjunction=and_):
+        """SQL expression testing if the mutation is mentioned in all (or any, with conjunction=or_) of sources."""
+        mask = source_manager.mask(sources)
+        present = cls.sources_mask.op('&')(mask)
 
-        return conjunction(
-            (
-                (
-                    source_manager.get_relationship(source).any()
-                    if are_details_managed(source) else
-                    source_manager.get_relationship(source).has()
-                )
-                for source in sources
+        if conjunction is and_:
+            return present == mask
+        if conjunction is or_:
+            return present != 0
+        raise ValueError(f'Unsupported conjunction: {conjunction}')
+
+    @classmethod
+    def update_sources_mask(cls, source: MutationSource, mutation_ids: Iterable[int] = None, chunk_size=10000):
+        """Recompute bit of given source in sources_mask of all mutations (or of mutations with given ids).
+
+        Returns the number of mutations which were updated.
+        """
+        if mutation_ids is None:
+            return cls._update_sources_mask(source)
+        return sum(
+            cls._update_sources_mask(source, cls.id.in_(chunk))
+            for chunk in chunked_list(list(mutation_ids), chunk_size=chunk_size, progress=False)
+        )
+
+    @classmethod
+    def _update_sources_mask(cls, source: MutationSource, *criteria):
+        bit = source_manager.bits[source]
+        has_details = exists().where(source.__table__.c.mutation_id == cls.id)
+        has_bit = cls.sources_mask.op('&')(bit) != 0
+
+        added = (
+            cls.query
+            .filter(*criteria, has_details, or_(cls.sources_mask == None, ~has_bit))
+            .update(
+                {cls.sources_mask: func.coalesce(cls.sources_mask, 0).op('|')(bit)},
+                synchronize_session=False
             )
         )
+        removed = (
+            cls.query
+            .filter(*criteria, ~has_details, has_bit)
+            .update({cls.sources_mask: cls.sources_mask - bit}, synchronize_session=False)
+        )
+        return added + removed
+
+
+def track_mutation_sources():
+    """Set (or clear) bits of Mutation.sources_mask when details are added to
+    (or removed from) mutations via the ORM relationships.
+
+    Changes bypassing the relationships (e.g. deletion of details rows) require
+    `Mutation.update_sources_mask` (the mutation importers call it after bulk changes).
+    """
+
+    def add_bit(bit):
+        def on_append(mutation, details, initiator):
+            mutation.sources_mask = (mutation.sources_mask or 0) | bit
+        return on_append
+
+    def remove_bit(bit, key):
+        def on_remove(mutation, details, initiator):
+            # the event is emitted before the details are removed from the collection
+            if not any(other is not details for other in getattr(mutation, key)):
+                mutation.sources_mask = (mutation.sources_mask or 0) & ~bit
+        return on_remove
+
+    def set_bit(bit):
+        def on_set(mutation, details, old_details, initiator):
+            mask = mutation.sources_mask or 0
+            mutation.sources_mask = mask | bit if details is not None else mask & ~bit
+        return on_set
+
+    for source, bit in source_manager.bits.items():
+        relationship = source_manager.get_relationship(source)
+        if relationship.prop.uselist:
+            event.listen(relationship, 'append', add_bit(bit))
+            event.listen(relationship, 'remove', remove_bit(bit, relationship.key))
+        else:
+            event.listen(relationship, 'set', set_bit(bit))
+
+
+track_mutation_sources()
 
 
 def confirmed_mutation_sources():
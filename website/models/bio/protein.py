@@ -1,6 +1,6 @@
 from typing import List, TYPE_CHECKING
 
-from sqlalchemy import select, case, exists, and_, func, distinct
+from sqlalchemy import select, case, exists, and_, func, distinct, event
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.utils import cached_property
@@ -10,7 +10,7 @@ from database import db, client_side_defaults, fast_count
 from .diseases import Cancer, Disease, ClinicalData
 from .model import BioModel, make_association_table
 from .mutations import Mutation, InheritedMutation
-from .sites import Site
+from .sites import Site, SiteIndex
 
 if TYPE_CHECKING:
     from .gene import Gene
@@ -357,38 +357,21 @@ class Protein(BioModel):
             kinase_groups.update(site.kinase_groups)
         return kinase_groups
 
-    @cached_property
-    def sites_affecting_positions(self):
-        return set(
-            i
-            for position, in db.session.query(Site.position).filter_by(protein=self)
-            for i in range(position - 7, position + 7 + 1)
-        )
+    @property
+    def site_index(self) -> SiteIndex:
+        """Index of sites positions; re-created after the list of sites changes (see track_sites_changes)."""
+        index = self.__dict__.get('_site_index')
+        if index is None:
+            index = self._site_index = SiteIndex.from_sites(self.sites)
+        return index
 
     def would_affect_any_sites(self, mutation_pos):
-        return mutation_pos in self.sites_affecting_positions
+        return bool(self.site_index.is_close(mutation_pos, 7, 7))
 
     def has_sites_in_range(self, left, right):
-        """Test if there are any sites in given range defined as <left, right>, inclusive.
-
-        Algorithm is based on bisection and an assumption,
-        that sites are sorted by position in the database.
-        """
+        """Test if there are any sites in given range defined as <left, right>, inclusive."""
         assert left < right
-
-        sites = self.sites
-
-        for i, site in enumerate(sites):
-            if site.position >= left:
-                start = i
-                break
-        else:
-            return False
-
-        for i, site in enumerate(reversed(sites)):
-            if site.position <= right:
-                return start <= len(sites) - i - 1
-        return False
+        return bool(self.site_index.is_close(left, right - left, 0))
 
     @property
     def disease_names_by_id(self):
@@ -415,6 +398,51 @@ class Protein(BioModel):
         return len(self.kinases) + len(self.kinase_groups)
 
 
+def track_sites_changes():
+    """Invalidate Protein.site_index when sites are added to or removed from the protein
+
+    (or when the sites are expired, so that these will be loaded again).
+    """
+
+    def invalidate(protein, *args):
+        # instance events may be emitted for already garbage-collected instances
+        if protein is not None:
+            protein.__dict__.pop('_site_index', None)
+
+    for collection_event in ['append', 'remove', 'bulk_replace']:
+        event.listen(Protein.sites, collection_event, invalidate)
+
+    for instance_event in ['expire', 'refresh']:
+        event.listen(Protein, instance_event, invalidate)
+
+
+track_sites_changes()
+
+
+class ProteinSummary(BioModel):
+    """Precomputed counts of mutations and PTM sites of a protein,
+
+    as shown in genes listings, for a combination of mutation source
+    and site type. Source None stands for all mutations (not filtered by source),
+    site type None for sites of any type. Only rows with at least
+    one non-zero count are stored (missing rows mean zero counts).
+
+    Refreshed by the mutations and protein_related import/remove commands
+    of manage.py, or explicitly with `./manage.py calc_summaries`.
+    """
+    __table_args__ = (
+        db.Index('protein_summary_index', 'protein_id', 'source', 'site_type_id'),
+    )
+
+    protein_id = db.Column(db.Integer, db.ForeignKey('protein.id'))
+    source = db.Column(db.String(16), nullable=True)
+    site_type_id = db.Column(db.Integer, db.ForeignKey('sitetype.id'), nullable=True)
+
+    muts_cnt = db.Column(db.Integer, default=0)
+    ptm_muts_cnt = db.Column(db.Integer, default=0)
+    ptm_sites_cnt = db.Column(db.Integer, default=0)
+
+
 class InterproDomain(BioModel):
     # Interpro ID
     accession = db.Column(db.String(64), unique=True)
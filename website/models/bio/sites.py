@@ -3,8 +3,9 @@ from functools import lru_cache
 
 from pathlib import Path
 from sys import float_info
-from typing import List, TYPE_CHECKING
+from typing import List, TYPE_CHECKING, Sequence, Set, Iterable
 
+import numpy as np
 from sqlalchemy import func, case
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
 
@@ -74,16 +75,21 @@ class SiteType(BioModel):
         }
 
     @classmethod
-    def fuzzy_filter(cls, other_type, join=False, site=None):
-        """Requires SiteType join!"""
-        site = site if site is not None else Site
-
-        matched_types_ids = [
+    def fuzzy_match_ids(cls, other_type) -> List[int]:
+        """Identifiers of site types matched by other_type in fuzzy_filter"""
+        return [
             type_id
             for type_name, type_id in cls.id_by_name().items()
             if other_type.name in type_name
         ]
 
+    @classmethod
+    def fuzzy_filter(cls, other_type, join=False, site=None):
+        """Requires SiteType join!"""
+        site = site if site is not None else Site
+
+        matched_types_ids = cls.fuzzy_match_ids(other_type)
+
         if len(matched_types_ids) == 1:
             if not join:
                 return SiteType.id == matched_types_ids[0]
@@ -359,6 +365,132 @@ class Site(BioModel):
         return data
 
 
+class SiteIndex:
+    """Positions of sites of a single protein, sorted, for vectorised proximity checks.
+
+    Mutation positions can be given either as a single int or as an array of ints;
+    accordingly, a single value or an array of values is returned.
+
+    Types of sites are stored as bitmasks (one bit per each of `types_names`),
+    so that the checks can be limited to sites of chosen types.
+    """
+
+    # spans (left, right) around a site, within which a mutation affects the site
+    spans = {
+        'direct': (0, 0),
+        'proximal': (2, 2),
+        'distal': (7, 7)
+    }
+
+    def __init__(self, positions, sites: Sequence['Site'] = None, types: Sequence[Set[str]] = None):
+        """
+        Args:
+            positions: positions of sites
+            sites: Site objects corresponding to positions (optional)
+            types: names of types of each of sites (optional)
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        order = np.argsort(positions, kind='stable')
+        self.positions = positions[order]
+        self.sites = [sites[i] for i in order] if sites is not None else None
+        self._types = [types[i] for i in order] if types is not None else None
+        self._types_bitmasks = None
+        self.types_names = []
+
+    @classmethod
+    def from_sites(cls, sites: Sequence['Site']) -> 'SiteIndex':
+        """Create index of given sites; types of sites will be loaded when first needed."""
+        sites = list(sites)
+        return cls([site.position for site in sites], sites=sites)
+
+    @property
+    def types(self) -> np.ndarray:
+        """Bitmasks of types of sites (bits correspond to `types_names`)."""
+        if self._types_bitmasks is None:
+            types = self._types
+            if types is None:
+                types = [site.types_names for site in self.sites] if self.sites is not None else []
+            self.types_names = sorted({name for site_types in types for name in site_types})
+            bits = {name: 1 << i for i, name in enumerate(self.types_names)}
+            self._types_bitmasks = np.array(
+                [sum(bits[name] for name in site_types) for site_types in types],
+                dtype=np.uint64
+            )
+        return self._types_bitmasks
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _types_mask(self, site_types: Iterable[str]) -> np.ndarray:
+        types = self.types
+        mask = 0
+        for i, name in enumerate(self.types_names):
+            if name in site_types:
+                mask |= 1 << i
+        return (types & np.uint64(mask)) != 0
+
+    def _positions(self, site_types=None) -> np.ndarray:
+        if site_types is None:
+            return self.positions
+        return self.positions[self._types_mask(site_types)]
+
+    def _bounds(self, positions, left, right, site_types=None):
+        """Return (first, after last) indices of sites with mutations in <site_pos - left, site_pos + right>."""
+        sites_positions = self._positions(site_types)
+        positions = np.asarray(positions)
+        first = np.searchsorted(sites_positions, positions - right, side='left')
+        after_last = np.searchsorted(sites_positions, positions + left, side='right')
+        return first, after_last
+
+    def count_close(self, positions, left=7, right=7, site_types=None):
+        """Number of sites for which the mutation lies in <site_pos - left, site_pos + right> span."""
+        first, after_last = self._bounds(positions, left, right, site_types)
+        return after_last - first
+
+    def is_close(self, positions, left=7, right=7, site_types=None):
+        """Check if mutations lie in <site_pos - left, site_pos + right> span of any of sites."""
+        return self.count_close(positions, left, right, site_types) > 0
+
+    def is_ptm_direct(self, positions, site_types=None):
+        return self.is_close(positions, *self.spans['direct'], site_types=site_types)
+
+    def is_ptm_proximal(self, positions, site_types=None):
+        return self.is_close(positions, *self.spans['proximal'], site_types=site_types)
+
+    def is_ptm_distal(self, positions, site_types=None):
+        return self.is_close(positions, *self.spans['distal'], site_types=site_types)
+
+    def ptm_impact(self, positions, site_types=None):
+        """Impact on the closest site: 'direct', 'proximal', 'distal' or 'none'.
+
+        Only proximity is considered here (see `Mutation.impact_on_ptm` for
+        other kinds of impact, such as 'network-rewiring' or 'motif-changing').
+        """
+        return np.select(
+            [
+                self.is_ptm_direct(positions, site_types),
+                self.is_ptm_proximal(positions, site_types),
+                self.is_ptm_distal(positions, site_types)
+            ],
+            ['direct', 'proximal', 'distal'],
+            default='none'
+        )
+
+    def affected_sites(self, position: int, distance=7) -> List['Site']:
+        """Sites (sorted by position) which might be affected by a mutation at given position."""
+        first, after_last = self._bounds(position, distance, distance)
+        return self.sites[first:after_last]
+
+    def closest_sites(self, position: int, distance=7) -> List['Site']:
+        """The closest site(s) within given distance: two if these are equally distant."""
+        first, after_last = self._bounds(position, distance, distance)
+        distances = np.abs(self.positions[first:after_last] - position)
+        closest = first + np.argsort(distances, kind='stable')[:2]
+        if len(closest) == 2 and distances[closest[0] - first] != distances[closest[1] - first]:
+            closest = closest[:1]
+        return [self.sites[i] for i in closest]
+
+
 class SiteMotif(BioModel):
     name = db.Column(db.String(32))
     pattern = db.Column(db.String(32))
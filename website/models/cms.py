@@ -3,7 +3,8 @@ import pickle
 from contextlib import suppress
 from datetime import datetime
 from datetime import timedelta
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List, Optional
+from urllib.parse import unquote
 
 from flask import url_for
 from sqlalchemy import and_, not_
@@ -22,6 +23,8 @@ from .model import Model
 
 if TYPE_CHECKING:
     from search.mutation import MutationSearch
+    from search.dataset import StoredSearch
+    from .bio.mutations import UserUploadedMutation
 
 
 class CMSModel(Model):
@@ -153,14 +156,24 @@ class UsersMutationsDataset(CMSModel):
         return cls.query.filter_by(uri=uri.rstrip('/')).one()
 
     @property
-    def data(self) -> 'MutationSearch':
-        if not hasattr(self, '_data'):
+    def stored(self) -> Optional['StoredSearch']:
+        """Lazily paged results, see `search.dataset.StoredSearch`."""
+        if not hasattr(self, '_stored'):
             try:
-                self._data = self._load_from_file()
+                self._stored = self._load_from_file()
             except FileNotFoundError:
                 # None if associated file was deleted.
                 # Be aware of this line when debugging.
                 return
+        return self._stored
+
+    @property
+    def data(self) -> 'MutationSearch':
+        """All results, rehydrated; prefer `stored` to access only a part of them."""
+        if not hasattr(self, '_data'):
+            if not self.stored:
+                return
+            self._data = self.stored.to_search()
         return self._data
 
     @data.setter
@@ -168,6 +181,8 @@ class UsersMutationsDataset(CMSModel):
         self._data = data
         uri = self._save_to_file(data, self.uri)
         self.uri = uri
+        with suppress(AttributeError):
+            del self._stored
 
     def remove(self, commit=True):
         """Performs hard-delete of dataset.
@@ -186,6 +201,8 @@ class UsersMutationsDataset(CMSModel):
         # prompt python interpreter to remove data from memory
         with suppress(AttributeError):
             del self._data
+        with suppress(AttributeError):
+            del self._stored
 
         # and delete from session
         db.session.delete(self)
@@ -201,6 +218,7 @@ class UsersMutationsDataset(CMSModel):
         """
         import base64
         from tempfile import NamedTemporaryFile
+        from search.dataset import StoredSearch
 
         os.makedirs(self.mutations_dir, exist_ok=True)
 
@@ -209,36 +227,48 @@ class UsersMutationsDataset(CMSModel):
             'utf-8'
         )
 
-        if uri:
-            file_name = uri + '.db'
-            path = os.path.join(self.mutations_dir, file_name)
-            db_file = open(path, 'wb')
-        else:
-            db_file = NamedTemporaryFile(
-                dir=self.mutations_dir,
-                prefix=encoded_name,
-                suffix='.db',
-                delete=False
-            )
+        db_file = NamedTemporaryFile(
+            dir=self.mutations_dir,
+            prefix=encoded_name,
+            suffix='.db',
+            delete=False
+        )
 
-        pickle.dump(data, db_file, protocol=4)
+        with db_file:
+            # no data yet (e.g. the search is still running): reserve the file only
+            if data is not None:
+                StoredSearch.dump(data, db_file)
 
-        uri_code = os.path.basename(db_file.name)[:-3]
+        if not uri:
+            return os.path.basename(db_file.name)[:-3]
 
-        return uri_code
+        # replace the existing file only once the new one is complete,
+        # so that readers never see it truncated (nor is it lost on failure)
+        path = os.path.join(self.mutations_dir, uri + '.db')
+        os.replace(db_file.name, path)
+
+        return uri
 
     @property
     def _path(self):
-        from urllib.parse import unquote
-
         file_name = unquote(self.uri) + '.db'
         return os.path.join(self.mutations_dir, file_name)
 
-    def _load_from_file(self):
+    def _load_from_file(self) -> Optional['StoredSearch']:
+        from search.dataset import StoredSearch
 
-        with open(self._path, 'rb') as f:
-            data = pickle.load(f)
-        return data
+        if not os.path.getsize(self._path):
+            return
+
+        if not StoredSearch.is_columnar(self._path):
+            # convert a legacy (pickled MutationSearch) file, once
+            with open(self._path, 'rb') as f:
+                data = pickle.load(f)
+            if data is None:
+                return
+            self._save_to_file(data, unquote(self.uri))
+
+        return StoredSearch(self._path)
 
     @hybrid_property
     def is_expired(self):
@@ -256,12 +286,13 @@ class UsersMutationsDataset(CMSModel):
     @property
     def query_size(self):
         if self.query_count is None:
-            new_lines = self.data.query.count('\n')
+            new_lines = self.stored.query.count('\n')
             return new_lines + 1 if new_lines else 0
         return self.query_count
 
     @property
     def mutations(self):
+        """All mutations, rehydrated; prefer `mutation_ids` or `get_mutation_details` when possible."""
         mutations = []
         results = self.data.results
         for results in results.values():
@@ -272,12 +303,23 @@ class UsersMutationsDataset(CMSModel):
     @property
     def mutations_count(self):
         if self.results_count is None:
-            return len(self.mutations)
+            return self.stored.results_count
         return self.results_count
 
-    def get_mutation_details(self, protein, pos, alt):
-        protein_results = self.data.results_by_refseq[protein.refseq]
-        return protein_results[pos, alt].meta_user
+    @property
+    def mutation_ids(self) -> List[int]:
+        if not self.stored:
+            return []
+        return self.stored.mutation_ids()
+
+    def get_mutation_details(self, protein, pos, alt) -> Optional['UserUploadedMutation']:
+        """Details of the mutation in this dataset, or None if it is not a part of the dataset."""
+        if hasattr(self, '_data'):
+            result = self._data.results_by_refseq.get(protein.refseq, {}).get((pos, alt))
+            return result.meta_user if result else None
+        if not self.stored:
+            return
+        return self.stored.find(protein.refseq, pos, alt)
 
 
 class User(CMSModel):
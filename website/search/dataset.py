@@ -0,0 +1,427 @@
+"""Compact, columnar storage of saved mutation searches (users' datasets).
+
+Results of a search are grouped into pages of consecutive query lines;
+each page is stored as a handful of columns (refseq, position, alt, count,
+type, ...) pickled separately, so that a single page can be read without
+loading the rest of the dataset. The file ends with a header describing
+the whole search (query, lines without mutations, offsets of pages) and
+an index of the mutations, giving the page (and row) of each of these.
+
+Reading results back (rehydration) requires a fixed number of queries per
+chunk of results: proteins are fetched by refseq and mutations by their
+(protein, position, alt) keys, instead of one query per result.
+"""
+import pickle
+from collections import defaultdict
+from struct import Struct
+from typing import Dict, List, Iterable, Optional, Set, Tuple
+
+from sqlalchemy.orm import joinedload
+
+from database import db
+from genomic_mappings import fetch_mutations
+from helpers.parsers import chunked_list
+from models import Mutation, Protein, UserUploadedMutation
+
+from .mutation import MutationSearch
+from .mutation_result import SearchResult
+
+
+# attributes of SearchResult stored in dedicated columns
+# (all other attributes are stored as optional, extra columns)
+core_attributes = {'protein', 'mutation', 'is_mutation_novel', 'type', 'meta_user'}
+
+offset_struct = Struct('>Q')
+
+
+class StoredSearch:
+    """Lazily loaded, paged results of a MutationSearch stored in a file."""
+
+    magic = b'ADDB:columnar:1\n'
+
+    # number of query lines per page
+    page_size = 500
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            if f.read(len(self.magic)) != self.magic:
+                raise ValueError(f'{path} is not a columnar dataset file')
+            f.seek(-offset_struct.size, 2)
+            header_offset, = offset_struct.unpack(f.read(offset_struct.size))
+            f.seek(header_offset)
+            header = pickle.load(f)
+
+        self.query: str = header['query']
+        self.without_mutations: List[str] = header['without_mutations']
+        self.badly_formatted: List[str] = header['badly_formatted']
+        self.hidden_results_cnt: int = header['hidden_results_cnt']
+        self.lines_count: int = header['lines_count']
+        self.results_count: int = header['results_count']
+        self.page_offsets: List[int] = header['page_offsets']
+        # (refseq, position, alt) -> (page, row); absent in files written before it was introduced
+        self.mutations_index: Dict[Tuple[str, int, str], Tuple[int, int]] = (
+            header.get('mutations_index') or self._index_pages()
+        )
+
+    @classmethod
+    def is_columnar(cls, path) -> bool:
+        with open(path, 'rb') as f:
+            return f.read(len(cls.magic)) == cls.magic
+
+    @classmethod
+    def dump(cls, search: MutationSearch, file):
+        """Write results of given search to a binary file object."""
+        indexed = indexed_results(search)
+        lines = list(search.results.items())
+
+        file.write(cls.magic)
+        page_offsets = []
+        mutations_index = {}
+
+        for start in range(0, len(lines), cls.page_size):
+            page_offsets.append(file.tell())
+            page = cls._to_columns(lines[start:start + cls.page_size], indexed)
+            mutations_index.update(cls._index_page(page, len(page_offsets) - 1))
+            pickle.dump(page, file, protocol=4)
+
+        header = {
+            'query': search.query,
+            'without_mutations': search.without_mutations,
+            'badly_formatted': search.badly_formatted,
+            'hidden_results_cnt': search.hidden_results_cnt,
+            'lines_count': len(lines),
+            'results_count': sum(len(results) for query_line, results in lines),
+            'page_offsets': page_offsets,
+            'mutations_index': mutations_index
+        }
+        header_offset = file.tell()
+        pickle.dump(header, file, protocol=4)
+        file.write(offset_struct.pack(header_offset))
+
+    @staticmethod
+    def _to_columns(lines, indexed) -> Dict[str, list]:
+        query_lines = []
+        refseqs = []
+        refseq_codes = {}
+        columns = {
+            name: []
+            for name in ['line', 'refseq', 'position', 'alt', 'count', 'type', 'novel', 'indexed']
+        }
+        extra = {}
+        row = 0
+
+        for line_number, (query_line, results) in enumerate(lines):
+            query_lines.append(query_line)
+
+            for result in results:
+                mutation = result.mutation
+                refseq = result.protein.refseq
+                if refseq not in refseq_codes:
+                    refseq_codes[refseq] = len(refseqs)
+                    refseqs.append(refseq)
+
+                columns['line'].append(line_number)
+                columns['refseq'].append(refseq_codes[refseq])
+                columns['position'].append(mutation.position)
+                columns['alt'].append(mutation.alt)
+                columns['count'].append(result.meta_user.count)
+                columns['type'].append(result.type)
+                columns['novel'].append(result.is_mutation_novel)
+                columns['indexed'].append(id(result) in indexed)
+
+                for name, value in result.__dict__.items():
+                    if name in core_attributes:
+                        continue
+                    if name not in extra:
+                        extra[name] = [None] * row
+                    extra[name].append(value)
+                row += 1
+
+                for values in extra.values():
+                    if len(values) < row:
+                        values.append(None)
+
+        columns['query_lines'] = query_lines
+        columns['refseqs'] = refseqs
+        columns['extra'] = extra
+        return columns
+
+    @staticmethod
+    def _index_page(columns, page: int):
+        """Yield ((refseq, position, alt), (page, row)) for the rows which can be looked up."""
+        refseqs = columns['refseqs']
+        for row, (code, position, alt, indexed) in enumerate(
+            zip(columns['refseq'], columns['position'], columns['alt'], columns['indexed'])
+        ):
+            if indexed:
+                yield (refseqs[code], position, alt), (page, row)
+
+    def _index_pages(self):
+        index = {}
+        for page in range(self.pages_count):
+            index.update(self._index_page(self.columns(page), page))
+        return index
+
+    @property
+    def pages_count(self) -> int:
+        return len(self.page_offsets)
+
+    def columns(self, page: int) -> Dict[str, list]:
+        """Raw columns of given page (numbered from 0)."""
+        with open(self.path, 'rb') as f:
+            f.seek(self.page_offsets[page])
+            return pickle.load(f)
+
+    def page(self, page: int) -> Dict[str, List[SearchResult]]:
+        """Results of query lines from given page (numbered from 0), by query line."""
+        if not 0 <= page < self.pages_count:
+            return {}
+        results, results_by_refseq = rehydrate([self.columns(page)])
+        return results
+
+    def find(self, refseq, position, alt) -> Optional[UserUploadedMutation]:
+        """Details of user's mutation with given refseq, position and alt,
+
+        looked up in raw columns of the single page holding it (without
+        rehydration of the results). The details are not bound to any
+        mutation object.
+        """
+        location = self.mutations_index.get((refseq, position, alt))
+        if location is None:
+            return
+        page, row = location
+        columns = self.columns(page)
+        return UserUploadedMutation(
+            count=columns['count'][row],
+            query=columns['query_lines'][columns['line'][row]],
+            mutation=None
+        )
+
+    def mutation_ids(self, chunk_size=500) -> List[int]:
+        """Identifiers of the mutations in the results, resolved in bulk (without reading the pages).
+
+        Read-only: mutations which are not in the database are skipped
+        (these are created on rehydration only, see `to_search`).
+        """
+        refseqs = {refseq for refseq, position, alt in self.mutations_index}
+        protein_ids = {}
+        for chunk in chunked_list(refseqs, chunk_size=chunk_size, progress=False):
+            protein_ids.update(
+                db.session.query(Protein.refseq, Protein.id).filter(Protein.refseq.in_(chunk))
+            )
+
+        mutation_keys = {
+            (protein_ids[refseq], position, alt)
+            for refseq, position, alt in self.mutations_index
+            if refseq in protein_ids
+        }
+        ids = fetch_mutations(mutation_keys, ids_only=True, chunk_size=chunk_size)
+
+        return list(ids.values())
+
+    def to_search(self) -> MutationSearch:
+        """Rehydrate all the results into a MutationSearch."""
+        results, results_by_refseq = rehydrate(
+            self.columns(page)
+            for page in range(self.pages_count)
+        )
+        return MutationSearch.from_results(
+            query=self.query,
+            results=results,
+            results_by_refseq=results_by_refseq,
+            without_mutations=self.without_mutations,
+            badly_formatted=self.badly_formatted,
+            hidden_results_cnt=self.hidden_results_cnt
+        )
+
+
+def indexed_results(search: MutationSearch) -> Set[int]:
+    """Identifiers of results which can be looked up by refseq, position and alt."""
+    return {
+        id(result)
+        for results in search.results_by_refseq.values()
+        for result in results.values()
+    }
+
+
+def search_to_columns(search: MutationSearch) -> dict:
+    """Columnar form of a search (with all results in a single page), compact to send between processes."""
+    return {
+        'query': search.query,
+        'without_mutations': search.without_mutations,
+        'badly_formatted': search.badly_formatted,
+        'hidden_results_cnt': search.hidden_results_cnt,
+        'page': StoredSearch._to_columns(list(search.results.items()), indexed_results(search))
+    }
+
+
+def search_from_columns(data: dict) -> MutationSearch:
+    """Rehydrate a search from its columnar form, see `search_to_columns`."""
+    results, results_by_refseq = rehydrate([data['page']])
+    return MutationSearch.from_results(
+        query=data['query'],
+        results=results,
+        results_by_refseq=results_by_refseq,
+        without_mutations=data['without_mutations'],
+        badly_formatted=data['badly_formatted'],
+        hidden_results_cnt=data['hidden_results_cnt']
+    )
+
+
+def merge_columns(parts: Iterable[dict]) -> dict:
+    """Merge columnar forms of searches of subsequent parts of the same query.
+
+    Gives the same results as `MutationSearch.merge` of the searches would,
+    without rehydration (thus without queries to the database).
+    """
+    merged = {'query': '', 'without_mutations': [], 'badly_formatted': [], 'hidden_results_cnt': 0}
+    copied = ['position', 'alt', 'count', 'type', 'novel']
+    columns = {name: [] for name in ['line', 'refseq', *copied]}
+    extra = defaultdict(dict)
+    query_lines = []
+    refseqs = []
+    refseq_codes = {}
+    # (refseq, position, alt) of the merged rows
+    keys = []
+    rows_by_line = {}
+    # (refseq, position, alt) -> the row looked up by these
+    index = {}
+
+    for part in parts:
+        for name in ['query', 'without_mutations', 'badly_formatted', 'hidden_results_cnt']:
+            merged[name] += part[name]
+
+        page = part['page']
+        page_rows = defaultdict(list)
+        for row, line in enumerate(page['line']):
+            page_rows[line].append(row)
+
+        for line, query_line in enumerate(page['query_lines']):
+            rows = page_rows[line]
+            row_keys = [
+                (page['refseqs'][page['refseq'][row]], page['position'][row], page['alt'][row])
+                for row in rows
+            ]
+
+            if query_line in rows_by_line:
+                # the line was queried in one of the previous parts: only the counts change
+                count = page['count'][rows[0]]
+                repeated = {}
+                for merged_row in rows_by_line[query_line]:
+                    columns['count'][merged_row] += count
+                    repeated[keys[merged_row]] = merged_row
+                for row, key in zip(rows, row_keys):
+                    if page['indexed'][row] and key in repeated:
+                        index[key] = repeated[key]
+                continue
+
+            merged_rows = rows_by_line[query_line] = []
+            for row, key in zip(rows, row_keys):
+                merged_row = len(keys)
+                refseq = key[0]
+                if refseq not in refseq_codes:
+                    refseq_codes[refseq] = len(refseqs)
+                    refseqs.append(refseq)
+
+                columns['line'].append(len(query_lines))
+                columns['refseq'].append(refseq_codes[refseq])
+                for name in copied:
+                    columns[name].append(page[name][row])
+                for name, values in page['extra'].items():
+                    extra[name][merged_row] = values[row]
+
+                keys.append(key)
+                merged_rows.append(merged_row)
+                if page['indexed'][row]:
+                    index[key] = merged_row
+            query_lines.append(query_line)
+
+    indexed = set(index.values())
+    columns['indexed'] = [row in indexed for row in range(len(keys))]
+    columns['extra'] = {
+        name: [values.get(row) for row in range(len(keys))]
+        for name, values in extra.items()
+    }
+    columns['query_lines'] = query_lines
+    columns['refseqs'] = refseqs
+    merged['page'] = columns
+    return merged
+
+
+def rehydrate(pages: Iterable[Dict[str, list]], chunk_size=500):
+    """Recreate search results from columns of given pages.
+
+    Proteins and mutations are fetched in bulk; mutations which are
+    not in the database are created (as novel mutations would be).
+    Results of proteins which no longer exist are omitted.
+
+    Returns:
+        results by query line, results by refseq and (position, alt)
+    """
+    pages = list(pages)
+
+    refseqs = {refseq for page in pages for refseq in page['refseqs']}
+    proteins = {}
+    for chunk in chunked_list(refseqs, chunk_size=chunk_size, progress=False):
+        proteins.update(
+            (protein.refseq, protein)
+            for protein in (
+                Protein.query
+                .filter(Protein.refseq.in_(chunk))
+                .options(joinedload(Protein.gene))
+            )
+        )
+
+    mutation_keys = {
+        (proteins[page['refseqs'][code]].id, position, alt)
+        for page in pages
+        for code, position, alt in zip(page['refseq'], page['position'], page['alt'])
+        if page['refseqs'][code] in proteins
+    }
+    mutations = fetch_mutations(mutation_keys, chunk_size=chunk_size)
+
+    results = {}
+    results_by_refseq = {}
+
+    for page in pages:
+        extra = page['extra']
+        for row, line in enumerate(page['line']):
+            refseq = page['refseqs'][page['refseq'][row]]
+            protein = proteins.get(refseq)
+            if not protein:
+                continue
+
+            position, alt = page['position'][row], page['alt'][row]
+            key = (protein.id, position, alt)
+
+            if key not in mutations:
+                mutations[key] = Mutation(
+                    protein=protein,
+                    protein_id=protein.id,
+                    position=position,
+                    alt=alt
+                )
+            mutation = mutations[key]
+
+            result = SearchResult(
+                protein=protein,
+                mutation=mutation,
+                is_mutation_novel=page['novel'][row],
+                type=page['type'][row],
+                **{name: values[row] for name, values in extra.items()}
+            )
+            query_line = page['query_lines'][line]
+            result.meta_user = UserUploadedMutation(
+                count=page['count'][row],
+                query=query_line,
+                mutation=mutation
+            )
+            mutation.meta_user = result.meta_user
+
+            results.setdefault(query_line, []).append(result)
+            if page['indexed'][row]:
+                results_by_refseq.setdefault(refseq, {})[position, alt] = result
+
+    return results, results_by_refseq
@@ -8,6 +8,7 @@ from werkzeug.utils import cached_property
 from models import Protein, UniprotEntry, ProteinReferences
 from models import Gene
 from database import db
+from search.index import search_index
 
 
 class GeneMatch:
@@ -48,6 +49,9 @@ class GeneMatch:
 
 class GeneOrProteinSearch(ABC):
 
+    # is there a search index (see search.index) named after this search?
+    indexed = False
+
     def __init__(self, options=None):
         self.options = options
 
@@ -65,6 +69,49 @@ class GeneOrProteinSearch(ABC):
     def search(self, phrase, sql_filters=None, limit=None):
         pass
 
+    def match_in_index(self, phrase, sql_filters=None, limit=None):
+        """Ids of rows with the feature starting with given phrase, found in the search index.
+
+        If there are no additional filters and the number of results is limited,
+        only rows of the best matching genes are returned.
+
+        Returns None if the look-up should be performed with SQL instead: when the
+        index is not available or when there are too many candidates to be passed
+        to a filtered or unlimited SQL query.
+        """
+        if not self.indexed or not search_index.enabled:
+            return None
+
+        index = search_index[self.name]
+        positions = index.prefix(phrase)
+
+        if sql_filters or not limit:
+            if len(positions) > search_index.max_candidates:
+                return None
+        else:
+            best_genes = set()
+            for position in index.by_distance(positions, phrase):
+                best_genes.add(index.payloads[position][1])
+                if len(best_genes) == limit:
+                    break
+            positions = [
+                position
+                for position in positions
+                if index.payloads[position][1] in best_genes
+            ]
+
+        return [index.payloads[position][0] for position in positions]
+
+    def look_up_filter(self, phrase, sql_filters, limit, id_column, like_filter):
+        """Filter selecting rows matching the phrase by ids from the search index,
+        falling back to given LIKE filter. None is returned if nothing matches."""
+        ids = self.match_in_index(phrase, sql_filters, limit)
+        if ids is None:
+            return like_filter
+        if not ids:
+            return None
+        return id_column.in_(ids)
+
     @property
     def base_query(self):
         return Gene.query
@@ -98,8 +145,14 @@ class GeneSearch(GeneOrProteinSearch):
         be executed on the preferred_isoform of gene.
         """
 
+        phrase = phrase.strip()
         feature = self.get_feature(Gene)
-        filters = [feature.like(phrase.strip() + '%')]
+        look_up = self.look_up_filter(phrase, sql_filters, limit, Gene.id, feature.like(phrase + '%'))
+
+        if look_up is None:
+            return []
+
+        filters = [look_up]
 
         if sql_filters:
             filters += sql_filters
@@ -132,6 +185,7 @@ class SymbolGeneSearch(GeneSearch):
 
     name = 'gene_symbol'
     feature = 'name'
+    indexed = True
 
 
 class GeneNameSearch(GeneSearch):
@@ -144,6 +198,7 @@ class GeneNameSearch(GeneSearch):
 
     name = 'gene_name'
     feature = 'full_name'
+    indexed = True
 
 
 class ProteinSearch(GeneOrProteinSearch):
@@ -220,10 +275,18 @@ class ProteinSearch(GeneOrProteinSearch):
 
 class ProteinNameSearch(ProteinSearch):
     name = 'protein_name'
+    indexed = True
 
     def search(self, phrase, sql_filters=None, limit=None):
 
-        filters = [Protein.full_name.ilike(phrase + '%')]
+        look_up = self.look_up_filter(
+            phrase, sql_filters, limit, Protein.id, Protein.full_name.ilike(phrase + '%')
+        )
+
+        if look_up is None:
+            return []
+
+        filters = [look_up]
 
         query = self.create_query(limit, filters, sql_filters)
 
@@ -248,6 +311,7 @@ class RefseqGeneSearch(ProteinSearch):
 
     name = 'refseq'
     pretty_name = 'RefSeq'
+    indexed = True
 
     def search(self, phrase, sql_filters=None, limit=None):
 
@@ -257,7 +321,14 @@ class RefseqGeneSearch(ProteinSearch):
         if not (phrase.startswith('NM_') or phrase.startswith('nm_')):
             return []
 
-        filters = [Protein.refseq.like(phrase + '%')]
+        look_up = self.look_up_filter(
+            phrase, sql_filters, limit, Protein.id, Protein.refseq.like(phrase + '%')
+        )
+
+        if look_up is None:
+            return []
+
+        filters = [look_up]
 
         query = self.create_query(limit, filters, sql_filters)
 
@@ -307,13 +378,21 @@ class UniprotSearch(ProteinSearch):
     """
 
     name = 'uniprot'
+    indexed = True
 
     def search(self, phrase, sql_filters=None, limit=None):
 
         if len(phrase) < 3:
             return []
 
-        filters = [UniprotEntry.accession.like(phrase + '%')]
+        look_up = self.look_up_filter(
+            phrase, sql_filters, limit, UniprotEntry.id, UniprotEntry.accession.like(phrase + '%')
+        )
+
+        if look_up is None:
+            return []
+
+        filters = [look_up]
 
         def add_joins(q):
             return (
@@ -0,0 +1,319 @@
+"""Process-local text indices backing the search bar and autocompletion.
+
+Instead of issuing LIKE queries on every keystroke, the searchable texts
+(gene symbols, RefSeq ids, disease names, etc.) are loaded once into memory.
+Prefix look-ups use binary search over sorted, lower-cased texts and substring
+look-ups use n-gram postings. The indices are built lazily and rebuilt after
+the data version changes (i.e. after an import) or after any of the indexed
+values (or relationships) is modified in the current process.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from operator import itemgetter
+from threading import RLock
+from typing import Callable, Dict, Hashable, Iterable, List, Set, Tuple
+
+from flask import current_app
+from Levenshtein import distance, ratio
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from database import db
+from helpers.cache import Cache, data_version
+from models import Gene, Protein, UniprotEntry, ProteinReferences, Disease, Cancer, Pathway
+
+
+class TextIndex:
+    """Case-insensitive prefix and substring look-ups of texts.
+
+    Each text is associated with a payload (e.g. an id of the matched row);
+    look-ups return positions of the matched entries, use `payloads` or
+    `texts` to retrieve the associated data.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, Hashable]], substring=False, n=3):
+        entries = sorted(
+            (
+                (str(text).lower(), str(text), payload)
+                for text, payload in entries
+                if text is not None
+            ),
+            key=itemgetter(0)
+        )
+        self.keys = [key for key, text, payload in entries]
+        self.texts = [text for key, text, payload in entries]
+        self.payloads = [payload for key, text, payload in entries]
+        self.n = n
+        self.postings = None
+
+        if substring:
+            postings = defaultdict(list)
+            for position, key in enumerate(self.keys):
+                for gram in self.ngrams(key):
+                    postings[gram].append(position)
+            self.postings = dict(postings)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def ngrams(self, text):
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def prefix(self, phrase) -> range:
+        """Positions of texts starting with given phrase, in alphabetical order."""
+        phrase = phrase.lower()
+        start = bisect_left(self.keys, phrase)
+        end = bisect_left(self.keys, phrase + '\U0010ffff', lo=start)
+        return range(start, end)
+
+    def substring(self, phrase) -> List[int]:
+        """Positions of texts containing given phrase, in alphabetical order."""
+        if self.postings is None:
+            raise ValueError('The index was built without substring support')
+
+        phrase = phrase.lower()
+
+        if len(phrase) < self.n:
+            candidates = range(len(self.keys))
+        else:
+            postings = sorted(
+                (self.postings.get(gram, []) for gram in self.ngrams(phrase)),
+                key=len
+            )
+            candidates = set(postings[0])
+            for positions in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(positions)
+            candidates = sorted(candidates)
+
+        keys = self.keys
+        return [position for position in candidates if phrase in keys[position]]
+
+    def by_distance(self, positions, phrase) -> List[int]:
+        """Sort positions by edit distance between the text and the phrase (case-sensitive)."""
+        texts = self.texts
+        return sorted(positions, key=lambda position: distance(texts[position], phrase))
+
+
+class SearchIndex:
+    """Registry of lazily built text indices."""
+
+    def __init__(self):
+        self.builders: Dict[str, Callable[[], TextIndex]] = {}
+        self.indices: Dict[str, TextIndex] = {}
+        # keys of attributes which the indices are built from, by model
+        self.attributes: Dict[type, Set[str]] = defaultdict(set)
+        self.version = None
+        # re-entrant: queries building an index may autoflush changes which clear the indices
+        self._lock = RLock()
+
+    def register(self, name, attributes: Dict[type, Iterable[str]]):
+        """Register a function building an index of given name from given attributes of models.
+
+        Changes of these attributes (including relationships used for joins)
+        will invalidate the indices.
+        """
+        def decorator(builder):
+            self.builders[name] = builder
+            for model, keys in attributes.items():
+                self.attributes[model].update(keys)
+            return builder
+        return decorator
+
+    def is_affected_by(self, instance, new_or_deleted=False) -> bool:
+        """Whether a change of given instance may change (some of) the indices."""
+        state = None
+        for model, keys in self.attributes.items():
+            if not isinstance(instance, model):
+                continue
+            if new_or_deleted:
+                return True
+            state = state or inspect(instance)
+            if any(state.attrs[key].history.has_changes() for key in keys):
+                return True
+        return False
+
+    def is_affected_by_changes(self, session) -> bool:
+        """Whether pending (or just flushed) changes in given session may change the indices."""
+        return any(
+            self.is_affected_by(instance, new_or_deleted)
+            for instances, new_or_deleted in [(session.new, True), (session.deleted, True), (session.dirty, False)]
+            for instance in instances
+        )
+
+    @property
+    def enabled(self):
+        return current_app.config.get('SEARCH_INDEX_ENABLED', False)
+
+    @property
+    def max_candidates(self):
+        """The largest number of ids to be passed to SQL queries as a look-up result."""
+        return current_app.config.get('SEARCH_INDEX_MAX_CANDIDATES', 1000)
+
+    def __getitem__(self, name) -> TextIndex:
+        # pending changes of the indexed attributes invalidate the indices too;
+        # queries rebuilding these will flush the changes (as for other queries)
+        if self.indices and self.is_affected_by_changes(db.session):
+            self.clear()
+
+        version = data_version()
+        with self._lock:
+            if version != self.version:
+                self.indices = {}
+                self.version = version
+            if name not in self.indices:
+                self.indices[name] = self.builders[name]()
+            return self.indices[name]
+
+    def clear(self):
+        with self._lock:
+            self.indices = {}
+
+
+search_index = SearchIndex()
+
+# allow to clear the indices together with other caches
+Cache.caches.append(search_index)
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_modified(session, flush_context):
+    # the history of attributes is still available after flush
+    if search_index.indices and search_index.is_affected_by_changes(session):
+        search_index.clear()
+
+
+def ranked_matches(phrase, prefix=(), substring=(), limit=None) -> list:
+    """Payloads of entries matching the phrase in any of given indices.
+
+    Results are sorted by the similarity to the phrase (Levenshtein ratio,
+    ignoring case), just like `database.levenshtein_sorted` does in SQL.
+
+    Args:
+        prefix: names of indices to be searched for texts starting with the phrase
+        substring: names of indices to be searched for texts containing the phrase
+    """
+    phrase_lower = phrase.lower()
+    similarities = {}
+
+    for names, look_up in [(prefix, TextIndex.prefix), (substring, TextIndex.substring)]:
+        for name in names:
+            index = search_index[name]
+            for position in look_up(index, phrase):
+                payload = index.payloads[position]
+                similarity = ratio(index.keys[position], phrase_lower)
+                if similarity > similarities.get(payload, -1):
+                    similarities[payload] = similarity
+
+    return sorted(similarities, key=similarities.get, reverse=True)[:limit]
+
+
+def fetch_ranked(model, ids) -> list:
+    """Fetch instances of model with given ids, preserving the order of ids."""
+    if not ids:
+        return []
+    by_id = {
+        instance.id: instance
+        for instance in model.query.filter(model.id.in_(ids))
+    }
+    return [by_id[i] for i in ids if i in by_id]
+
+
+# Gene-level indices (payloads are: matched row id, gene id);
+# only genes with preferred isoforms are searchable
+
+@search_index.register('gene_symbol', {Gene: ['name', 'preferred_isoform_id', 'preferred_isoform']})
+def gene_symbols():
+    return TextIndex(
+        (name, (gene_id, gene_id))
+        for name, gene_id in (
+            db.session.query(Gene.name, Gene.id)
+            .filter(Gene.preferred_isoform_id.isnot(None))
+        )
+    )
+
+
+@search_index.register('gene_name', {Gene: ['full_name', 'preferred_isoform_id', 'preferred_isoform']})
+def gene_names():
+    return TextIndex(
+        (full_name, (gene_id, gene_id))
+        for full_name, gene_id in (
+            db.session.query(Gene.full_name, Gene.id)
+            .filter(Gene.preferred_isoform_id.isnot(None))
+        )
+    )
+
+
+@search_index.register('refseq', {Protein: ['refseq', 'gene_id', 'gene']})
+def refseqs():
+    return TextIndex(
+        (refseq, (protein_id, gene_id))
+        for refseq, protein_id, gene_id in (
+            db.session.query(Protein.refseq, Protein.id, Protein.gene_id)
+            .filter(Protein.gene_id.isnot(None))
+        )
+    )
+
+
+@search_index.register('protein_name', {Protein: ['full_name', 'gene_id', 'gene']})
+def protein_names():
+    return TextIndex(
+        (full_name, (protein_id, gene_id))
+        for full_name, protein_id, gene_id in (
+            db.session.query(Protein.full_name, Protein.id, Protein.gene_id)
+            .filter(Protein.gene_id.isnot(None))
+        )
+    )
+
+
+@search_index.register('uniprot', {
+    UniprotEntry: ['accession', 'references'],
+    ProteinReferences: ['uniprot_entries', 'protein_id', 'protein'],
+    Protein: ['gene_id', 'gene', 'external_references']
+})
+def uniprot_accessions():
+    return TextIndex(
+        (accession, (uniprot_id, gene_id))
+        for accession, uniprot_id, gene_id in (
+            db.session.query(UniprotEntry.accession, UniprotEntry.id, Protein.gene_id)
+            .select_from(Protein)
+            .join(ProteinReferences)
+            .join(ProteinReferences.uniprot_association_table)
+            .join(UniprotEntry)
+            .filter(Protein.gene_id.isnot(None))
+            .distinct()
+        )
+    )
+
+
+# Indices for suggestions (payloads are ids of rows)
+
+@search_index.register('disease', {Disease: ['name']})
+def disease_names():
+    return TextIndex(db.session.query(Disease.name, Disease.id), substring=True)
+
+
+@search_index.register('cancer_code', {Cancer: ['code']})
+def cancer_codes():
+    return TextIndex(db.session.query(Cancer.code, Cancer.id))
+
+
+@search_index.register('cancer_name', {Cancer: ['name']})
+def cancer_names():
+    return TextIndex(db.session.query(Cancer.name, Cancer.id), substring=True)
+
+
+@search_index.register('pathway_gene_ontology', {Pathway: ['gene_ontology']})
+def pathway_gene_ontology_ids():
+    return TextIndex(db.session.query(Pathway.gene_ontology, Pathway.id))
+
+
+@search_index.register('pathway_reactome', {Pathway: ['reactome']})
+def pathway_reactome_ids():
+    return TextIndex(db.session.query(Pathway.reactome, Pathway.id))
+
+
+@search_index.register('pathway_description', {Pathway: ['description']})
+def pathway_descriptions():
+    return TextIndex(db.session.query(Pathway.description, Pathway.id), substring=True)
@@ -1,12 +1,12 @@
 from collections import defaultdict
 from operator import attrgetter
+from time import monotonic
 from typing import List
 
-from werkzeug.datastructures import FileStorage
-
 from app import celery
 from database import bdb
 from helpers.bioinf import complement
+from helpers.parsers import UploadedTextFile
 from models import UserUploadedMutation
 
 from .mutation_result import SearchResult
@@ -15,13 +15,21 @@ from .protein_mutations import get_protein_muts
 
 class MutationSearch:
 
+    # number of lines for which genomic mutations are looked up together
+    batch_size = 1000
+
+    # minimal time (in seconds) between two progress updates sent to celery
+    progress_interval = 0.5
+
     def __init__(self, vcf_file=None, text_query=None, filter_manager=None):
         """Performs search for known and novel mutations from provided VCF file and/or text query.
 
         Stop codon mutations are not considered.
 
         Args:
-            vcf_file: a file object containing data in Variant Call Format
+            vcf_file: data in Variant Call Format: an uploaded file, a binary stream,
+                bytes (all can be gzip-compressed; these are read incrementally)
+                or a list of lines
             text_query: a string of multiple lines, where each line represents either:
                  - a genomic mutation (e.g. chr12 57490358 C A) or
                  - a protein mutation (e.g. STAT6 W737C)
@@ -36,11 +44,14 @@ class MutationSearch:
         self.hidden_results_cnt = 0
         self._progress = 0
         self._total = 0
+        self._last_progress_update = 0
+        self._vcf_stream = None
         if vcf_file:
-            if type(vcf_file) is FileStorage:
-                # as bad as it can be, but usually the vcf file will be a list of lines already
-                vcf_file = vcf_file.readlines()
-            self._total += len(vcf_file)
+            if isinstance(vcf_file, list):
+                self._total += len(vcf_file)
+            else:
+                # the number of lines will be estimated while reading
+                vcf_file = self._vcf_stream = UploadedTextFile(vcf_file)
         if text_query:
             self._total += sum(1 for _ in text_query.splitlines())
 
@@ -56,25 +67,92 @@ class MutationSearch:
 
         self.data_filter = data_filter
 
-        if vcf_file:
-            self.parse_vcf(vcf_file)
+        # reuse a single read transaction for all the mappings lookups
+        with bdb.reader():
+            if vcf_file:
+                self.parse_vcf(vcf_file)
 
-        if text_query:
-            self.query += text_query
-            self.parse_text(text_query)
+            if text_query:
+                self.query += text_query
+                self.parse_text(text_query)
 
         # when parsing is complete, quickly forget where is such complex object
         # like filter_manager so any instance of this class can be pickled.
         self.data_filter = None
+        self._vcf_stream = None
+
+    @classmethod
+    def from_results(
+        cls, query, results, results_by_refseq, without_mutations,
+        badly_formatted, hidden_results_cnt
+    ) -> 'MutationSearch':
+        """Recreate a completed search from its results (without parsing the query again)."""
+        search = cls.__new__(cls)
+        search.query = query
+        search.results = results
+        search.results_by_refseq = defaultdict(dict, results_by_refseq)
+        search.without_mutations = without_mutations
+        search.badly_formatted = badly_formatted
+        search.hidden_results_cnt = hidden_results_cnt
+        search._progress = search._total = len(results)
+        search._last_progress_update = 0
+        search._vcf_stream = None
+        search.data_filter = None
+        return search
 
     def progress(self):
         self._progress += 1
         if celery.current_task:
+            now = monotonic()
+            if now - self._last_progress_update < self.progress_interval:
+                return
+            self._last_progress_update = now
             celery.current_task.update_state(
                 state='PROGRESS',
-                meta={'progress': self._progress / self._total}
+                meta={'progress': self.estimate_progress()}
             )
 
+    def estimate_progress(self) -> float:
+        total = self._total
+        if self._vcf_stream:
+            # estimate the number of lines in the VCF file from the number of bytes read so far
+            fraction_read = self._vcf_stream.fraction_read()
+            if fraction_read:
+                total += self._vcf_stream.lines_read / fraction_read
+        if not total:
+            return 0
+        return min(self._progress / total, 1)
+
+    def merge(self, other: 'MutationSearch'):
+        """Merge results of a search of the following part of the same query into this search.
+
+        The results are the same as if the concatenated query was searched at once.
+        """
+        self.query += other.query
+        self.without_mutations.extend(other.without_mutations)
+        self.badly_formatted.extend(other.badly_formatted)
+        self.hidden_results_cnt += other.hidden_results_cnt
+        self._progress += other._progress
+        self._total += other._total
+
+        # lines which were queried in both searches
+        repeated = {}
+
+        for query_line, items in other.results.items():
+            if query_line in self.results:
+                count = items[0].meta_user.count
+                for result in self.results[query_line]:
+                    result.meta_user.count += count
+                    mutation = result.mutation
+                    repeated[mutation.protein.refseq, mutation.position, mutation.alt, query_line] = result
+            else:
+                self.results[query_line] = items
+
+        for refseq, results in other.results_by_refseq.items():
+            for (position, alt), result in results.items():
+                result = repeated.get((refseq, position, alt, result.meta_user.query), result)
+                self.results_by_refseq[refseq][position, alt] = result
+
     def add_mutation_items(self, items: List[SearchResult], query_line: str):
 
         self.progress()
@@ -107,6 +185,7 @@ class MutationSearch:
             self.results[query_line] = items
 
     def parse_vcf(self, vcf_file):
+        batch = []
 
         for line in vcf_file:
             line = line.strip()
@@ -128,19 +207,28 @@ class MutationSearch:
             alts = alts.split(',')
             for alt in alts:
 
-                items = bdb.get_genomic_muts(chrom, pos, ref, alt)
+                # we don't have queries in our format for vcf files:
+                # those need to be built this way
+                parsed_line = ' '.join(('chr' + chrom, pos, ref, alt)) + '\n'
 
-                chrom = 'chr' + chrom
-                parsed_line = ' '.join((chrom, pos, ref, alt)) + '\n'
+                batch.append(((chrom, pos, ref, alt), parsed_line))
 
-                self.add_mutation_items(items, parsed_line)
+            if len(batch) >= self.batch_size:
+                self._add_vcf_batch(batch)
+                batch = []
 
-                # we don't have queries in our format for vcf files:
-                # those need to be built this way
-                self.query += parsed_line
+        self._add_vcf_batch(batch)
+
+    def _add_vcf_batch(self, batch):
+        all_items = bdb.get_genomic_muts_bulk(snv for snv, parsed_line in batch)
+
+        for (snv, parsed_line), items in zip(batch, all_items):
+            self.add_mutation_items(items, parsed_line)
+            self.query += parsed_line
 
     def parse_text(self, text_query):
         complement_prefix = 'Complement of '
+        batch = []
 
         for line in text_query.splitlines():
             if line.startswith(complement_prefix):
@@ -151,18 +239,47 @@ class MutationSearch:
                 if chrom.startswith('chr'):
                     chrom = chrom[3:]
 
-                items = bdb.get_genomic_muts(chrom, pos, ref, alt)
-
-                if not items:
-                    line = complement_prefix + line
-                    items = bdb.get_genomic_muts(chrom, pos, complement(ref), complement(alt))
+                # genomic mutations will be looked up for the whole batch at once
+                batch.append((line, (chrom, pos, ref, alt), None))
 
             elif len(data) == 2:
                 gene, mut = [x.upper() for x in data]
 
-                items = get_protein_muts(gene, mut)
+                batch.append((line, None, get_protein_muts(gene, mut)))
             else:
                 self.badly_formatted.append(line)
                 continue
 
+            if len(batch) >= self.batch_size:
+                self._add_text_batch(batch)
+                batch = []
+
+        self._add_text_batch(batch)
+
+    def _add_text_batch(self, batch):
+        complement_prefix = 'Complement of '
+
+        genomic_items = iter(
+            bdb.get_genomic_muts_bulk(snv for line, snv, items in batch if snv)
+        )
+        batch = [
+            (line, snv, next(genomic_items) if snv else items)
+            for line, snv, items in batch
+        ]
+
+        # try the other strand for genomic mutations which were not found
+        not_found = [
+            i
+            for i, (line, snv, items) in enumerate(batch)
+            if snv and not items
+        ]
+        complement_items = bdb.get_genomic_muts_bulk(
+            (chrom, pos, complement(ref), complement(alt))
+            for chrom, pos, ref, alt in (batch[i][1] for i in not_found)
+        )
+        for i, items in zip(not_found, complement_items):
+            line, snv, _ = batch[i]
+            batch[i] = (complement_prefix + line, snv, items)
+
+        for line, snv, items in batch:
             self.add_mutation_items(items, line)
@@ -1,16 +1,59 @@
+import os
 import pickle
-from typing import Dict
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, NamedTuple
+
+from celery import chord
+from flask import current_app
 
 from app import celery
+from helpers.parsers import UploadedTextFile
 from helpers.pickle import pickle_as_str, unpickle_str
+from search.dataset import search_to_columns, merge_columns
 from search.mutation import MutationSearch
 
 from search.filters import SearchViewFilters
 
 
+class UploadedRange(NamedTuple):
+    """Byte range (of complete lines) of a saved upload."""
+    path: str
+    start: int
+    end: int
+
+    def read(self) -> bytes:
+        with open(self.path, 'rb') as upload:
+            upload.seek(self.start)
+            return upload.read(self.end - self.start)
+
+
+def save_upload(vcf_file) -> str:
+    """Save the (decompressed) content of an uploaded VCF file, so that it can be read by workers.
+
+    The file is saved in SEARCH_UPLOAD_FOLDER (or in the temporary directory)
+    which has to be shared with Celery workers.
+
+    Returns: path to the saved file
+    """
+    directory = current_app.config.get('SEARCH_UPLOAD_FOLDER')
+    with NamedTemporaryFile('w', encoding='utf-8', dir=directory, prefix='search_', suffix='.vcf', delete=False) as saved:
+        for line in UploadedTextFile(vcf_file):
+            saved.write(line)
+    return saved.name
+
+
+def remove_upload(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
 class SearchTask:
 
     def __init__(self, vcf_file, textarea_query: str, filter_manager: SearchViewFilters, dataset_uri=None):
+        """
+        Args:
+            vcf_file: path to a saved upload (see `save_upload`) or an UploadedRange of it
+        """
         self.vcf_file = vcf_file
         self.textarea_query = textarea_query
         self.filter_manager = filter_manager
@@ -32,6 +75,10 @@ class SearchTask:
             # print('This weird issue again... Retrying')
             filter_manager = pickle.loads(filter_manager)
 
+        # ranges are serialized as lists
+        if isinstance(vcf_file, (list, tuple)):
+            vcf_file = UploadedRange(*vcf_file)
+
         return cls(
             vcf_file,
             textarea_query,
@@ -39,9 +86,116 @@ class SearchTask:
             dataset_uri
         )
 
+    @property
+    def upload_path(self):
+        if isinstance(self.vcf_file, UploadedRange):
+            return self.vcf_file.path
+        return self.vcf_file or None
+
+    def search(self) -> MutationSearch:
+        if isinstance(self.vcf_file, UploadedRange):
+            vcf_file = self.vcf_file.read()
+        elif self.vcf_file:
+            with open(self.vcf_file, 'rb') as vcf_file:
+                return MutationSearch(vcf_file, self.textarea_query, self.filter_manager)
+        else:
+            vcf_file = None
+        return MutationSearch(vcf_file, self.textarea_query, self.filter_manager)
+
+    def split(self, chunk_size: int) -> List['SearchTask']:
+        """Split the query into tasks of at most `chunk_size` lines each.
+
+        The saved VCF file is read line by line and the tasks get byte ranges
+        of its lines (rather than the lines), to read these on their own.
+
+        Merging the results of the tasks (in the returned order) with
+        `MutationSearch.merge` gives the results of the whole query.
+        """
+        chunks = []
+
+        if self.vcf_file:
+            path = self.upload_path
+            start = end = 0
+            lines_count = 0
+
+            with open(path, 'rb') as vcf_file:
+                for line in vcf_file:
+                    # the VCF parser stops on the first empty line
+                    if not line.strip():
+                        break
+                    end += len(line)
+                    lines_count += 1
+                    if lines_count == chunk_size:
+                        chunks.append(SearchTask(UploadedRange(path, start, end), None, self.filter_manager))
+                        start = end
+                        lines_count = 0
+            if lines_count:
+                chunks.append(SearchTask(UploadedRange(path, start, end), None, self.filter_manager))
+
+        if self.textarea_query:
+            lines = self.textarea_query.splitlines(keepends=True)
+            for i in range(0, len(lines), chunk_size):
+                chunks.append(SearchTask(None, ''.join(lines[i:i + chunk_size]), self.filter_manager))
+
+        return chunks
+
+
+# uploads with more lines will be split into chunks searched in parallel
+CHUNK_SIZE = 5000
+
+
+@celery.task(bind=True)
+def search_task(self, task_data):
+    task = SearchTask.from_serialized(**task_data)
+    chunks = task.split(CHUNK_SIZE)
+
+    if len(chunks) < 2:
+        mutation_search = task.search()
+        remove_upload(task.upload_path)
+        return pickle_as_str(search_to_columns(mutation_search)), task.dataset_uri
+
+    subtasks = [search_chunk_task.s(chunk.serialize()) for chunk in chunks]
+    for subtask in subtasks:
+        subtask.freeze()
+
+    # the ids of subtasks are needed to report the progress of the search
+    self.update_state(
+        state='PROGRESS',
+        meta={'progress': 0, 'subtasks': [subtask.id for subtask in subtasks]}
+    )
+
+    # the result of merging will be stored as the result of this task
+    raise self.replace(chord(subtasks, merge_searches_task.s(task.dataset_uri, task.upload_path)))
+
 
 @celery.task
-def search_task(task_data):
+def search_chunk_task(task_data):
     task = SearchTask.from_serialized(**task_data)
-    mutation_search = MutationSearch(task.vcf_file, task.textarea_query, task.filter_manager)
-    return pickle_as_str(mutation_search), task.dataset_uri
+    return pickle_as_str(search_to_columns(task.search()))
+
+
+@celery.task
+def merge_searches_task(pickled_searches, dataset_uri, upload_path=None):
+    remove_upload(upload_path)
+    # results are merged in the columnar form, to be rehydrated (in bulk) only once
+    merged = merge_columns(map(unpickle_str, pickled_searches))
+    return pickle_as_str(merged), dataset_uri
+
+
+def search_progress(celery_task) -> float:
+    """Return progress of a search task in progress (averaged over subtasks if the search was split)."""
+    meta = celery_task.result
+    subtasks = meta.get('subtasks')
+
+    if not subtasks:
+        return meta.get('progress', 0)
+
+    progress = 0
+    for subtask_id in subtasks:
+        subtask = celery.AsyncResult(subtask_id)
+        if subtask.status == 'SUCCESS':
+            progress += 1
+        elif subtask.status == 'PROGRESS':
+            progress += subtask.result.get('progress', 0)
+
+    return progress / len(subtasks)
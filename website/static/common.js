@@ -161,3 +161,61 @@ function flash(message, category) {
         category = 'warning'
     $('.flashes').append('<div class="alert alert-' + category + '" role="alert">' + message + ' </div>')
 }
+
+/**
+ * Enable keyset pagination in a Bootstrap-Table with server-side pagination
+ * (see keyset_columns of AjaxTableView): when the page following the last
+ * loaded one is requested (for the same ordering, search and filters),
+ * the cursor returned with the last page is sent along, so that the server
+ * does not have to skip over the preceding rows again.
+ * @param {Object} options - Bootstrap-Table options (modified in place)
+ * @returns {Object} options
+ */
+function with_keyset_pagination(options)
+{
+    var query_params = options.queryParams
+    var response_handler = options.responseHandler
+    var last_page = {}
+
+    function is_next_page(page)
+    {
+        var keys = ['url', 'sort', 'order', 'search', 'filters']
+        for(var i = 0; i < keys.length; i++)
+        {
+            if(page[keys[i]] !== last_page[keys[i]])
+                return false
+        }
+        return page.offset === last_page.offset + last_page.limit
+    }
+
+    options.queryParams = function(params)
+    {
+        if(query_params)
+            params = query_params.call(this, params)
+
+        var page = {
+            url: this.url,
+            sort: params.sort,
+            order: params.order,
+            search: params.search,
+            filters: params.filters,
+            offset: params.offset,
+            limit: params.limit
+        }
+        if(last_page.cursor && is_next_page(page))
+            params.cursor = last_page.cursor
+
+        last_page = page
+        return params
+    }
+
+    options.responseHandler = function(response)
+    {
+        last_page.cursor = response.cursor
+        if(response_handler)
+            response = response_handler.call(this, response)
+        return response
+    }
+
+    return options
+}
@@ -1,4 +1,6 @@
-from collections import defaultdict, Counter
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict
 
 from flask import current_app
 
@@ -7,33 +9,65 @@ from .stats import Statistics
 from .venn import VennDiagrams
 
 
-def hypermutated_samples(path, sample_column: int, threshold=900):
-    from helpers.parsers import iterate_tsv_gz_file
+class SampleMutationsCounter:
+    """Counts distinct mutations of samples, given lines of an annotated MAF file one by one.
+
+    Samples and genomic variants (chromosome, start, end, ref, alt) are given
+    compact, consecutive integer identifiers, so that a pair of these can be
+    stored as a single integer.
+    """
+
+    def __init__(self):
+        self.sample_ids = {}
+        self.sample_names = []
+        self.variant_ids = {}
+        self.counts = []
+        self.pairs = set()
+        self.total = 0
+
+    def add(self, sample, line) -> int:
+        """Count the mutation from given line for the sample and return the identifier of the sample."""
+        sample_id = self.sample_ids.get(sample)
+        if sample_id is None:
+            sample_id = self.sample_ids[sample] = len(self.sample_names)
+            self.sample_names.append(sample)
+            self.counts.append(0)
+
+        variant = (line[0], int(line[1]), int(line[2]), line[3], line[4])
+        variant_id = self.variant_ids.setdefault(variant, len(self.variant_ids))
 
-    samples_cnt = Counter()
-    muts = defaultdict(set)
-    total = 0
+        pair = variant_id << 32 | sample_id
+        if pair not in self.pairs:
+            self.pairs.add(pair)
+            self.counts[sample_id] += 1
 
-    for line in iterate_tsv_gz_file(path):
-        total += 1
-        muts[','.join([line[0], '%x' % int(line[1]), '%x' % int(line[2]), line[3], line[4]])].add(line[sample_column])
+        self.total += 1
+        return sample_id
 
-    for samples in muts.values():
-        for sample in samples:
-            samples_cnt[sample] += 1
+    def hypermutated(self, threshold=900) -> Dict[str, int]:
+        """Samples with more than `threshold` mutations, by the count of mutations (descending)."""
+        hypermutated = {
+            self.sample_names[sample_id]: count
+            for sample_id, count in sorted(enumerate(self.counts), key=itemgetter(1), reverse=True)
+            if count > threshold
+        }
+
+        percent = sum(hypermutated.values()) / self.total * 100 if self.total else 0
+        print(f'There are {len(hypermutated)} hypermutated samples.')
+        print(f'Hypermutated samples represent {percent} percent of analysed mutations.')
+
+        return hypermutated
+
+
+def hypermutated_samples(path, sample_column: int, threshold=900):
+    from helpers.parsers import iterate_tsv_gz_file
 
-    hypermutated = {}
-    for sample, count in samples_cnt.most_common():
-        if count > threshold:
-            hypermutated[sample] = count
-        else:
-            break
+    counter = SampleMutationsCounter()
 
-    percent = sum(hypermutated.values()) / total * 100
-    print(f'There are {len(hypermutated)} hypermutated samples.')
-    print(f'Hypermutated samples represent {percent} percent of analysed mutations.')
+    for line in iterate_tsv_gz_file(path, with_total=False):
+        counter.add(line[sample_column], line)
 
-    return hypermutated
+    return counter.hypermutated(threshold)
 
 
 store_classes = [Statistics, VennDiagrams, Plots, Datasets]
@@ -209,7 +209,7 @@ def source_specific_proteins_with_ptm_mutations() -> TableChunk:
 
 def source_specific_nucleotide_mappings() -> TableChunk:
     from database import bdb
-    from genomic_mappings import decode_csv
+    from genomic_mappings import decode_record
     from models import Mutation
     from tqdm import tqdm
     from gc import collect
@@ -250,8 +250,8 @@ def source_specific_nucleotide_mappings() -> TableChunk:
 
     def iterate_known_muts_sources():
         for value in tqdm(bdb.values(), total=len(bdb.db)):
-            for item in map(decode_csv, value):
-                sources = mutations.get(str(item['protein_id']) + item['alt'] + str(item['pos']))
+            for item in map(decode_record, value):
+                sources = mutations.get(str(item.protein_id) + item.alt + str(item.pos))
                 if sources:
                     yield sources
 
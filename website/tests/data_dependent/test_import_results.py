@@ -1,6 +1,6 @@
 """"This tests should be passed after successful data import and fail before"""
 from database import bdb
-from genomic_mappings import make_snv_key, decode_csv
+from genomic_mappings import make_snv_key, decode_record
 import app  # this will take some time (stats initialization)
 from models import Protein
 
@@ -33,7 +33,7 @@ def test_mappings():
         snv = make_snv_key(*genomic_data)
 
         items = [
-            decode_csv(item)
+            decode_record(item)
             for item in bdb[snv]
         ]
 
@@ -41,10 +41,10 @@ def test_mappings():
 
         for item in items:
             retrieved_data = (
-                Protein.query.get(item['protein_id']).gene.name,
-                item['pos'],
-                item['ref'],
-                item['alt']
+                Protein.query.get(item.protein_id).gene.name,
+                item.pos,
+                item.ref,
+                item.alt
             )
             if retrieved_data == protein_data:
                 break
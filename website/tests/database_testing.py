@@ -43,6 +43,9 @@ class DatabaseTest(TestCase):
     USE_LEVENSTHEIN_MYSQL_UDF = False
     CONTACT_LIST = ['dummy.maintainer@domain.org']
     SCHEDULER_ENABLED = True
+    RESPONSE_CACHE_ENABLED = False
+    SEARCH_INDEX_ENABLED = False
+    TABLE_COUNT_CACHE_TTL = 0
 
     SECRET_KEY = 'test_key'
     PREFERRED_URL_SCHEME = 'http'
@@ -1,5 +1,5 @@
 from helpers.cache import cache_decorator
-from helpers.cache import Cache
+from helpers.cache import Cache, MemoryCache, TieredCache
 
 
 def test_cache(tmpdir):
@@ -70,3 +70,40 @@ def test_cache(tmpdir):
     assert calc() == 25
     assert calc(a=1) == 5
     assert calc(a=2) == 1
+
+
+def test_memory_cache():
+
+    cache = MemoryCache(size_limit=10)
+
+    assert cache.set('a', b'aaaa', 4)
+    assert cache.set('b', b'bbbb', 4)
+
+    # refresh 'a' so that 'b' becomes the least recently used
+    assert cache.get('a') == b'aaaa'
+
+    assert cache.set('c', b'cccc', 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+    assert cache.volume == 8
+
+    # values exceeding the budget are not stored at all
+    assert not cache.set('d', b'd' * 11, 11)
+    assert len(cache) == 2
+
+
+def test_tiered_cache(tmpdir):
+
+    cache = TieredCache(tmpdir, memory_limit=10, disk_limit=2 ** 20)
+
+    cache.set('a', b'aaaaaaaa')
+    cache.set('b', b'bbbbbbbb')
+
+    # evicted from memory, but still available on disk
+    assert cache.memory.get('a') is None
+    assert cache.get('a') == b'aaaaaaaa'
+    assert cache.memory.get('a') == b'aaaaaaaa'
+
+    cache.clear()
+    assert cache.get('b') is None
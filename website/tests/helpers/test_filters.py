@@ -235,3 +235,61 @@ def test_update_request():
 
         assert manager.get_value('Model.shape') == 'rectangle:or:circle'
         assert manager.url_string() == 'Model.shape:eq:rectangle:or:circle'
+
+
+def test_filter_plans():
+    from sqlalchemy import column
+    from helpers.filters.manager import FilterManager
+
+    class Pair:
+        def __init__(self, value, other):
+            self.value = value
+            self.other = other
+
+    def create_manager(value, other=None):
+        manager = FilterManager([
+            filters.Filter(
+                Pair, 'value', comparators=['eq'],
+                as_sqlalchemy=lambda value: column('value') == value
+            ),
+            filters.Filter(Pair, 'other', comparators=['eq'])
+        ])
+        manager.filters['Pair.value'].update(value)
+        manager.filters['Pair.other'].update(other)
+        return manager
+
+    # managers in the same state share the plan
+    plan = create_manager(1).plan(Pair)
+    assert create_manager(1).plan(Pair) is plan
+    assert create_manager(2).plan(Pair) is not plan
+
+    assert plan.manual_filters_ids == []
+    assert str(plan.clause) == 'value = :value_1'
+
+    manager = create_manager(1, other='x')
+    sql_filters, manual_filters, joins = manager.prepare_filters(Pair)
+    assert len(sql_filters) == 1
+    assert manual_filters == [manager.filters['Pair.other']]
+
+    # manual filters are tested in a single pass
+    pairs = [Pair(1, 'x'), Pair(1, 'y'), Pair(2, 'x')]
+    assert manager.apply(pairs) == [pairs[0]]
+
+    # callbacks capturing objects (rather than values) are not cached
+    bounds = [1]
+
+    def create_capturing_manager(value):
+        manager = FilterManager([
+            filters.Filter(
+                Pair, 'value', comparators=['eq'],
+                as_sqlalchemy=lambda value: column('value').between(value, value + bounds[0])
+            )
+        ])
+        manager.filters['Pair.value'].update(value)
+        return manager
+
+    plan = create_capturing_manager(1).plan(Pair)
+    bounds[0] = 2
+    other_plan = create_capturing_manager(1).plan(Pair)
+    assert other_plan is not plan
+    assert other_plan.query_filters[0].right.clauses[1].value == 3
@@ -68,3 +68,44 @@ def test_tsv_file_iterator(tmpdir):
     assert ['4'] == test(skip=3)
     assert ['3', '4'] == test(skip=2, limit=2)
     assert ['3'] == test(skip=2, limit=1)
+
+
+def test_chunk_index(tmpdir):
+    lines = ['gene\tmut', 'TP53\tR175H', 'Ąę\tx', 'KRAS\tG12D', 'BRAF\tV600E']
+    temp_file = tmpdir.join('some_tsv_file.tsv')
+    temp_file.write_text('\n'.join(lines), encoding='utf-8')
+    file_name = str(temp_file)
+
+    index = parsers.load_chunk_index(file_name, chunk_size=2)
+    assert index.lines_count == 5
+    assert len(index.offsets) == 3
+
+    def chunk(i):
+        return list(parsers.tsv_chunk_iterator(file_name, index.offsets[i], limit=2))
+
+    # offsets are in bytes, also for multi-byte characters
+    assert chunk(1) == [['Ąę', 'x'], ['KRAS', 'G12D']]
+    assert chunk(2) == [['BRAF', 'V600E']]
+
+    # the index is cached next to the file
+    assert tmpdir.join('some_tsv_file.tsv.chunks').exists()
+    assert parsers.load_chunk_index(file_name, chunk_size=2) == index
+
+    # and rebuilt when the file or the chunk size changes
+    assert parsers.load_chunk_index(file_name, chunk_size=3).offsets == [0, index.offsets[1] + len('Ąę\tx\n'.encode())]
+    temp_file.write_text('\n'.join(lines[:2]), encoding='utf-8')
+    assert parsers.load_chunk_index(file_name, chunk_size=2) == (2, [0])
+
+
+def test_uploaded_text_file():
+    import gzip
+    from io import BytesIO
+
+    content = b'##header\n20\t14370\n20\t17330\n'
+
+    for data in [content, gzip.compress(content)]:
+        uploaded = parsers.UploadedTextFile(BytesIO(data))
+        assert uploaded.fraction_read() == 0
+        assert list(uploaded) == ['##header\n', '20\t14370\n', '20\t17330\n']
+        assert uploaded.lines_read == 3
+        assert uploaded.fraction_read() == 1
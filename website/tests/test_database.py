@@ -1,3 +1,5 @@
+from pytest import raises
+
 import genomic_mappings
 from database import db
 from database.migrate import basic_auto_migrate_relational_db, mysql_extract_definitions, mysql_columns_to_update
@@ -16,6 +18,22 @@ def test_make_snv_key():
         result_2 = genomic_mappings.make_snv_key(*equivalent_attributes)
         assert result_1 == result_2
 
+    # keys should sort in the genomic order
+    snvs = [('1', 9, 'A', 'C'), ('1', 10, 'A', 'C'), ('1', 256, 'A', 'C'), ('2', 1, 'G', 'T'), ('X', 5, 'T', 'G')]
+    keys = [genomic_mappings.make_snv_key(*snv) for snv in snvs]
+    assert sorted(keys) == keys
+
+    for snv, key in zip(snvs, keys):
+        assert genomic_mappings.decode_snv_key(key) == snv
+
+    # legacy, text keys can be converted
+    legacy_key = b'X:7dct' + b'g'
+    assert genomic_mappings.decode_legacy_snv_key(legacy_key) == ('X', 2012, 'T', 'G')
+
+    for invalid_snv in [('chr1', 10, 'A', 'C'), ('1', 'x', 'A', 'C'), ('1', -1, 'A', 'C')]:
+        with raises(ValueError):
+            genomic_mappings.make_snv_key(*invalid_snv)
+
 
 def test_encode_csv():
     test_data = (
@@ -39,6 +57,22 @@ def test_decode_csv():
         assert result == dict(zip(keys, correct_result))
 
 
+def test_encode_decode_record():
+    test_data = (
+        # strand, ref, alt, cdna_pos, exon, protein_id, is_ptm
+        (('+', 'R', 'H', 204, 'exon1', 123, False), ('+', 'R', 'H', 68, 204, 1, 123, False)),
+        (('-', 'R', '*', 204, '12', 2 ** 31, True), ('-', 'R', '*', 68, 204, 12, 2 ** 31, True)),
+    )
+    for attributes, correct_result in test_data:
+        record = genomic_mappings.encode_record(*attributes)
+        assert len(record) == genomic_mappings.record_struct.size
+        assert genomic_mappings.decode_record(record) == correct_result
+
+    # conversion from the legacy text format
+    record = genomic_mappings.record_from_csv('-RH1cc:exon1:7b')
+    assert genomic_mappings.decode_record(record) == ('-', 'R', 'H', 68, 204, 1, 123, True)
+
+
 MYSQL_DISEASE = """\
 CREATE TABLE `disease` (
   `name` varchar(255) NOT NULL,
@@ -121,3 +155,62 @@ class TestTypes(DatabaseTest):
     def test_migrate(self):
         for bind in self.SQLALCHEMY_BINDS.keys():
             basic_auto_migrate_relational_db(self.app, bind)
+
+
+class TestBulkInsert(DatabaseTest):
+
+    def test_bulk_insert(self):
+        from database.bulk import bulk_insert, bulk_writers, ExecuteManyWriter, LoadDataWriter
+        from models import Protein, Mutation, Disease
+
+        protein = Protein(refseq='NM_0001', sequence='MAR')
+        db.session.add(protein)
+        # pending objects are flushed before the rows are written
+        bulk_insert(
+            Mutation,
+            ('position', 'protein_id', 'alt', 'precomputed_is_ptm'),
+            ((position, protein.id, 'V', position == 1) for position in range(1, 4))
+        )
+        bulk_insert(Disease, ('name',), [('Cystic\tfibrosis',), ('Cataract',)])
+
+        mutations = Mutation.query.order_by(Mutation.position).all()
+        assert [(m.position, m.alt, m.precomputed_is_ptm) for m in mutations] == [
+            (1, 'V', True), (2, 'V', False), (3, 'V', False)
+        ]
+        assert {d.name for d in Disease.query} == {'Cystic\tfibrosis', 'Cataract'}
+
+        # rows are written in the transaction of the session
+        db.session.rollback()
+        assert not Mutation.query.count()
+
+        connection = db.session.connection()
+        columns = [Disease.__table__.c.name]
+        assert not LoadDataWriter().supports(connection, columns)
+        assert isinstance(bulk_writers[-1], ExecuteManyWriter)
+
+        writer = LoadDataWriter()
+        assert writer.format(None) == '\\N'
+        assert writer.format(False) == '0'
+        assert writer.format('a\tb\\c\nd') == 'a\\tb\\\\c\\nd'
+
+    def test_writer_choice(self):
+        from types import SimpleNamespace
+        from sqlalchemy import inspect
+        from database.bulk import choose_writer, ExecuteManyWriter, LoadDataWriter
+        from imports.mutations.mutation_importer.base_importer import BaseMutationsImporter
+        from models import Mutation
+
+        mysql = SimpleNamespace(dialect=SimpleNamespace(name='mysql'))
+        mapper = inspect(Mutation)
+
+        def columns(keys):
+            return [mapper.column_attrs[key].columns[0] for key in keys]
+
+        # all columns with Python-side defaults are given by the importer
+        assert isinstance(choose_writer(mysql, columns(BaseMutationsImporter.insert_columns)), LoadDataWriter)
+
+        # the default of sources_mask would not be applied by LOAD DATA
+        assert isinstance(choose_writer(mysql, columns(('id', 'position', 'protein_id', 'alt'))), ExecuteManyWriter)
+
+        connection = db.session.connection()
+        assert isinstance(choose_writer(connection, columns(BaseMutationsImporter.insert_columns)), ExecuteManyWriter)
@@ -0,0 +1,103 @@
+from database_testing import DatabaseTest
+from database import db, bdb
+from genomic_mappings import make_snv_key, encode_csv, cdna_pos_from_aa, GenomicMappings, encode_record
+from models import Protein, Mutation
+
+
+def test_iter_region(tmpdir):
+    mappings = GenomicMappings(tmpdir)
+    record = encode_record('+', 'R', 'H', 204, 'EX1', 1, False)
+
+    for chrom, pos in [('1', 99), ('1', 100), ('1', 150), ('1', 200), ('1', 201), ('2', 150)]:
+        mappings.add(make_snv_key(chrom, pos, 'G', 'A'), record)
+
+    region = list(mappings.iter_region('1', 100, 200))
+    assert [snv for snv, records in region] == [
+        ('1', 100, 'G', 'A'),
+        ('1', 150, 'G', 'A'),
+        ('1', 200, 'G', 'A')
+    ]
+    assert all(records[0].protein_id == 1 for snv, records in region)
+
+    assert not list(mappings.iter_region('3', 0, 2 ** 32 - 1))
+    assert len(list(mappings.iter_region('1', 0, 2 ** 32 - 1))) == 5
+
+
+def test_convert_legacy_keys(tmpdir):
+    mappings = GenomicMappings(tmpdir)
+    legacy_value = bytes(encode_csv('+', 'R', 'H', 204, 'exon1', 123, False), 'utf-8')
+    mappings.db[b'20:384ga'] = legacy_value
+    mappings.db[b'X:7dctg'] = legacy_value
+
+    assert mappings.convert_format(batch_size=1) == 2
+    assert mappings.convert_format() == 0
+
+    assert {snv for snv, records in mappings.items()} == {('20', 900, 'G', 'A'), ('X', 2012, 'T', 'G')}
+    assert list(mappings.iter_region('20', 900, 900))[0][1][0].protein_id == 123
+
+
+class GenomicMappingsTest(DatabaseTest):
+
+    def test_get_genomic_muts_bulk(self):
+        p = Protein(refseq='NM_007', id=7, sequence='XXXXXXXXXXXXV')
+        known = Mutation(protein=p, position=13, alt='V')
+        db.session.add_all([p, known])
+        db.session.commit()
+
+        bdb.add_genomic_mut('20', 14370, 'G', 'A', known, is_ptm=True)
+
+        # mappings to a mutation which is not in the database (yet)
+        novel = encode_record('+', 'X', 'K', cdna_pos_from_aa(5), 'EX1', p.id, False)
+        bdb.add(make_snv_key('20', 17330, 'T', 'A'), novel)
+        # a different nucleotide substitution leading to the same protein mutation
+        bdb.add(make_snv_key('20', 17331, 'T', 'A'), novel)
+
+        snvs = [
+            ('20', '17330', 'T', 'A'),
+            ('1', '100', 'C', 'G'),
+            ('20', '14370', 'G', 'A'),
+            ('20', '17331', 'T', 'A'),
+        ]
+        results = bdb.get_genomic_muts_bulk(snvs)
+
+        assert len(results) == len(snvs)
+        assert results[1] == []
+
+        known_result = results[2][0]
+        assert known_result.mutation is known
+        assert not known_result.is_mutation_novel
+        assert known_result.is_ptm
+
+        novel_result = results[0][0]
+        assert novel_result.is_mutation_novel
+        assert novel_result.mutation.position == 5
+        assert novel_result.mutation.alt == 'K'
+        assert results[3][0].mutation is novel_result.mutation
+
+        # should be consistent with one-by-one lookups
+        for snv, bulk_results in zip(snvs, results):
+            single_results = bdb.get_genomic_muts(*snv)
+            assert [
+                (r.mutation.position, r.mutation.alt) for r in single_results
+            ] == [
+                (r.mutation.position, r.mutation.alt) for r in bulk_results
+            ]
+
+    def test_iterate_known_muts(self):
+        p = Protein(refseq='NM_007', id=7, sequence='XXXXXXXXXXXXV')
+        known = Mutation(protein=p, position=13, alt='V')
+        other = Mutation(protein=p, position=2, alt='V')
+        db.session.add_all([p, known, other])
+        db.session.commit()
+
+        # two genomic mutations leading to the same known mutation
+        bdb.add_genomic_mut('20', 14370, 'G', 'A', known)
+        bdb.add_genomic_mut('20', 14371, 'G', 'A', known)
+        # and one which leads to a mutation which is not in the database
+        bdb.add(make_snv_key('1', 100, 'G', 'A'), encode_record('+', 'X', 'K', cdna_pos_from_aa(5), 'EX1', p.id, False))
+
+        for chunk_size in [1, 2, 10000]:
+            mutations = list(bdb.iterate_known_muts(chunk_size=chunk_size))
+            assert mutations == [known, known]
+
+        assert list(bdb.iterate_known_muts(ids_only=True)) == [known.id, known.id]
@@ -1,4 +1,4 @@
-from hash_set_db import HashSet
+from hash_set_db import HashSet, HashSetWithCache, TextSetFormat, VarintSetFormat
 
 
 def are_the_same(view_one, view_two, cast):
@@ -52,3 +52,103 @@ def test_hash_set(tmpdir):
     # values of bhs return iterator [per key] of iterators [per set item] (!)
     assert are_the_same(bhs.values(), expected_representation.values(), value_as_set)
     assert are_the_same(bhs.items(), expected_representation.items(), item_with_set)
+
+
+def test_writes_within_read_session(tmpdir):
+    bhs = HashSet(tmpdir)
+
+    # updates read the current value, not the snapshot of the session
+    with bhs.reader():
+        bhs.add('k', '1')
+        bhs.add('k', '2')
+    assert bhs['k'] == {'1', '2'}
+
+    # a partially consumed generator does not hold a snapshot for later reads
+    bhs.add('l', '1')
+    items = bhs.items()
+    next(items)
+    bhs.add('k', '3')
+    bhs.add('k', '4')
+    assert bhs['k'] == {'1', '2', '3', '4'}
+
+
+def test_varint_set_format():
+    value_format = VarintSetFormat()
+    numbers = {0, 1, 127, 128, 300, 2 ** 35}
+    packed = value_format.pack(numbers)
+    assert value_format.is_current(packed)
+    assert set(value_format.unpack(packed)) == numbers
+
+    # legacy text values should remain readable
+    assert set(value_format.unpack(b'1|300|128')) == {1, 128, 300}
+    assert not value_format.is_current(b'1|300|128')
+
+
+def test_convert_format(tmpdir):
+    legacy = HashSet(value_format=TextSetFormat())
+    legacy.open(tmpdir)
+    legacy['tp53'] = {'1', '2', '1000'}
+    legacy['brca2'] = {'7'}
+    legacy.close()
+
+    bhs = HashSet(integer_values=True)
+    bhs.open(tmpdir)
+
+    # reading works before the conversion
+    assert bhs['tp53'] == {1, 2, 1000}
+
+    assert bhs.convert_format(batch_size=1) == 2
+    assert bhs.convert_format() == 0
+
+    assert bhs['tp53'] == {1, 2, 1000}
+    assert bhs['brca2'] == {7}
+    assert all(
+        bhs.format.is_current(value)
+        for key, value in bhs.db.items()
+    )
+
+
+def test_sorted_runs(tmpdir):
+    bhs = HashSet(integer_values=True)
+    bhs.open(tmpdir.mkdir('db'))
+
+    runs = [str(tmpdir.join('%d.run' % i)) for i in range(2)]
+    bhs.dump_run(runs[0], {b'b': {1, 2}, b'a': {3}})
+    bhs.dump_run(runs[1], {b'b': {2, 5}, b'c': {4}})
+
+    assert bhs.load_runs(runs, batch_size=2) == 3
+
+    assert bhs['a'] == {3}
+    assert bhs['b'] == {1, 2, 5}
+    assert bhs['c'] == {4}
+
+
+def test_dupsort_layout(tmpdir):
+    bhs = HashSetWithCache(integer_values=True)
+    bhs.open(tmpdir.mkdir('db'), dupsort=True)
+
+    bhs['tp53'] = {1, 300}
+    bhs['tp53'].add(2)
+    bhs.update('brca2', {2 ** 40, 7})
+    bhs.add('brca2', 7)
+
+    assert bhs['tp53'] == {1, 2, 300}
+    assert bhs['brca2'] == {7, 2 ** 40}
+    assert len(bhs) == 2
+
+    with bhs.cached_session():
+        bhs.cached_add_integer('tp53', 5)
+        bhs.cached_add_integer('kras', 12)
+
+    assert {key: set(value) for key, value in bhs.items()} == {
+        'tp53': {1, 2, 5, 300},
+        'brca2': {7, 2 ** 40},
+        'kras': {12}
+    }
+    assert bhs.convert_format() == 0
+
+    run = str(tmpdir.join('0.run'))
+    bhs.dump_run(run, {b'a': {3, 1}, b'b': {2}})
+    bhs.reset()
+    assert bhs.load_runs([run]) == 2
+    assert bhs['a'] == {1, 3}
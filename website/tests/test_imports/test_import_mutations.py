@@ -1,3 +1,6 @@
+from collections import Counter
+from tempfile import TemporaryDirectory
+
 import pytest
 
 from database_testing import DatabaseTest
@@ -8,7 +11,7 @@ from models import (
     Site, SiteType,
     Mutation
 )
-from models import MC3Mutation
+from models import MC3Mutation, Cancer, ClinicalData
 from database import db
 from miscellaneous import make_named_temp_file, make_named_gz_file
 
@@ -194,6 +197,59 @@ class TestImport(DatabaseTest):
         assert sample == 'TCGA-02-0003-01A-01D-1490-08'
         assert count == 3
 
+    def test_mc3_skips_hypermutated_samples(self):
+        from unittest.mock import patch
+        from helpers import parsers
+        from imports.mutations.mc3 import MC3Importer
+
+        muts_filename = make_named_gz_file(with_hypermutated_samples)
+        proteins = create_proteins({
+            # PANX3 R296Q (hypermutated sample)
+            'NM_052959': 'A' * 295 + 'R' + 'A' * 10,
+            # PADI2 G197R
+            'NM_007365': 'A' * 196 + 'G' + 'A' * 10
+        })
+
+        threshold = MC3Importer.hypermutation_threshold
+        MC3Importer.hypermutation_threshold = 2
+        try:
+            with patch.object(parsers, 'fast_gzip_read', wraps=parsers.fast_gzip_read) as gzip_read:
+                self.run_importer('load', 'mc3', proteins, muts_filename)
+        finally:
+            MC3Importer.hypermutation_threshold = threshold
+
+        # the file was decompressed (and read) only once
+        assert gzip_read.call_count == 1
+
+        # mutations of the hypermutated sample were not even created
+        mutation = Mutation.query.one()
+        assert mutation.protein.refseq == 'NM_007365'
+        assert (mutation.position, mutation.alt) == (197, 'R')
+
+        mc3_mutation = MC3Mutation.query.one()
+        assert mc3_mutation.mutation == mutation
+        assert mc3_mutation.samples == 'TCGA-04-1349-01A-01W-0492-08'
+        assert mc3_mutation.cancer.name == 'Ovarian serous cystadenocarcinoma'
+
+    def test_broken_sequences_of_hypermutated_samples(self):
+        from imports.mutations.mc3 import MC3Importer
+
+        muts_filename = make_named_gz_file(with_hypermutated_samples)
+        proteins = create_proteins({
+            # SPI1 P127T (hypermutated sample), mismatched reference residue
+            'NM_001080547': 'A' * 126 + 'C' + 'A' * 10,
+            # PADI2 G197R, mismatched reference residue
+            'NM_007365': 'A' * 196 + 'C' + 'A' * 10
+        })
+
+        importer = MC3Importer(proteins)
+        importer.hypermutation_threshold = 2
+        records = list(importer.skip_hypermutated(importer.iterate_lines(muts_filename)))
+
+        assert records == []
+        # only the mismatch of the sample which was kept is reported
+        assert set(importer.broken_seq) == {'NM_007365'}
+
     def test_clinvar_disease_names(self):
         beutify = ClinVarImporter._beautify_disease_name
         assert beutify('B_Lymphoblastic_Leukemia/Lymphoma_with_t(v%3B11q23.3)%3B_KMT2A_Rearranged') == 'B Lymphoblastic Leukemia/Lymphoma with t(v;11q23.3); KMT2A Rearranged'
@@ -540,6 +596,160 @@ class TestImport(DatabaseTest):
         duplicated = add_if_not_duplicate(2, ['motif_gain', 22])
         assert not duplicated
 
+    def test_mutation_key_index(self):
+        from sqlalchemy import event
+        from imports.mutations.mutation_importer.base_importer import BaseMutationsImporter, MutationKeyIndex
+
+        proteins = create_proteins({'NM_01': 'MAR' * 10, 'NM_02': 'MKV' * 10})
+        known = [
+            Mutation(protein=proteins['NM_01'], position=2, alt='V'),
+            Mutation(protein=proteins['NM_02'], position=3, alt='*'),
+            Mutation(protein=proteins['NM_02'], position=2, alt='x')
+        ]
+        db.session.add_all(known)
+        db.session.commit()
+        p1, p2 = proteins['NM_01'].id, proteins['NM_02'].id
+        known_ids = [mutation.id for mutation in known]
+
+        queries = []
+
+        def count_query(*args):
+            queries.append(args)
+
+        index = MutationKeyIndex()
+        engine = db.get_engine(self.app, 'bio')
+        event.listen(engine, 'before_cursor_execute', count_query)
+        try:
+            assert index.get(2, p1, 'V') == known_ids[0]
+            assert index.get(3, p2, '*') == known_ids[1]
+            # unusual residues are handled too
+            assert index.get(2, p2, 'x') == known_ids[2]
+            assert index.get(2, p2, 'V') is None
+            assert index.get(2, p1, 'W') is None
+            # the keys were loaded with a single query
+            assert len(queries) == 1
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_query)
+
+        # mutations inserted by one importer are known to the next one
+        first = BaseMutationsImporter(index)
+        first.prepare()
+        new_id = first.get_or_make_mutation(5, p1, 'K', False)
+        assert first.get_or_make_mutation(2, p1, 'V', False) == known_ids[0]
+        first.insert()
+
+        second = BaseMutationsImporter(index)
+        second.prepare()
+        assert second.get_or_make_mutation(5, p1, 'K', False) == new_id
+        assert not second.mutations
+
+
+# the databases are stored in files so that these can be shared with worker processes
+parallel_import_databases = TemporaryDirectory(prefix='parallel_import')
+
+
+class TestParallelImport(DatabaseTest):
+
+    SQLALCHEMY_BINDS = {
+        'cms': f'sqlite:///{parallel_import_databases.name}/cms.db',
+        'bio': f'sqlite:///{parallel_import_databases.name}/bio.db'
+    }
+
+    def test_parallel_load(self):
+        from imports.mutations.mimp import MIMPImporter
+        from imports.mutations.parallel import PROVISIONAL_ID_STEP, replace_ids, uses_memory_database
+
+        assert replace_ids(
+            {PROVISIONAL_ID_STEP + 1: [(PROVISIONAL_ID_STEP + 1, 5)], 7: {PROVISIONAL_ID_STEP * 2}},
+            {PROVISIONAL_ID_STEP + 1: 3, PROVISIONAL_ID_STEP * 2: 4}
+        ) == {3: [(3, 5)], 7: {4}}
+
+        assert not uses_memory_database()
+
+        proteins = create_proteins({
+            **tp53, **idi2,
+            # PANX3 R296Q and SPI1 P126T from MC3
+            'NM_052959': 'A' * 295 + 'R' + 'A' * 10,
+            'NM_003120': 'A' * 125 + 'P' + 'A' * 10
+        })
+        phosphorylation = SiteType(name='phosphorylation')
+        db.session.add_all([
+            Site(protein=proteins['NM_000546'], position=site_pos, types={phosphorylation})
+            for site_pos in [20, 215, 315, 106]
+        ])
+        db.session.commit()
+
+        # MC3 is parsed (in a single worker) together with the MIMP chunks (see below),
+        # these are still inserted in this order, after the other sources in between
+        sources = ['mc3', 'esp6500', 'thousand_genomes', 'mimp']
+        paths = {
+            'esp6500': make_named_gz_file(esp_mutations),
+            'thousand_genomes': make_named_gz_file(thousand_genomes_mutations),
+            'mc3': make_named_gz_file(mc3_mutations),
+            'mimp': make_named_temp_file(data=mimp_mutations)
+        }
+        details_models = [MC3Mutation, ExomeSequencingMutation, The1000GenomesMutation, MIMPMutation]
+
+        def imported_mutations():
+            return {
+                (mutation.protein.refseq, mutation.position, mutation.alt): mutation.id
+                for mutation in Mutation.query
+            }
+
+        def imported_details():
+            return {
+                (model.__name__, details.mutation_id)
+                for model in details_models
+                for details in model.query
+            }
+
+        chunk_size = MIMPImporter.chunk_size
+        # three chunks, parsed in a group with MC3
+        MIMPImporter.chunk_size = 2
+        MIMPImporter.parallel_group = 'cancers'
+        try:
+            muts_import_manager.perform('load', proteins, sources, paths)
+            sequential_mutations = imported_mutations()
+            sequential_details = imported_details()
+
+            for model in [*details_models, Mutation]:
+                model.query.delete()
+            db.session.commit()
+
+            muts_import_manager.perform('load', proteins, sources, paths, processes=3)
+        finally:
+            MIMPImporter.chunk_size = chunk_size
+            MIMPImporter.parallel_group = None
+
+        # the identifiers are assigned in the same, deterministic order
+        assert imported_mutations() == sequential_mutations
+        assert imported_details() == sequential_details
+
+        sources_counts = Counter(model_name for model_name, mutation_id in sequential_details)
+        assert sources_counts == {
+            'ExomeSequencingMutation': 2, 'The1000GenomesMutation': 2,
+            'MC3Mutation': 2, 'MIMPMutation': 4
+        }
+        assert all(mutation_id < PROVISIONAL_ID_STEP for mutation_id in sequential_mutations.values())
+        # cancers created by the worker are re-used rather than duplicated
+        assert Cancer.query.count() == 1
+
+    def test_parallel_clinvar(self):
+        muts_filename = make_named_gz_file(clinvar_mutations)
+        proteins = create_proteins({**tp53, **lama4, **msh2})
+
+        muts_import_manager.perform(
+            'load', proteins, ['clinvar'], {'clinvar': muts_filename},
+            clinvar_xml_path='tests/test_imports/clinvar_subset.xml',
+            processes=2
+        )
+
+        # the same as in the sequential import (see test_clinvar_import)
+        assert Disease.query.count() == 3
+        assert Mutation.query.filter_by(protein=proteins['NM_000546']).count() == 5
+        assert InheritedMutation.query.count() == 3
+        assert ClinicalData.query.count() > 0
+
 
 tss_cancer_map_text = """\
 A1	Breast invasive carcinoma
@@ -2,7 +2,7 @@ from os import path
 
 import pytest
 
-from imports.mappings import import_genome_proteome_mappings, import_aminoacid_mutation_refseq_mappings
+from imports.mappings import import_genome_proteome_mappings, import_aminoacid_mutation_refseq_mappings, import_mappings
 from database_testing import DatabaseTest
 from models import Protein
 from models import Gene
@@ -78,6 +78,27 @@ class TestImport(DatabaseTest):
         assert set(broken_sequences.keys()) == {'NM_002749'}
         assert [('NM_002749', 'L', 'A', '5', 'Q')] in list(broken_sequences.values())
 
+    @pytest.mark.serial
+    def test_genome_proteome_mappings_sharded(self):
+
+        mappings_filename, gene, proteins = create_test_data()
+
+        broken_sequences = import_genome_proteome_mappings(
+            proteins,
+            path.dirname(mappings_filename),
+            path.basename(mappings_filename),
+            processes=2
+        )
+
+        bdb.reload()
+
+        assert not bdb[make_snv_key('1', 19282216, 'G', 'A')]
+        assert len(bdb[make_snv_key('17', 19282216, 'G', 'A')]) == 3
+        assert len(bdb) == 9
+
+        assert set(broken_sequences.keys()) == {'NM_002749'}
+        assert [('NM_002749', 'L', 'A', '5', 'Q')] in list(broken_sequences.values())
+
     @pytest.mark.serial
     def test_gene_mutation_mappings(self):
 
@@ -95,3 +116,23 @@ class TestImport(DatabaseTest):
         assert bdb_refseq['MAPK7 M1K'] == set(protein.id for protein in proteins.values())
         retrieved_proteins = {Protein.query.get(protein_id) for protein_id in bdb_refseq['MAPK7 M1K']}
         assert retrieved_proteins == set(proteins.values())
+
+    @pytest.mark.serial
+    def test_combined_mappings(self):
+
+        mappings_filename, gene, proteins = create_test_data()
+
+        for processes in [1, 2]:
+            broken_sequences = import_mappings(
+                proteins,
+                path.dirname(mappings_filename),
+                path.basename(mappings_filename),
+                processes=processes
+            )
+
+            bdb.reload()
+            bdb_refseq.reload()
+
+            assert len(bdb[make_snv_key('17', 19282216, 'G', 'A')]) == 3
+            assert bdb_refseq['MAPK7 M1K'] == set(protein.id for protein in proteins.values())
+            assert set(broken_sequences.keys()) == {'NM_002749'}
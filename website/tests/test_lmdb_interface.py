@@ -22,3 +22,57 @@ def test_basic_interface(tmpdir):
 
     assert b'x' in db
     assert b'z' not in db
+
+
+def test_reader(tmpdir):
+    db = LightningInterface(tmpdir)
+    for key in [b'1:a', b'1:b', b'2:a', b'10:a']:
+        db[key] = key.upper()
+
+    with db.reader() as reader:
+        assert reader.get_many([b'1:a', b'3:a', b'2:a']) == [b'1:A', None, b'2:A']
+
+        # nested sessions and plain reads should reuse the same transaction
+        with db.reader() as nested_reader:
+            assert nested_reader is reader
+        assert db.get(b'1:b') == b'1:B'
+        assert b'10:a' in db
+
+        assert [k for k, v in reader.iterate_prefix(b'1:')] == [b'1:a', b'1:b']
+        # keys are sorted lexicographically
+        assert [k for k, v in reader.iterate_range(b'1', b'2:a')] == [b'10:a', b'1:a', b'1:b']
+        assert [k for k, v in reader.iterate_range(b'3')] == []
+
+    assert len(db) == 4
+
+    # iteration outside of a session uses its own transaction
+    items = db.items()
+    next(items)
+    db[b'1:a'] = b'new'
+    assert db[b'1:a'] == b'new'
+
+
+def test_reopen_after_fork(tmpdir):
+    db = LightningInterface(tmpdir)
+    db[b'x'] = b'2'
+    env = db.env
+
+    # pretend that we are in a forked child process
+    db._pid = -1
+
+    assert db[b'x'] == b'2'
+    assert db.env is not env
+
+
+def test_dupsort(tmpdir):
+    db = LightningInterface(tmpdir, dupsort=True)
+    db.add_many([(b'x', b'2'), (b'x', b'1'), (b'y', b'3')])
+    db.add_many([(b'x', b'3'), (b'x', b'1')])
+
+    assert db[b'x'] == [b'1', b'2', b'3']
+    assert db.get(b'z') is None
+    assert len(db) == 2
+
+    db[b'y'] = [b'5', b'4']
+    assert dict(db.items()) == {b'x': [b'1', b'2', b'3'], b'y': [b'4', b'5']}
+    assert list(db.iterate_range(b'y')) == [(b'y', [b'4', b'5'])]
@@ -6,7 +6,7 @@ from flask import current_app
 
 import manage
 from database import db
-from models import User, Gene, Cancer, Page
+from models import User, Gene, Cancer, Page, Protein, Mutation, MC3Mutation, ProteinSummary
 from miscellaneous import make_named_temp_file, use_fixture
 
 
@@ -176,6 +176,22 @@ class ManageTest(DatabaseTest):
 
             assert len(Cancer.query.all()) == 0
 
+    def test_summaries_refresh(self):
+        with current_app.app_context():
+            mutation = Mutation(position=1, alt='A')
+            MC3Mutation(mutation=mutation)
+            protein = Protein(refseq='NM_0001', sequence='MA', mutations=[mutation])
+            db.session.add(Gene(name='test_gene', isoforms=[protein], preferred_isoform=protein))
+            db.session.commit()
+
+            msg, error = self.run_command('calc_summaries')
+            assert 'Created 2 protein summaries' in msg
+            assert ProteinSummary.query.count() == 2
+
+            # summaries are recalculated after mutations are removed
+            self.run_command('remove protein_related --models MC3Mutation Mutation')
+            assert ProteinSummary.query.count() == 0
+
     def test_drop_all(self):
         with current_app.app_context():
             example_models = [Gene, Cancer, Page]
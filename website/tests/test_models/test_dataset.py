@@ -82,3 +82,114 @@ class DatasetTest(ModelTest):
 
         assert dataset.is_expired
         assert dataset.data is None
+
+    def test_columnar_storage(self):
+        import pickle
+        from sqlalchemy import event
+        from database import bdb_refseq
+        from models import Gene, Mutation, Protein
+        from search.dataset import StoredSearch
+        from search.mutation import MutationSearch
+
+        proteins = [
+            Protein(refseq=f'NM_00{i}', sequence='A' * 50, gene=Gene(name=f'G{i}'))
+            for i in range(4)
+        ]
+        known = Mutation(protein=proteins[0], position=2, alt='V')
+        db.session.add_all([*proteins, known])
+        db.session.commit()
+
+        for i, protein in enumerate(proteins):
+            for position in range(1, 4):
+                bdb_refseq[f'G{i} A{position}V'] = [protein.id]
+
+        lines = [f'G{i} A{position}V' for i in range(4) for position in range(1, 4)]
+        # the first line is repeated (counted twice)
+        search = MutationSearch(text_query='\n'.join(lines + lines[:1]))
+        legacy_data = pickle.dumps(search, protocol=4)
+        known_id = known.id
+
+        engine = db.get_engine(self.app, 'bio')
+        queries = []
+
+        def count_query(*args):
+            queries.append(args)
+
+        page_size = StoredSearch.page_size
+        StoredSearch.page_size = 5
+        try:
+            dataset = UsersMutationsDataset(name='test', data=search)
+            db.session.add(dataset)
+            db.session.commit()
+
+            uri = dataset.uri
+            db.session.expunge_all()
+
+            dataset = UsersMutationsDataset.by_uri(uri)
+            stored = dataset.stored
+
+            assert stored.pages_count == 3
+            assert stored.lines_count == 12 == stored.results_count
+            assert dataset.mutations_count == 12
+
+            protein = Protein.query.filter_by(refseq='NM_000').one()
+
+            # only the page holding the mutation is read
+            read_pages = []
+            read_columns = stored.columns
+            stored.columns = lambda page: read_pages.append(page) or read_columns(page)
+            assert stored.mutations_index['NM_003', 3, 'V'] == (2, 1)
+
+            event.listen(engine, 'before_cursor_execute', count_query)
+            try:
+                # lookups in columns do not require rehydration
+                details = dataset.get_mutation_details(protein, 1, 'V')
+                assert details.count == 2 and details.query == lines[0]
+                assert not queries
+                assert read_pages == [0]
+                assert dataset.get_mutation_details(protein, 4, 'V') is None
+                assert read_pages == [0]
+
+                first_page = stored.page(0)
+                queries_per_page = len(queries)
+                assert list(first_page) == lines[:5]
+
+                queries.clear()
+                assert list(stored.page(2)) == lines[10:]
+                assert stored.page(3) == {}
+                assert len(queries) == queries_per_page
+            finally:
+                event.remove(engine, 'before_cursor_execute', count_query)
+
+            results = first_page[lines[1]]
+            assert len(results) == 1
+            result = results[0]
+            assert result.protein.refseq == 'NM_000'
+            assert result.mutation.id == known_id
+            assert result.mutation.meta_user is result.meta_user
+            assert result.pos == 2 and result.ref == 'A' and result.type == 'proteomic'
+
+            # identifiers are resolved without rehydration
+            mutation_ids = dataset.mutation_ids
+            assert len(set(mutation_ids)) == 12 and known_id in mutation_ids
+
+            # read-only: mutations missing from the database are not created
+            Mutation.query.filter(Mutation.id != known_id).delete()
+            db.session.commit()
+            assert dataset.mutation_ids == [known_id]
+            assert Mutation.query.count() == 1
+
+            # all results can be rehydrated at once
+            assert len(dataset.mutations) == 12
+            assert dataset.data.results_by_refseq['NM_003'][3, 'V'].meta_user.query == lines[-1]
+
+            # legacy, pickled datasets are converted on the first read
+            with open(dataset._path, 'wb') as f:
+                f.write(legacy_data)
+            db.session.expunge_all()
+
+            dataset = UsersMutationsDataset.by_uri(uri)
+            assert dataset.stored.lines_count == 12
+            assert StoredSearch.is_columnar(dataset._path)
+        finally:
+            StoredSearch.page_size = page_size
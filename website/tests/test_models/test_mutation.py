@@ -1,6 +1,8 @@
+from sqlalchemy import or_
+
 from database import db
 from .model_testing import ModelTest
-from models import Mutation
+from models import Mutation, MC3Mutation, InheritedMutation, The1000GenomesMutation, source_manager
 from models import Protein
 from models import Site
 
@@ -109,3 +111,61 @@ class MutationTest(ModelTest):
         for mutation, expected_sites_cnt in expected_affected_sites.items():
             sites_found = mutation.get_affected_ptm_sites()
             assert len(sites_found) == expected_sites_cnt
+
+    def test_sources_mask(self):
+        mc3 = Mutation(position=1, meta_MC3=[MC3Mutation()])
+        clinvar = Mutation(position=2)
+        clinvar.meta_ClinVar = InheritedMutation()
+        both = Mutation(position=3, meta_MC3=[MC3Mutation()], meta_ClinVar=InheritedMutation())
+        population = Mutation(position=4)
+        The1000GenomesMutation(mutation=population)
+        novel = Mutation(position=5)
+
+        db.session.add(Protein(refseq='NM_00003', mutations=[mc3, clinvar, both, population, novel]))
+        db.session.commit()
+
+        assert mc3.sources_mask == source_manager.bits[MC3Mutation]
+        assert both.sources_mask == source_manager.mask([MC3Mutation, InheritedMutation])
+        assert not novel.sources_mask
+
+        def query_ids(*criteria):
+            return {m.position for m in Mutation.query.filter(*criteria)}
+
+        assert query_ids(Mutation.in_sources(MC3Mutation)) == {1, 3}
+        assert query_ids(Mutation.in_sources(MC3Mutation, InheritedMutation)) == {3}
+        assert query_ids(Mutation.in_sources(MC3Mutation, InheritedMutation, conjunction=or_)) == {1, 2, 3}
+        assert query_ids(Mutation.is_confirmed) == {1, 2, 3, 4}
+        assert query_ids(~Mutation.is_confirmed) == {5}
+
+        # the same is read from the masks on the Python side
+        assert both.sources == ['MC3', 'ClinVar'] and both.is_confirmed
+        assert novel.sources == [] and not novel.is_confirmed
+        masked = Mutation(sources_mask=source_manager.bits[InheritedMutation])
+        assert masked.sources == ['ClinVar'] and masked.is_confirmed
+
+        # the bit is cleared when the last details of the source are removed
+        mc3_bit = source_manager.bits[MC3Mutation]
+        other_details = MC3Mutation()
+        both.meta_MC3.append(other_details)
+        both.meta_MC3.remove(both.meta_MC3[0])
+        assert both.sources_mask & mc3_bit
+        both.meta_MC3.remove(other_details)
+        assert not both.sources_mask & mc3_bit
+        db.session.commit()
+        assert query_ids(Mutation.in_sources(MC3Mutation)) == {1}
+
+        # masks can be rebuilt after changes done with raw SQL
+        MC3Mutation.query.delete()
+        Mutation.query.update({Mutation.sources_mask: None})
+        for source in source_manager.bits:
+            Mutation.update_sources_mask(source)
+        db.session.commit()
+
+        assert query_ids(Mutation.in_sources(MC3Mutation)) == set()
+        assert query_ids(Mutation.in_sources(InheritedMutation)) == {2, 3}
+        assert query_ids(Mutation.is_confirmed) == {2, 3, 4}
+
+        # updates can be limited to given mutations
+        Mutation.query.update({Mutation.sources_mask: 0})
+        assert Mutation.update_sources_mask(InheritedMutation, mutation_ids=[clinvar.id]) == 1
+        assert query_ids(Mutation.in_sources(InheritedMutation)) == {2}
@@ -1,6 +1,6 @@
 from database import db
 from .model_testing import ModelTest
-from models import Protein, Site, Gene, Mutation, KinaseGroup, Kinase
+from models import Protein, Site, Gene, Mutation, KinaseGroup, Kinase, SiteIndex, SiteType
 
 
 class ProteinTest(ModelTest):
@@ -34,6 +34,52 @@ class ProteinTest(ModelTest):
             result = protein.would_affect_any_sites(mutation_position)
             assert result == expected_result
 
+    def test_site_index(self):
+        phosphorylation = SiteType(name='phosphorylation')
+        sites = [
+            Site(position=57, types={phosphorylation}),
+            Site(position=10),
+            Site(position=14, types={phosphorylation}),
+            Site(position=15)
+        ]
+        protein = Protein(sites=sites)
+        db.session.add(protein)
+
+        index = protein.site_index
+        assert list(index.positions) == [10, 14, 15, 57]
+        assert protein.site_index is index
+
+        positions = [0, 5, 10, 12, 17, 22, 57]
+        assert list(index.ptm_impact(positions)) == [
+            'none', 'distal', 'direct', 'proximal', 'proximal', 'distal', 'direct'
+        ]
+        assert list(index.is_ptm_direct(positions, site_types={'phosphorylation'})) == [
+            False, False, False, False, False, False, True
+        ]
+        assert [site.position for site in index.affected_sites(12)] == [10, 14, 15]
+        # two sites equally distant
+        assert [site.position for site in index.closest_sites(12)] == [10, 14]
+        assert [site.position for site in index.closest_sites(13)] == [14]
+        assert not index.closest_sites(30)
+
+        # the index should follow changes of sites
+        protein.sites.append(Site(position=30))
+        assert protein.site_index.closest_sites(30)[0].position == 30
+
+        protein.sites.remove(sites[0])
+        assert 57 not in protein.site_index.positions
+
+        protein.sites = sites[1:3]
+        assert list(protein.site_index.positions) == [10, 14]
+
+        index = protein.site_index
+        db.session.commit()
+        assert protein.site_index is not index
+        assert list(protein.site_index.positions) == [10, 14]
+
+        # indices can be created without Site objects too
+        assert list(SiteIndex([15, 10]).is_close([3, 22, 23])) == [True, True, False]
+
     def test_is_preferred_isoform(self):
 
         proteins = [Protein(refseq=f'NM_{i}') for i in range(5)]
@@ -1,5 +1,7 @@
+from types import SimpleNamespace
+
 from view_testing import ViewTest
-from models import Mutation, Cancer, MC3Mutation, ExomeSequencingMutation, SiteType
+from models import Mutation, Cancer, MC3Mutation, ExomeSequencingMutation, SiteType, MIMPMutation, Kinase
 from models import Protein
 from models import Site
 from models import Gene
@@ -91,3 +93,91 @@ class TestChromosomeView(ViewTest):
 
         response = get_a15v('?filters=Mutation.sources:in:ESP6500;Mutation.populations_ESP6500:in:European American')
         assert not response.json
+
+    def test_region(self):
+
+        p = Protein(refseq='NM_007', id=1, sequence='A' * 15, gene=Gene(name='SomeGene'))
+        db.session.add(p)
+
+        from database import bdb
+
+        for aa_pos, dna_pos in {13: 14370, 15: 14376, 14: 14500}.items():
+            bdb.add_genomic_mut('20', dna_pos, 'G', 'A', Mutation(protein=p, position=aa_pos, alt='V'))
+
+        response = self.client.get('/chromosome/region/chr20/14000/14400')
+        assert response.status_code == 200
+
+        # in the genomic order
+        assert [(m['dna_pos'], m['pos']) for m in response.json] == [(14370, 13), (14376, 15)]
+        assert response.json[0]['chrom'] == '20'
+        assert response.json[0]['dna_ref'] == 'G'
+        assert response.json[0]['dna_alt'] == 'A'
+
+        response = self.client.get('/chromosome/region/chr21/14000/14400')
+        assert response.status_code == 200
+        assert response.json == []
+
+        # mappings to mutations which are not in the database are skipped (and not created)
+        mutations_count = Mutation.query.count()
+        novel = SimpleNamespace(protein=p, position=12, ref='A', alt='V')
+        bdb.add_genomic_mut('20', 14380, 'G', 'A', novel)
+
+        response = self.client.get('/chromosome/region/chr20/14000/14400')
+        assert [(m['dna_pos'], m['pos']) for m in response.json] == [(14370, 13), (14376, 15)]
+        assert Mutation.query.count() == mutations_count
+
+        from views.chromosome import ChromosomeView
+        too_long = ChromosomeView.max_region_length
+        for invalid_window in ['chr20/14400/14000', 'chr99/1/10', 'chr20/a/10', f'chr20/1/{too_long + 1}']:
+            response = self.client.get('/chromosome/region/' + invalid_window)
+            assert response.status_code == 400
+
+    def test_region_queries_count(self):
+        from sqlalchemy import event
+        from database import bdb
+
+        cancer = Cancer(name='Breast invasive carcinoma', code='BRCA')
+        kinase = Kinase(name='AKT1')
+
+        def create_protein(i, mutations_count):
+            sites = [
+                Site(position=position, types={SiteType(name=f'type_{i}_{position}')}, kinases={kinase})
+                for position in range(5, 40, 10)
+            ]
+            p = Protein(refseq=f'NM_00{i}', sequence='A' * 50, gene=Gene(name=f'Gene{i}'), sites=sites)
+            db.session.add(p)
+            for j in range(mutations_count):
+                m = Mutation(protein=p, position=j + 1, alt='V')
+                MC3Mutation(mutation=m, cancer=cancer, count=j)
+                MIMPMutation(mutation=m, site=sites[0], probability=0.5, effect='gain', pwm='AKT1')
+                db.session.flush()
+                bdb.add_genomic_mut(str(i), 1000 + j, 'G', 'A', m)
+
+        create_protein(1, 2)
+        create_protein(2, 12)
+        db.session.commit()
+
+        queries = []
+        engine = db.get_engine(self.app, 'bio')
+
+        def count_query(*args):
+            queries.append(args)
+
+        event.listen(engine, 'before_cursor_execute', count_query)
+        try:
+            counts = {}
+            for chrom in ['1', '2']:
+                db.session.expire_all()
+                queries.clear()
+                response = self.client.get(f'/chromosome/region/{chrom}/1000/1100')
+                assert response.status_code == 200
+                counts[chrom] = (len(response.json), len(queries))
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_query)
+
+        assert counts['1'][0] == 2 and counts['2'][0] == 12
+        assert response.json[0]['in_datasets']['MC3'] == {'Cancers': [{'Cancer': 'Breast invasive carcinoma', 'Value': 0}]}
+        assert response.json[0]['in_datasets']['MIMP']['gain'][0]['pwm'] == 'AKT1'
+
+        # the number of queries does not depend on the number of mutations
+        assert counts['1'][1] == counts['2'][1]
@@ -1,5 +1,6 @@
 from view_testing import ViewTest
-from models import Protein, GeneList, TCGAMutation, Mutation, MC3Mutation
+from models import Protein, GeneList, TCGAMutation, Mutation, MC3Mutation, InheritedMutation, Site, SiteType
+from models import ProteinSummary
 from models import Gene
 from database import db
 
@@ -92,3 +93,122 @@ class TestGeneView(ViewTest):
         assert response.status_code == 200
 
         assert response.json['total'] == len(genes)
+
+    def test_browse_pagination(self):
+        from helpers.cache import bump_data_version
+
+        gene_names = ['GeneA', 'GeneB', 'GeneC', 'GeneD', 'GeneE']
+        for i, name in enumerate(gene_names):
+            p = Protein(refseq=f'NM_000{i}')
+            db.session.add(Gene(name=name, isoforms=[p], preferred_isoform=p))
+        db.session.commit()
+
+        def get_page(**args):
+            query = '&'.join(f'{key}={value}' for key, value in args.items())
+            return self.client.get('/gene/browse_data/?sort=name&limit=2&' + query).json
+
+        def names(page):
+            return [row['name'] for row in page['rows']]
+
+        # keyset pagination (follow the cursor)
+        page = get_page()
+        assert names(page) == ['GeneA', 'GeneB']
+        page = get_page(cursor=page['cursor'])
+        assert names(page) == ['GeneC', 'GeneD']
+        # the offset is ignored if a cursor is given
+        page = get_page(cursor=page['cursor'], offset=2)
+        assert names(page) == ['GeneE']
+
+        # yields the same results as the offset-based pagination
+        assert names(get_page(offset=2)) == ['GeneC', 'GeneD']
+
+        page = get_page(order='desc')
+        assert names(get_page(order='desc', cursor=page['cursor'])) == ['GeneC', 'GeneB']
+
+        # cursors created for other ordering, or malformed, are ignored
+        assert names(get_page(cursor=page['cursor'])) == ['GeneA', 'GeneB']
+        assert names(get_page(cursor='not-a-cursor')) == ['GeneA', 'GeneB']
+
+        # memoised totals
+        self.app.config['TABLE_COUNT_CACHE_TTL'] = 60
+        assert get_page()['total'] == 5
+
+        p = Protein(refseq='NM_0005')
+        db.session.add(Gene(name='GeneF', isoforms=[p], preferred_isoform=p))
+        db.session.commit()
+
+        assert get_page()['total'] == 5
+        bump_data_version()
+        assert get_page()['total'] == 6
+
+    def test_keyset_ties(self):
+        from helpers.views import apply_cursor, encode_cursor
+
+        proteins = [
+            Protein(refseq=f'NM_000{i}', sequence=sequence)
+            for i, sequence in enumerate(['MA', 'MA', 'MA', 'MB'])
+        ]
+        db.session.add(Gene(name='GeneA', isoforms=proteins, preferred_isoform=proteins[0]))
+        db.session.commit()
+
+        keyset = (Protein.sequence, Protein.id)
+        query = Protein.query.order_by(Protein.sequence, Protein.id)
+
+        # rows having the same sorted value as the last one are not skipped
+        cursor = encode_cursor('sequence', 'asc', 'MA', proteins[0].id)
+        assert apply_cursor(query, keyset, cursor, 'sequence', 'asc').all() == proteins[1:]
+
+        cursor = encode_cursor('sequence', 'desc', 'MA', proteins[2].id)
+        assert apply_cursor(query, keyset, cursor, 'sequence', 'desc').all() == proteins[:2]
+
+        # proteins listing
+        page = self.client.get('/protein/browse_data/?sort=refseq&limit=3').json
+        page = self.client.get('/protein/browse_data/?sort=refseq&limit=3&cursor=' + page['cursor']).json
+        assert [row['refseq'] for row in page['rows']] == ['NM_0003']
+
+    def test_protein_summaries(self):
+        from views.gene import refresh_protein_summaries
+
+        phosphorylation = SiteType(name='phosphorylation')
+        acetylation = SiteType(name='acetylation')
+
+        for i, name in enumerate(('BRCA1', 'BRCA2', 'TP53')):
+            mutations = [
+                Mutation(position=position, alt='A', precomputed_is_ptm=position < 20)
+                for position in range(5 * i, 30, 7)
+            ]
+            for mutation in mutations[::2]:
+                MC3Mutation(mutation=mutation)
+            for mutation in mutations[1::2]:
+                InheritedMutation(mutation=mutation)
+            p = Protein(
+                refseq=f'NM_000{i}', sequence='A' * 40, mutations=mutations,
+                sites=[
+                    Site(position=10, types={phosphorylation}),
+                    Site(position=3 * i + 1, types={acetylation, phosphorylation})
+                ]
+            )
+            db.session.add(Gene(name=name, isoforms=[p], preferred_isoform=p))
+        db.session.commit()
+
+        queries = [
+            '',
+            '?filters=Mutation.sources:in:MC3',
+            '?filters=Site.types:in:acetylation',
+            '?filters=Mutation.sources:in:MC3;Site.types:in:phosphorylation;Gene.has_ptm_muts:eq:True',
+            '?filters=Mutation.sources:in:ClinVar',
+        ]
+
+        def get_rows():
+            return [
+                self.client.get('/gene/browse_data/' + query).json['rows']
+                for query in queries
+            ]
+
+        live_rows = get_rows()
+        assert any(row['muts_cnt'] for rows in live_rows for row in rows)
+
+        assert refresh_protein_summaries() == ProteinSummary.query.count() != 0
+        db.session.commit()
+
+        assert get_rows() == live_rows
@@ -150,6 +150,35 @@ class TestNetworkView(ViewTest):
         response = self.client.get('/network/data/NM_0007')
         assert response.json['content']['network'] == representation
 
+    def test_kinases_mutations_counts(self):
+        create_network()
+
+        site = Site.query.filter_by(position=1).one()
+        cancer = Cancer.query.one()
+
+        # kinases with 0, 1 and 3 mutations; all of them have MC3 details but the last one
+        for i, mutations_count in enumerate([0, 1, 3]):
+            kinase = create_test_kinase(f'Kinase {i}', f'NM_01{i}')
+            kinase.protein.mutations = [
+                Mutation(position=position, alt='A', meta_MC3=[MC3Mutation(cancer=cancer)])
+                for position in range(1, mutations_count + 1)
+            ]
+            site.kinases.add(kinase)
+        kinase.protein.mutations.append(Mutation(position=10, alt='A'))
+        db.session.commit()
+
+        def get_counts(query=''):
+            response = self.client.get('/network/representation/NM_0007' + query)
+            assert response.status_code == 200
+            return {
+                kinase['name']: kinase['protein']['mutations_count']
+                for kinase in response.json['network']['kinases']
+            }
+
+        assert get_counts('?filters=Mutation.sources:in:MC3') == {
+            'Kinase Y': 1, 'Kinase 0': 0, 'Kinase 1': 1, 'Kinase 2': 3
+        }
+
     def test_predicted_representation(self):
         create_network()
 
@@ -1,4 +1,11 @@
+import gzip
+import json
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
 from view_testing import ViewTest, relative_location
+from helpers import cache
+from helpers.cache import Cache, TieredCache, bump_data_version
 from models import Protein, SiteType
 from models import Site
 from database import db
@@ -85,3 +92,89 @@ class TestProteinView(ViewTest):
         response = self.client.get('/protein/known_mutations/NM_000123')
         muts = response.json
         assert len(muts) == 4
+
+    def use_temporary_caches(self):
+        """Store the data version and cached responses in a directory of this test only
+
+        (the default ones are shared by all processes, including other test workers)
+        """
+        from website.views import _commons
+
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        version_store = Cache('.data_version', cache_root=directory.name, purgeable=False)
+        response_cache = TieredCache(
+            '.response_cache', memory_limit=2 ** 20, disk_limit=2 ** 20,
+            sizeof=lambda cached: len(cached.body), cache_root=directory.name, purgeable=False
+        )
+        self.addCleanup(version_store.close)
+        self.addCleanup(response_cache.disk.close)
+
+        for patcher in [
+            patch.object(cache, 'data_version_store', version_store),
+            patch.object(_commons, '_response_cache', response_cache)
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_responses(self):
+
+        self.use_temporary_caches()
+        self.app.config['RESPONSE_CACHE_ENABLED'] = True
+
+        p = Protein(**test_protein_data())
+        p.mutations = create_test_mutations()
+        db.session.add(p)
+        db.session.commit()
+
+        url = '/protein/known_mutations/NM_000123'
+
+        response = self.client.get(url)
+        assert response.status_code == 200
+        assert len(response.json) == 4
+        etag = response.headers['ETag']
+
+        # compressed body is served to clients which accept it
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(response.data)) == self.client.get(url).json
+
+        # unchanged payloads are not sent again
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        # the cache is not invalidated until the data version changes
+        p.mutations = p.mutations[:1]
+        db.session.commit()
+        assert len(self.client.get(url).json) == 4
+
+        bump_data_version()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert len(response.json) == 1
+
+        # differently ordered filters share the cache entry (hence the same ETag)
+        filters = [
+            'Mutation.sources:in:MC3;Mutation.is_ptm:eq:True',
+            'Mutation.is_ptm:eq:True;Mutation.sources:in:MC3',
+        ]
+        etags = {
+            self.client.get(url + '?filters=' + query).headers['ETag']
+            for query in filters
+        }
+        assert len(etags) == 1
+
+        # messages flashed by the view are flashed again when the cached response is served
+        def get_flashes(query):
+            with self.client.session_transaction() as session:
+                session['_flashes'] = []
+            response = self.client.get(url + '?filters=' + query)
+            assert response.status_code == 200
+            with self.client.session_transaction() as session:
+                return session.get('_flashes', [])
+
+        rejected = 'Mutation.sources:in:1KGenomes;Mutation.populations_1KG:in:African,Nowhere'
+        flashes = get_flashes(rejected)
+        assert any('Nowhere' in message for category, message in flashes)
+        assert get_flashes(rejected) == flashes
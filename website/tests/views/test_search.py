@@ -1,3 +1,4 @@
+import gzip
 import re
 from io import BytesIO
 from time import sleep
@@ -69,6 +70,87 @@ class TestSearchView(ViewTest):
         task_recreated = SearchTask.from_serialized(**serialized)
         assert isinstance(task_recreated.filter_manager, SearchViewFilters)
 
+    def test_split_search(self):
+        from search.task import SearchTask, save_upload, remove_upload
+        from search.mutation import MutationSearch
+        from search.filters import SearchViewFilters
+        from database import bdb
+
+        # by default only mutations affecting PTM sites are shown
+        methylation = SiteType(name='methylation')
+        sites = [Site(position=position, types={methylation}) for position in (12, 13)]
+        p = Protein(refseq='NM_007', id=7, sites=sites, sequence='XXXXXXXXXXXXV')
+        db.session.add(p)
+        bdb.add_genomic_mut('20', 14370, 'G', 'A', Mutation(protein=p, position=13, alt='V'), is_ptm=True)
+        bdb.add_genomic_mut('20', 17330, 'T', 'A', Mutation(protein=p, position=12, alt='V'), is_ptm=True)
+
+        vcf = VCF_FILE_CONTENT.decode().splitlines(keepends=True)
+        query = 'chr20 14370 G A\nchr20 17330 T A\nbadly formatted line\nchr20 14370 G A\nchr20 1 G A\n'
+
+        # uploads are saved decompressed, to be read by the workers
+        path = save_upload(BytesIO(gzip.compress(VCF_FILE_CONTENT)))
+        self.addCleanup(remove_upload, path)
+        with open(path, 'rb') as saved:
+            assert saved.read() == VCF_FILE_CONTENT
+
+        filters = SearchViewFilters()
+        task = SearchTask(path, query, filters)
+        whole = MutationSearch(vcf, query, filters)
+
+        chunks = task.split(chunk_size=2)
+        assert len(chunks) == 15
+
+        # chunks of the upload refer to ranges of the saved file (rather than carry the lines)
+        from search.task import UploadedRange
+        ranges = [chunk.vcf_file for chunk in chunks if chunk.vcf_file]
+        assert all(isinstance(chunk_range, UploadedRange) for chunk_range in ranges)
+        assert b''.join(chunk_range.read() for chunk_range in ranges) == VCF_FILE_CONTENT
+        serialized = SearchTask.from_serialized(**chunks[0].serialize())
+        assert serialized.vcf_file == ranges[0]
+
+        merged, *other_searches = [chunk.search() for chunk in chunks]
+        for other_search in other_searches:
+            merged.merge(other_search)
+
+        assert merged.query == whole.query
+        assert merged.badly_formatted == whole.badly_formatted
+        assert merged.without_mutations == whole.without_mutations
+        assert merged.results.keys() == whole.results.keys()
+
+        counts = {line: [r.meta_user.count for r in results] for line, results in merged.results.items()}
+        assert counts == {line: [r.meta_user.count for r in results] for line, results in whole.results.items()}
+        # a line repeated in two different chunks
+        assert counts['chr20 14370 G A'] == [2]
+
+        # merging in the columnar form (as done by the celery tasks) gives the same results
+        from search.dataset import search_to_columns, merge_columns, search_from_columns
+
+        merged_columns = merge_columns(
+            search_to_columns(chunk.search())
+            for chunk in chunks
+        )
+        rehydrated = search_from_columns(merged_columns)
+
+        assert rehydrated.query == whole.query
+        assert rehydrated.without_mutations == whole.without_mutations
+        assert rehydrated.results.keys() == whole.results.keys()
+        assert counts == {line: [r.meta_user.count for r in results] for line, results in rehydrated.results.items()}
+        assert {
+            refseq: {key: result.meta_user.query for key, result in results.items()}
+            for refseq, results in rehydrated.results_by_refseq.items()
+        } == {
+            refseq: {key: result.meta_user.query for key, result in results.items()}
+            for refseq, results in whole.results_by_refseq.items()
+        }
+
+        assert {
+            refseq: {key: result.meta_user.query for key, result in results.items()}
+            for refseq, results in merged.results_by_refseq.items()
+        } == {
+            refseq: {key: result.meta_user.query for key, result in results.items()}
+            for refseq, results in whole.results_by_refseq.items()
+        }
+
     def view_module(self):
         from website.views import search
         return search
@@ -196,6 +278,18 @@ class TestSearchView(ViewTest):
         assert response.status_code == 200
         assert b'NM_007' in response.data
 
+        # compressed VCF files should be accepted too
+        response = self.client.post(
+            '/search/mutations/',
+            content_type='multipart/form-data',
+            data={
+                'vcf-file': (BytesIO(gzip.compress(VCF_FILE_CONTENT)), 'exemplar_vcf.vcf.gz')
+            }
+        )
+
+        assert response.status_code == 200
+        assert b'NM_007' in response.data
+
     def test_autocomplete_all_proteins(self):
         # MC3 GeneList is required as a target (a href for links) where users will be pointed
         # after clicking of cancer autocomplete suggestion
@@ -350,7 +444,7 @@ class TestSearchView(ViewTest):
 
         # let's add a mutation
         m = Mutation(protein=p, position=1, alt='Y')
-        bdb_refseq['BR X1Y'] = ['NM_007']
+        bdb_refseq['BR X1Y'] = [p.id]
         # note: sig_code is required here
         data = ClinicalData(disease=diseases['Cystic fibrosis'], sig_code=1)
         disease_mutation = InheritedMutation(mutation=m, clin_data=[data])
@@ -503,3 +597,67 @@ class TestSearchView(ViewTest):
         self.login('other_user@domain.org', 'password', create=True)
         response = self.client.get(f'search/remove_saved/{dataset.uri}', follow_redirects=True)
         assert response.status_code == 401
+
+
+class TestIndexedSearchView(TestSearchView):
+    """Repeat the search tests using the in-memory search index instead of LIKE queries."""
+
+    SEARCH_INDEX_ENABLED = True
+
+    def test_best_matches_are_chosen_from_index(self):
+        from views.search import search_proteins
+
+        db.session.add_all([
+            Gene(name=name, preferred_isoform=Protein(refseq=f'NM_{i}'))
+            for i, name in enumerate(['TPKKK', 'TPKK', 'TP', 'TPK'])
+        ])
+        db.session.commit()
+
+        # the genes returned under the limit are not arbitrary, but the closest ones
+        results = search_proteins('TPK', 2, features=['gene_symbol'])
+        assert [result.name for result in results] == ['TPK', 'TPKK']
+
+        # the index is refreshed after modifications
+        db.session.add(Gene(name='TPKA', preferred_isoform=Protein(refseq='NM_5')))
+        db.session.commit()
+        assert len(search_proteins('TPK', features=['gene_symbol'])) == 4
+
+    def test_index_invalidation(self):
+        from search.index import search_index
+
+        gene = Gene(name='TPK', preferred_isoform=Protein(refseq='NM_1'))
+        db.session.add(gene)
+        db.session.commit()
+
+        index = search_index['gene_symbol']
+        assert index.payloads
+
+        # modifications of attributes which are not indexed (here: a backref) keep the indices
+        db.session.add(Mutation(protein=gene.preferred_isoform, position=1, alt='A'))
+        db.session.commit()
+        assert search_index['gene_symbol'] is index
+
+        gene.name = 'TPKB'
+        db.session.commit()
+        assert search_index['gene_symbol'] is not index
+
+
+def test_text_index():
+    from search.index import TextIndex
+
+    index = TextIndex(
+        [('Cystic fibrosis', 1), ('Polycystic kidney disease 2', 2), ('Cataract', 3), (None, 4)],
+        substring=True
+    )
+    assert len(index) == 3
+
+    def payloads(positions):
+        return [index.payloads[position] for position in positions]
+
+    assert payloads(index.prefix('c')) == [3, 1]
+    assert payloads(index.prefix('CYSTIC F')) == [1]
+    assert not index.prefix('x')
+
+    assert payloads(index.substring('cystic')) == [1, 2]
+    assert payloads(index.substring('ys')) == [1, 2]
+    assert not payloads(index.substring('cystic d'))
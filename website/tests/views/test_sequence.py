@@ -1,5 +1,5 @@
 from view_testing import ViewTest
-from models import Protein, Disease, MIMPMutation, Kinase
+from models import Protein, Disease, MIMPMutation, Kinase, Site, SiteType
 from models import Gene
 from models import Mutation
 from models import Cancer
@@ -191,3 +191,58 @@ class TestSequenceView(ViewTest):
 
         response = self.client.get(uri + '?filters=Mutation.sources:in:ESP6500;Mutation.populations_ESP6500:in:European American')
         assert response.json['muts_count'] == 1
+
+    def test_needles_queries_count(self):
+        from unittest.mock import patch
+        from sqlalchemy import event
+        from website.views.sequence import SequenceRepresentation
+
+        cancer = Cancer(name='Breast invasive carcinoma', code='BRCA')
+        kinase = Kinase(name='AKT1')
+
+        def create_protein(i, mutations_count):
+            sites = [
+                Site(position=position, types={SiteType(name=f'type_{i}_{position}')}, kinases={kinase})
+                for position in range(5, 40, 10)
+            ]
+            p = Protein(refseq=f'NM_00{i}', sequence='A' * 50, gene=Gene(name=f'Gene{i}'), sites=sites)
+            db.session.add(p)
+            for j in range(mutations_count):
+                m = Mutation(protein=p, position=j + 1, alt='V')
+                MC3Mutation(mutation=m, cancer=cancer, count=j + 1)
+                MIMPMutation(mutation=m, site=sites[0], probability=0.5, effect='gain', pwm='AKT1')
+
+        create_protein(1, 2)
+        create_protein(2, 12)
+        db.session.commit()
+
+        from website.views.filters import cached_queries
+        cached_queries.reload()
+
+        queries = []
+        counts = []
+        engine = db.get_engine(self.app, 'bio')
+        represent_needles = SequenceRepresentation.represent_needles
+
+        def count_query(*args):
+            queries.append(args)
+
+        def counting_represent_needles(representation):
+            queries.clear()
+            event.listen(engine, 'before_cursor_execute', count_query)
+            try:
+                needles = represent_needles(representation)
+            finally:
+                event.remove(engine, 'before_cursor_execute', count_query)
+            counts.append((len(needles), len(queries)))
+            return needles
+
+        with patch.object(SequenceRepresentation, 'represent_needles', counting_represent_needles):
+            for i in [1, 2]:
+                db.session.expire_all()
+                response = self.client.get(f'/sequence/representation_data/NM_00{i}')
+                assert response.status_code == 200
+
+        assert [needles_count for needles_count, queries_count in counts] == [2, 12]
+        # the number of queries does not depend on the number of mutations
+        assert counts[0][1] == counts[1][1]
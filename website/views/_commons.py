@@ -1,13 +1,109 @@
 import gzip
 from collections import defaultdict
-from typing import Dict, Set
+from functools import wraps
+from hashlib import sha1
+from typing import Dict, Set, Iterable, List, NamedTuple
 
-from flask import request, Response
+from flask import request, Response, current_app, flash, session
+from flask_login import current_user
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE
 
-from models import Gene
+from helpers.cache import TieredCache, data_version
+from helpers.parsers import chunked_list
+from models import Gene, Mutation, Protein, Site, SiteType, Kinase, source_manager
 from models.bio.drug import Drug, DrugTarget
 
 
+def details_loaders(relationship):
+    """Loader options eagerly loading mutation details of given relationship,
+
+    together with objects which are referenced by the details (and used to
+    represent them), e.g. cancer of MC3 mutation or disease of ClinVar data.
+    """
+    loader = selectinload(relationship)
+    loaders = [loader]
+    details_model = relationship.property.mapper
+
+    for details_relationship in details_model.relationships:
+        if details_relationship.mapper.class_ is Mutation:
+            continue
+        nested_loader = loader.selectinload(getattr(details_model.class_, details_relationship.key))
+        loaders.append(nested_loader)
+
+        # only follow many-to-one relationships further
+        target = details_relationship.mapper
+        for target_relationship in target.relationships:
+            if target_relationship.direction is MANYTOONE and target_relationship.mapper.class_ is not Mutation:
+                loaders.append(nested_loader.joinedload(getattr(target.class_, target_relationship.key)))
+
+    return loaders
+
+
+def preload_needles_data(mutations: Iterable[Mutation], chunk_size=5000):
+    """Load all data required by represent_mutation (and needle representations
+    built upon it) for given mutations in a fixed number of queries per chunk,
+    instead of lazy loading it separately for every mutation.
+
+    Preloaded are: proteins and genes, sites of the proteins (with types, motifs
+    and kinases), mutation details from all sources (including MIMP predictions)
+    and precomputed affected motifs.
+    """
+    mutations = list(mutations)
+    # already loaded mutations are updated in place (only unloaded attributes are populated)
+    _load_needles_mutations([mutation.id for mutation in mutations], chunk_size)
+    _preload_needles_sites(mutations, chunk_size)
+    return mutations
+
+
+def load_needles_data(mutation_ids: Iterable[int], chunk_size=5000) -> List[Mutation]:
+    """Load mutations with given identifiers together with the data required
+    by represent_mutation, as `preload_needles_data` does for loaded mutations."""
+    mutations = _load_needles_mutations(mutation_ids, chunk_size)
+    _preload_needles_sites(mutations, chunk_size)
+    return mutations
+
+
+def _load_needles_mutations(mutation_ids: Iterable[int], chunk_size) -> List[Mutation]:
+    mutation_options = [
+        joinedload(Mutation.protein).joinedload(Protein.gene),
+        selectinload(Mutation.precomputed_affected_motifs)
+    ]
+    for relationship in source_manager.class_relation_map.values():
+        mutation_options.extend(details_loaders(relationship))
+
+    mutations = []
+    for chunk in chunked_list(list(mutation_ids), chunk_size, progress=False):
+        mutations.extend(Mutation.query.filter(Mutation.id.in_(chunk)).options(*mutation_options))
+    return mutations
+
+
+def _preload_needles_sites(mutations: List[Mutation], chunk_size):
+    proteins = {mutation.protein for mutation in mutations if mutation.protein}
+
+    for chunk in chunked_list([protein.id for protein in proteins], chunk_size, progress=False):
+        (
+            Site.query
+            .filter(Site.protein_id.in_(chunk))
+            .options(
+                selectinload(Site.types).selectinload(SiteType.motifs),
+                selectinload(Site.kinases).joinedload(Kinase.protein).joinedload(Protein.gene),
+                selectinload(Site.kinase_groups)
+            )
+            .all()
+        )
+
+    for mutation in mutations:
+        if mutation.protein and 'affected_sites' in inspect(mutation).unloaded:
+            # the same sites as the relationship would load, but without a query per mutation
+            set_committed_value(
+                mutation, 'affected_sites',
+                mutation.protein.site_index.affected_sites(mutation.position)
+            )
+
+
 def represent_mutation(mutation, data_filter, representation_type=dict):
 
     affected_sites = mutation.get_affected_ptm_sites(data_filter)
@@ -52,3 +148,95 @@ def compress(response: Response, level=7) -> Response:
         response.headers['Content-length'] = len(data)
         response.headers['Content-Encoding'] = 'gzip'
     return response
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    mimetype: str
+    # gzip-compressed body
+    body: bytes
+    # (category, message) pairs flashed when the response was created
+    flashes: tuple = ()
+
+
+_response_cache = None
+
+
+def get_response_cache() -> TieredCache:
+    global _response_cache
+    if not _response_cache:
+        config = current_app.config
+        _response_cache = TieredCache(
+            '.response_cache',
+            memory_limit=config.get('RESPONSE_CACHE_MEMORY_LIMIT', 256 * 1024 * 1024),
+            disk_limit=config.get('RESPONSE_CACHE_DISK_LIMIT', 4 * 1024 * 1024 * 1024),
+            sizeof=lambda cached: len(cached.body)
+        )
+    return _response_cache
+
+
+def serve_cached(cached: CachedResponse) -> Response:
+    if 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+        response = Response(cached.body, mimetype=cached.mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(cached.body), mimetype=cached.mimetype)
+    response.vary.add('Accept-Encoding')
+    # weak, as the same tag is used for the compressed and the plain body
+    response.set_etag(cached.etag, weak=True)
+    return response.make_conditional(request)
+
+
+def cached_response(view):
+    """Serve responses of given view method from the response cache.
+
+    Responses are keyed by the endpoint, the view arguments, the state of filters
+    and the data version (bumped after imports). Bodies are stored compressed and
+    served with an ETag, so revalidation of an unchanged payload yields 304.
+
+    Messages flashed by the view (e.g. warnings about rejected filter values)
+    are stored along and flashed again whenever the response is served.
+
+    Requests of users having their own datasets bypass the cache, as such
+    responses include user-specific data.
+    """
+
+    # flask-classful drills through closures to find the signature of
+    # the view (used to build the route), thus no explicit 'self' here
+    @wraps(view)
+    def cached_view(*args, **kwargs):
+        if not current_app.config.get('RESPONSE_CACHE_ENABLED', False) or current_user.datasets:
+            return compress(view(*args, **kwargs))
+
+        self, *args = args
+
+        key = (
+            request.endpoint,
+            tuple(args),
+            tuple(sorted(kwargs.items())),
+            self.filter_manager.canonical_url_string(),
+            data_version()
+        )
+        cache = get_response_cache()
+        cached = cache.get(key)
+
+        if cached is None:
+            flashed_before = len(session.get('_flashes', []))
+            response = view(self, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.get_data()
+            cached = CachedResponse(
+                etag=sha1(data).hexdigest(),
+                mimetype=response.mimetype,
+                body=gzip.compress(data, 9),
+                flashes=tuple(session.get('_flashes', [])[flashed_before:])
+            )
+            cache.set(key, cached)
+        else:
+            for category, message in cached.flashes:
+                flash(message, category)
+
+        return serve_cached(cached)
+
+    return cached_view
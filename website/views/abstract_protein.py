@@ -1,11 +1,13 @@
+from collections import Counter
 from itertools import chain
+from typing import Dict, Iterable
 from warnings import warn
 
 import flask
 from flask import request, flash
 from flask_classful import FlaskView
 from flask_login import current_user
-from sqlalchemy import and_
+from sqlalchemy import and_, func
 
 from helpers.filters.manager import FilterManager
 from models import Protein, Mutation, UsersMutationsDataset
@@ -93,22 +95,26 @@ class AbstractProteinView(FlaskView):
         return protein, filter_manager
 
 
-def get_raw_mutations(protein, filter_manager, count=False):
+def custom_dataset_filters(filter_manager) -> list:
+    """Limit mutations to the user's dataset, if one was chosen in filters"""
 
     custom_dataset = filter_manager.get_value('UserMutations.sources')
 
-    mutation_filters = [Mutation.protein == protein]
+    if not custom_dataset:
+        return []
 
-    if custom_dataset:
-        dataset = UsersMutationsDataset.query.filter_by(
-            uri=custom_dataset
-        ).one()
+    dataset = UsersMutationsDataset.query.filter_by(
+        uri=custom_dataset
+    ).one()
 
-        filter_manager.filters['Mutation.sources']._value = 'user'
+    filter_manager.filters['Mutation.sources']._value = 'user'
 
-        mutation_filters.append(
-            Mutation.id.in_([m.id for m in dataset.mutations])
-        )
+    return [Mutation.id.in_(dataset.mutation_ids)]
+
+
+def get_raw_mutations(protein, filter_manager, count=False):
+
+    mutation_filters = [Mutation.protein == protein, *custom_dataset_filters(filter_manager)]
 
     getter = filter_manager.query_count if count else filter_manager.query_all
 
@@ -120,6 +126,39 @@ def get_raw_mutations(protein, filter_manager, count=False):
     return raw_mutations
 
 
+def count_raw_mutations(proteins: Iterable[Protein], filter_manager) -> Dict[Protein, int]:
+    """Count mutations of each of proteins, as get_raw_mutations(count=True) does, but in one query."""
+
+    proteins_by_id = {protein.id: protein for protein in proteins}
+
+    if not proteins_by_id:
+        return {}
+
+    mutation_filters = [Mutation.protein_id.in_(proteins_by_id), *custom_dataset_filters(filter_manager)]
+
+    query, to_apply_manually = filter_manager.build_query(
+        Mutation,
+        lambda q: and_(q, and_(*mutation_filters))
+    )
+
+    if to_apply_manually:
+        counts = Counter(
+            mutation.protein_id
+            for mutation in filter_manager.apply(query, to_apply_manually)
+        )
+    else:
+        counts = dict(
+            query
+            .with_entities(Mutation.protein_id, func.count(Mutation.id))
+            .group_by(Mutation.protein_id)
+        )
+
+    return {
+        protein: counts.get(protein_id, 0)
+        for protein_id, protein in proteins_by_id.items()
+    }
+
+
 class ProteinRepresentation:
 
     def __init__(self, protein, filter_manager, include_kinases_from_groups=False):
@@ -1,17 +1,18 @@
-from flask import request
+from flask import request, abort
 from flask_classful import FlaskView
 from flask import jsonify
 
 from database import bdb
+from genomic_mappings import chromosome_codes
 from models import source_manager
 from helpers.filters.manager import FilterManager
 from .filters import common_filters
-from ._commons import represent_mutation
+from ._commons import represent_mutation, preload_needles_data, load_needles_data
 from operator import attrgetter
 from collections import OrderedDict
 
 
-def represent_mutations(mutations, filter_manager):
+def represent_mutations(mutations, filter_manager, preload=True):
 
     source_name = filter_manager.get_value('Mutation.sources')
 
@@ -24,6 +25,9 @@ def represent_mutations(mutations, filter_manager):
 
     response = []
 
+    if preload:
+        mutations = preload_needles_data(mutations)
+
     for mutation in mutations:
 
         needle = represent_mutation(
@@ -79,6 +83,10 @@ def represent_mutations(mutations, filter_manager):
 
 class ChromosomeView(FlaskView):
 
+    # the longest genomic window (in nucleotides) to be queried at once;
+    # needles of all mutations in the window are built within one request
+    max_region_length = 50000
+
     @staticmethod
     def _make_filters():
         filters = common_filters(None, default_source=None, source_nullable=False)
@@ -107,3 +115,55 @@ class ChromosomeView(FlaskView):
         )
 
         return jsonify(parsed_mutations)
+
+    def region(self, chrom, start, end):
+        """Rest API endpoint: mutations mapped to genomic positions from <start, end> window.
+
+        Each mutation is extended with its genomic coordinates
+        (mutations reached from more than one genomic mutation
+        are listed once for each of these).
+        Only mutations known to the database are listed.
+        Stop codon mutations are not considered."""
+
+        _, filter_manager = self._make_filters()
+
+        if chrom.startswith('chr'):
+            chrom = chrom[3:]
+
+        try:
+            start, end = int(start), int(end)
+        except ValueError:
+            abort(400)
+
+        if chrom not in chromosome_codes or start < 0 or not 0 <= end - start < self.max_region_length:
+            abort(400)
+
+        response = []
+
+        ids_by_snv = bdb.get_region_mutation_ids(chrom, start, end)
+
+        # load all mutations in the region (with data for needles) at once
+        mutations = {
+            mutation.id: mutation
+            for mutation in load_needles_data({
+                mutation_id
+                for snv, ids in ids_by_snv
+                for mutation_id in ids
+            })
+        }
+
+        mutations_by_snv = [
+            (snv, filter_manager.apply([mutations[mutation_id] for mutation_id in ids]))
+            for snv, ids in ids_by_snv
+        ]
+
+        for (chrom, dna_pos, dna_ref, dna_alt), raw_mutations in mutations_by_snv:
+
+            for needle in represent_mutations(raw_mutations, filter_manager, preload=False):
+                needle['chrom'] = chrom
+                needle['dna_pos'] = dna_pos
+                needle['dna_ref'] = dna_ref
+                needle['dna_alt'] = dna_alt
+                response.append(needle)
+
+        return jsonify(response)
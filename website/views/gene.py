@@ -7,6 +7,7 @@ from flask_classful import route
 from sqlalchemy.sql.elements import TextClause
 
 from models import Protein, Cancer, InheritedMutation, Disease, ClinicalData, source_manager, SiteType, MC3Mutation
+from models import ProteinSummary
 from models import Mutation
 from models import Gene
 from models import Site
@@ -17,6 +18,7 @@ from sqlalchemy import distinct
 from sqlalchemy import case
 from sqlalchemy import literal_column
 from database import db
+from helpers.parsers import chunked_list
 from helpers.views import AjaxTableView
 from helpers.filters.manager import joined_query, FilterManager
 from helpers.filters import Filter
@@ -62,14 +64,139 @@ def chain_filters(filters, conjunction=and_):
     return conjunction(*filters)
 
 
-def prepare_subqueries(sql_filters, required_joins):
+# filters which do not change the counts stored in ProteinSummary
+# (or which are applied to the outer query of the gene listing)
+summarised_filters = {'Mutation.sources', 'Site.types', 'Gene.has_ptm_muts', 'Gene.is_known_kinase'}
+
+
+def summarised_sources():
+    return [None] + [
+        source_name
+        for source_name in source_manager.visible_fields
+        if source_name != 'user'
+    ]
+
+
+def summarised_site_types():
+    return [None] + [
+        site_type
+        for site_type in SiteType.available_types()
+        if len(SiteType.fuzzy_match_ids(site_type)) == 1
+    ]
+
+
+def summary_filters(source, site_type):
+    """Return sql filters and required joins equivalent to given summary key."""
+    sql_filters = []
+    required_joins = []
+    if source:
+        sql_filters.append(sqlalchemy_filter_from_source_name(source))
+        required_joins.append([])
+    if site_type:
+        sql_filters.append(SiteType.fuzzy_filter(site_type))
+        required_joins.append([SiteType])
+    return sql_filters, required_joins
+
+
+def summary_key(filter_manager):
+    """Return (source name, site type id) of ProteinSummary entries with counts
+    matching currently active filters, or None if the filters are not covered.
+    """
+    active = {
+        filter_.id: filter_
+        for filter_ in filter_manager.active_filters()
+    }
+    if not summarised_filters.issuperset(active):
+        return None
+
+    source = active['Mutation.sources'].value if 'Mutation.sources' in active else None
+    if source not in summarised_sources():
+        return None
+
+    site_type_id = None
+    if 'Site.types' in active:
+        matched_types_ids = SiteType.fuzzy_match_ids(active['Site.types'].mapped_value)
+        if len(matched_types_ids) != 1:
+            return None
+        site_type_id = matched_types_ids[0]
+
+    if not db.session.query(ProteinSummary.query.exists()).scalar():
+        return None
+
+    return source, site_type_id
+
+
+def summary_subqueries(source, site_type_id):
+    """Return sub-queries as prepare_subqueries does, reading counts from ProteinSummary."""
+
+    def count(column):
+        query = (
+            db.session.query(column)
+            .filter(
+                ProteinSummary.protein_id == Protein.id,
+                ProteinSummary.source == source,
+                ProteinSummary.site_type_id == site_type_id
+            )
+        )
+        return func.coalesce(query.as_scalar(), 0).label(column.key)
+
+    return (
+        count(ProteinSummary.muts_cnt),
+        count(ProteinSummary.ptm_muts_cnt),
+        count(ProteinSummary.ptm_sites_cnt)
+    )
+
+
+def refresh_protein_summaries():
+    """Recalculate counts stored in ProteinSummary for all covered combinations of filters.
+
+    Returns the number of created summary entries.
+    """
+    ProteinSummary.query.delete()
+
+    count = 0
+
+    for source in summarised_sources():
+        for site_type in summarised_site_types():
+            muts, ptm_muts, sites = prepare_subqueries(*summary_filters(source, site_type))
+            query = (
+                db.session.query(Protein.id, muts, ptm_muts, sites)
+                .having(text('muts_cnt > 0 OR ptm_sites_cnt > 0'))
+                .group_by(Protein.id)
+            )
+            summaries = (
+                {
+                    'protein_id': protein_id,
+                    'source': source,
+                    'site_type_id': site_type.id if site_type else None,
+                    'muts_cnt': muts_cnt,
+                    'ptm_muts_cnt': ptm_muts_cnt,
+                    'ptm_sites_cnt': ptm_sites_cnt
+                }
+                for protein_id, muts_cnt, ptm_muts_cnt, ptm_sites_cnt in query
+            )
+            for chunk in chunked_list(summaries, progress=False):
+                db.session.bulk_insert_mappings(ProteinSummary, chunk)
+                count += len(chunk)
+
+    return count
+
+
+def prepare_subqueries(sql_filters, required_joins, filter_manager=None):
     """Return three sub-queries suitable for use in protein queries which are:
         - mutations count (muts_cnt),
         - PTM mutations count (ptm_muts_cnt),
         - sites count (ptm_sites_cnt)
 
     Returned sub-queries are labelled as shown in parentheses above.
+
+    If filter_manager is given and all its active filters are covered
+    by the precomputed ProteinSummary, the counts are read from there.
     """
+    if filter_manager:
+        key = summary_key(filter_manager)
+        if key:
+            return summary_subqueries(*key)
 
     muts_filtering_models = [Mutation, MC3Mutation, InheritedMutation, ClinicalData, Disease, Cancer]
 
@@ -231,13 +358,14 @@ def make_widgets(filter_manager, include_dataset_specific=False):
 
 def ajax_query(sql_filters, joins):
 
-    muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins)
+    muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins, flask.g.filter_manager)
 
     protein_filters = select_filters(sql_filters, [Protein])
 
     textutal_filters = select_textual_filters(sql_filters)
     query = (
         db.session.query(
+            Gene.id,
             Gene.name,
             Gene.full_name,
             muts,
@@ -255,7 +383,7 @@ def ajax_query(sql_filters, joins):
 
 def ajax_query_count(sql_filters, joins):
 
-    muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins)
+    muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins, flask.g.filter_manager)
     protein_filters = select_filters(sql_filters, [Protein])
     textutal_filters = select_textual_filters(sql_filters)
 
@@ -333,7 +461,7 @@ class GeneView(FlaskView):
         gene_list = GeneList.query.filter_by(name=list_name).first_or_404()
 
         def query_constructor(sql_filters, joins):
-            muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins)
+            muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins, self.filter_manager)
 
             textutal_filters = select_textual_filters(sql_filters)
             textutal_filters.append(text('muts_cnt > 0'))
@@ -359,7 +487,7 @@ class GeneView(FlaskView):
             )
 
         def count_query_constructor(sql_filters, joins):
-            muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins)
+            muts, ptm_muts, sites = prepare_subqueries(sql_filters, joins, self.filter_manager)
 
             textutal_filters = select_textual_filters(sql_filters)
             textutal_filters.append(text('muts_cnt > 0'))
@@ -402,6 +530,7 @@ class GeneView(FlaskView):
             filters_class=GeneViewFilters,
             search_filter=lambda q: Gene.name.like(q + '%'),
             count_query=ajax_query_count,
-            sort='name'
+            sort='name',
+            keyset_columns={'name': (Gene.name, Gene.id)}
         )
     )
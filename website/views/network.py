@@ -6,12 +6,13 @@ from flask import render_template as template
 from flask import request, abort, Response, json
 from flask import url_for
 from flask_login import current_user
+from sqlalchemy.orm import selectinload
 
 from helpers.filters import Filter
 from helpers.widgets import FilterWidget
-from models import Mutation
-from views._commons import drugs_interacting_with_kinases, compress
-from views.abstract_protein import AbstractProteinView, get_raw_mutations, GracefulFilterManager, ProteinRepresentation
+from models import Mutation, KinaseGroup
+from views._commons import drugs_interacting_with_kinases, cached_response, preload_needles_data
+from views.abstract_protein import AbstractProteinView, GracefulFilterManager, ProteinRepresentation, count_raw_mutations
 from .filters import common_filters, ProteinFiltersData
 from .filters import create_widgets
 
@@ -88,18 +89,26 @@ class NetworkRepresentation(ProteinRepresentation):
 
         super().__init__(protein, filter_manager, include_kinases_from_groups)
 
-        sites, kinases, kinase_groups = self.get_sites_and_kinases()
-
-        kinases_counts = dict()
-        for kinase in kinases:
-            if kinase.protein:
+        # load MIMP data, sites, their kinases etc. for all mutations at once
+        preload_needles_data(self.protein_mutations)
 
-                count = get_raw_mutations(kinase.protein, filter_manager, count=True)
+        sites, kinases, kinase_groups = self.get_sites_and_kinases()
 
-                # related discussion: #72
-                kinases_counts[kinase] = count
+        KinaseGroup.query.filter(
+            KinaseGroup.id.in_([group.id for group in kinase_groups])
+        ).options(selectinload(KinaseGroup.kinases)).all()
 
-                # KINASES NOT MAPPED TO PROTEINS ARE NOT SHOWN
+        # related discussion: #72
+        # KINASES NOT MAPPED TO PROTEINS ARE NOT SHOWN
+        mapped_kinases = [kinase for kinase in kinases if kinase.protein]
+        counts_by_protein = count_raw_mutations(
+            {kinase.protein for kinase in mapped_kinases},
+            filter_manager
+        )
+        kinases_counts = {
+            kinase: counts_by_protein[kinase.protein]
+            for kinase in mapped_kinases
+        }
 
         protein_kinases_names = [kinase.name for kinase in kinases]
 
@@ -191,7 +200,21 @@ class NetworkRepresentation(ProteinRepresentation):
 
         site_kinases = self.get_site_kinases(site)
         site_kinase_groups = self.get_site_kinase_groups(site)
-        # TODO: do not iterate over mutations times mimp four times
+
+        mimp_losses = []
+        mimp_losses_family = []
+        mimp_gains = []
+        mimp_gains_family = []
+
+        for mutation in site_mutations:
+            for mimp in mutation.meta_MIMP:
+                if mimp.is_loss:
+                    mimp_losses.append(mimp.pwm)
+                    mimp_losses_family.append(mimp.pwm_family)
+                if mimp.is_gain:
+                    mimp_gains.append(mimp.pwm)
+                    mimp_gains_family.append(mimp.pwm_family)
+
         return {
             'position': site.position,
             'residue': site.residue,
@@ -202,30 +225,10 @@ class NetworkRepresentation(ProteinRepresentation):
             'sequence': site.sequence,
             'mutations_count': len(site_mutations),
             'mutations': mutations,
-            'mimp_losses': [
-                mimp.pwm
-                for mutation in site_mutations
-                for mimp in mutation.meta_MIMP
-                if mimp.is_loss
-            ],
-            'mimp_losses_family': [
-                mimp.pwm_family
-                for mutation in site_mutations
-                for mimp in mutation.meta_MIMP
-                if mimp.is_loss
-            ],
-            'mimp_gains_family': [
-                mimp.pwm_family
-                for mutation in site_mutations
-                for mimp in mutation.meta_MIMP
-                if mimp.is_gain
-            ],
-            'mimp_gains': [
-                mimp.pwm
-                for mutation in site_mutations
-                for mimp in mutation.meta_MIMP
-                if mimp.is_gain
-            ],
+            'mimp_losses': mimp_losses,
+            'mimp_losses_family': mimp_losses_family,
+            'mimp_gains_family': mimp_gains_family,
+            'mimp_gains': mimp_gains,
             'impact': self.most_significant_impact(set(
                 mutation['impact']
                 for mutation in mutations
@@ -425,12 +428,17 @@ class NetworkView(AbstractProteinView):
             headers={'Content-disposition': 'attachment; filename="%s"' % filename}
         )
 
+    @cached_response
     def predicted_representation(self, refseq):
         """Representation (of predicted network) exposed to an API user"""
-        return self.representation(refseq, include_mimp_gain_kinases=True)
+        return self._representation(refseq, include_mimp_gain_kinases=True)
 
-    def representation(self, refseq, include_mimp_gain_kinases=False):
+    @cached_response
+    def representation(self, refseq):
         """Representation (of network) exposed to an API user"""
+        return self._representation(refseq)
+
+    def _representation(self, refseq, include_mimp_gain_kinases=False):
 
         protein, filter_manager = self.get_protein_and_manager(refseq)
 
@@ -440,11 +448,16 @@ class NetworkView(AbstractProteinView):
 
         return jsonify(response)
 
+    @cached_response
     def predicted_data(self, refseq):
-        return compress(self.data(refseq, include_mimp_gain_kinases=True))
+        return self._data(refseq, include_mimp_gain_kinases=True)
 
-    def data(self, refseq, include_mimp_gain_kinases=False):
+    @cached_response
+    def data(self, refseq):
         """Internal endpoint used for network rendering and asynchronous updates"""
+        return self._data(refseq)
+
+    def _data(self, refseq, include_mimp_gain_kinases=False):
 
         protein, filter_manager = self.get_protein_and_manager(refseq)
 
@@ -460,4 +473,4 @@ class NetworkView(AbstractProteinView):
             'filters': ProteinFiltersData(filter_manager, protein).to_json()
         }
 
-        return compress(jsonify(response))
+        return jsonify(response)
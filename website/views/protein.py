@@ -11,6 +11,7 @@ from sqlalchemy import and_
 from helpers.views import AjaxTableView
 from models import Mutation, Site, source_manager
 from models import Protein
+from ._commons import cached_response
 from .abstract_protein import AbstractProteinView, get_raw_mutations
 from .chromosome import represent_mutations
 from .sequence import SequenceViewFilters, prepare_sites
@@ -46,7 +47,8 @@ class ProteinView(AbstractProteinView):
                 .gene_name.remote_attr
                 .like(q + '%')
             ),
-            sort='gene_name'
+            sort='gene_name',
+            keyset_columns={'refseq': (Protein.refseq, Protein.id)}
         )
     )
 
@@ -119,6 +121,7 @@ class ProteinView(AbstractProteinView):
 
         return jsonify(parsed_mutations)
 
+    @cached_response
     def known_mutations(self, refseq):
         """REST API endpoint"""
 
@@ -137,6 +140,7 @@ class ProteinView(AbstractProteinView):
 
         return jsonify(parsed_mutations)
 
+    @cached_response
     def sites(self, refseq):
         """REST API endpoint"""
 
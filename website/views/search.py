@@ -22,6 +22,8 @@ from models import (
     OrderedDict,
     List,
 )
+from helpers.pickle import unpickle_str
+from search.dataset import search_from_columns
 from search.filters import SearchViewFilters
 from search.mutation import MutationSearch
 from models import Gene
@@ -31,11 +33,12 @@ from sqlalchemy import exists, or_, text
 from helpers.filters.manager import quote_if_needed
 from helpers.widgets import FilterWidget
 from search.mutation_result import SearchResult
-from search.task import SearchTask, search_task
+from search.task import SearchTask, save_upload, search_task, search_progress
 from views.gene import prepare_subqueries
 from search.protein_mutations import get_protein_muts
 from database import db, levenshtein_sorted, bdb
 from search.gene import GeneMatch, search_feature_engines
+from search.index import search_index, ranked_matches, fetch_ranked
 
 
 def create_engines(options=None):
@@ -194,15 +197,22 @@ class SearchView(FlaskView):
         if dataset.owner and dataset.owner != current_user:
             current_app.login_manager.unauthorized()
 
+        stored = dataset.stored
+
+        # only one page of results is loaded, the rest is left on disk
+        page = request.args.get('page', 1, type=int)
+
         response = make_response(template(
             'search/dataset.html',
             mutation_types=Mutation.types,
-            results=dataset.data.results,
+            results=stored.page(page - 1),
             widgets=make_widgets(filter_manager),
-            without_mutations=dataset.data.without_mutations,
-            query=dataset.data.query,
-            badly_formatted=dataset.data.badly_formatted,
-            dataset=dataset
+            without_mutations=stored.without_mutations,
+            query=stored.query,
+            badly_formatted=stored.badly_formatted,
+            dataset=dataset,
+            page=page,
+            pages_count=stored.pages_count
         ))
         return response
 
@@ -235,7 +245,7 @@ class SearchView(FlaskView):
         if status == 'SUCCESS':
             progress = 100
         elif status == 'PROGRESS':
-            progress = celery_task.result.get('progress', 0)
+            progress = search_progress(celery_task)
 
         return jsonify({'status': status, 'progress': int(progress * 100)})
 
@@ -245,14 +255,14 @@ class SearchView(FlaskView):
         status = celery_task.status
 
         if status == 'SUCCESS':
-            mutation_search, dataset_uri = celery_task.result
+            columns, dataset_uri = celery_task.result
             if dataset_uri:
                 dataset = UsersMutationsDataset.query.filter_by(uri=dataset_uri).one()
-                dataset.data = mutation_search
+                dataset.data = search_from_columns(unpickle_str(columns))
                 db.session.commit()
             return redirect(url_for('SearchView:mutations', task_id=task_id))
 
-        progress = celery_task.result.get('progress', 0) if status == 'PROGRESS' else 0
+        progress = search_progress(celery_task) if status == 'PROGRESS' else 0
 
         return make_response(template(
             'search/progress.html',
@@ -274,11 +284,7 @@ class SearchView(FlaskView):
             store_on_server = request.form.get('store_on_server', False)
 
             if not use_celery:
-                if vcf_file:
-                    vcf_file = [
-                        line.decode()
-                        for line in vcf_file
-                    ]
+                # the file will be read (and decompressed if needed) incrementally
                 mutation_search = MutationSearch(
                     vcf_file, textarea_query, filter_manager
                 )
@@ -310,8 +316,8 @@ class SearchView(FlaskView):
             if use_celery:
                 mutation_search = search_task.delay(
                     SearchTask(
-                        # vcf_file is not serializable but list of lines is
-                        vcf_file.readlines() if vcf_file else None,
+                        # workers read the saved (decompressed) file, chunk by chunk
+                        save_upload(vcf_file) if vcf_file else None,
                         textarea_query,
                         pickle.dumps(filter_manager),
                         dataset_uri=dataset.uri if store_on_server else None
@@ -328,10 +334,8 @@ class SearchView(FlaskView):
                     'warning'
                 )
                 return redirect(url_for('SearchView:mutations'))
-            mutation_search, dataset_uri = celery_task.result
-
-            from helpers.pickle import unpickle_str
-            mutation_search = unpickle_str(mutation_search)
+            columns, dataset_uri = celery_task.result
+            mutation_search = search_from_columns(unpickle_str(columns))
 
             if dataset_uri:
                 url = url_for(
@@ -485,12 +489,18 @@ class SearchView(FlaskView):
 
 
 def suggest_matching_cancers(query, count=2):
-    cancers = levenshtein_sorted(Cancer.query.filter(
-        or_(
-            Cancer.code.ilike(query + '%'),
-            Cancer.name.ilike('%' + query + '%'),
+    if search_index.enabled:
+        cancers = fetch_ranked(
+            Cancer,
+            ranked_matches(query, prefix=['cancer_code'], substring=['cancer_name'], limit=count)
         )
-    ), Cancer.name, query).limit(count)
+    else:
+        cancers = levenshtein_sorted(Cancer.query.filter(
+            or_(
+                Cancer.code.ilike(query + '%'),
+                Cancer.name.ilike('%' + query + '%'),
+            )
+        ), Cancer.name, query).limit(count)
 
     tcga_list = GeneList.query.filter_by(mutation_source_name=MC3Mutation.name).first()
 
@@ -524,13 +534,19 @@ def suggest_matching_diseases(q, count=3):
         potential_disease = q[:-1]
 
     if potential_disease:
-        disease = (
-            levenshtein_sorted(
-                Disease.query.filter(Disease.name.ilike('%' + potential_disease + '%')),
-                Disease.name,
-                potential_disease
-            )
-        ).first()
+        if search_index.enabled:
+            disease = next(iter(fetch_ranked(
+                Disease,
+                ranked_matches(potential_disease, substring=['disease'], limit=1)
+            )), None)
+        else:
+            disease = (
+                levenshtein_sorted(
+                    Disease.query.filter(Disease.name.ilike('%' + potential_disease + '%')),
+                    Disease.name,
+                    potential_disease
+                )
+            ).first()
         if disease:
             return json_message(
                 f'Do you wish to search for <i>{disease.name}</i> mutations? '
@@ -547,7 +563,14 @@ def suggest_matching_diseases(q, count=3):
             protein_name = 'NM_' + protein_name
 
         disease_like = Disease.name.ilike('%' + disease_name + '%')
-        disease = Disease.query.filter(disease_like).first()
+
+        if search_index.enabled:
+            diseases_ids = ranked_matches(disease_name, substring=['disease'])
+            if len(diseases_ids) <= search_index.max_candidates:
+                disease_like = Disease.id.in_(diseases_ids)
+            disease = bool(diseases_ids)
+        else:
+            disease = Disease.query.filter(disease_like).first()
 
         if disease:
             muts, _, _, = prepare_subqueries(
@@ -602,11 +625,14 @@ def suggest_matching_diseases(q, count=3):
                 for disease_name, disease_id, gene, refseq, muts in query
             ]
 
-    diseases = levenshtein_sorted(Disease.query.filter(
-        or_(
-            Disease.name.ilike('%' + q + '%'),
-        )
-    ), Disease.name, q).limit(count)
+    if search_index.enabled:
+        diseases = fetch_ranked(Disease, ranked_matches(q, substring=['disease'], limit=count))
+    else:
+        diseases = levenshtein_sorted(Disease.query.filter(
+            or_(
+                Disease.name.ilike('%' + q + '%'),
+            )
+        ), Disease.name, q).limit(count)
 
     clinvar_list = GeneList.query.filter_by(mutation_source_name=InheritedMutation.name).first()
 
@@ -640,18 +666,24 @@ def suggest_matching_pathways(query, count=2):
         go = query[3:]
         pathway_filter = Pathway.gene_ontology.like(go + '%')
         column = Pathway.gene_ontology
+        look_up = {'prefix': ['pathway_gene_ontology'], 'phrase': go}
     elif query.startswith('REAC:'):
         reactome = query[5:]
         pathway_filter = Pathway.reactome.like(reactome + '%')
         column = Pathway.reactome
+        look_up = {'prefix': ['pathway_reactome'], 'phrase': reactome}
     else:
         pathway_filter = Pathway.description.like('%' + query + '%')
         column = Pathway.description
+        look_up = {'substring': ['pathway_description'], 'phrase': query}
 
-    pathways = Pathway.query.filter(pathway_filter)
-    pathways = levenshtein_sorted(pathways, column, query)
+    if search_index.enabled:
+        pathways = fetch_ranked(Pathway, ranked_matches(limit=count + 1, **look_up))
+    else:
+        pathways = Pathway.query.filter(pathway_filter)
+        pathways = levenshtein_sorted(pathways, column, query)
 
-    pathways = pathways.limit(count + 1).all()
+        pathways = pathways.limit(count + 1).all()
 
     # show {count} of pathways; if we got {count} + 1 results suggest searching for all
 
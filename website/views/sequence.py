@@ -18,7 +18,7 @@ from helpers.tracks import TrackElement
 from models import Domain, source_manager, SiteType, Site
 from models import Mutation
 from .abstract_protein import AbstractProteinView, GracefulFilterManager, ProteinRepresentation
-from ._commons import represent_mutation, compress
+from ._commons import represent_mutation, cached_response, preload_needles_data
 from .filters import common_filters, ProteinFiltersData
 from .filters import create_widgets
 
@@ -113,7 +113,7 @@ class SequenceRepresentation(ProteinRepresentation):
 
         response = []
 
-        for mutation in self.protein_mutations:
+        for mutation in preload_needles_data(self.protein_mutations):
 
             needle = represent_mutation(mutation, data_filter)
 
@@ -212,6 +212,7 @@ class SequenceView(AbstractProteinView):
         """Show SearchView as default page"""
         return redirect(url_for('SearchView:default', target='proteins'))
 
+    @cached_response
     def representation_data(self, refseq):
 
         protein, filter_manager = self.get_protein_and_manager(refseq)
@@ -235,7 +236,7 @@ class SequenceView(AbstractProteinView):
             'filters': ProteinFiltersData(filter_manager, protein).to_json()
         }
 
-        return compress(jsonify(response))
+        return jsonify(response)
 
     def show(self, refseq):
         """Show a protein by: